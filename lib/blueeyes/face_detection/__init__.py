@@ -1 +1,6 @@
-from .detector import FaceDetector
\ No newline at end of file
+from .detector import FaceDetector
+from .detections import Detections
+from .roi import ROI
+from .filters import FaceFilter
+from .quality import QualityScorer
+from .motion import MotionGate
@@ -0,0 +1,120 @@
+'''
+Columnar face detection result: one array per field instead of one tuple per face.
+Boxes are an int32 (N, 4) array of (x1, y1, x2, y2), scores a float32 (N,) array and
+landmarks an optional float32 (N, 5, 2) array (eyes, nose, mouth corners).
+Filtering, scaling and clipping work on the whole arrays. Iterating still yields
+(x1, y1, x2, y2) tuples, so code written for the old list of boxes keeps working.
+'''
+import numpy as np
+
+from ..utils.pyramid import FramePyramid
+
+def box_iou(boxes1, boxes2):
+    '''(N, M) intersection over union of two arrays of (x1, y1, x2, y2) boxes.'''
+    # reshape so empty lists give (0, 4) instead of (0,)
+    boxes1 = np.asarray(boxes1, dtype=np.float32).reshape(-1, 4)[:, None, :]
+    boxes2 = np.asarray(boxes2, dtype=np.float32).reshape(-1, 4)[None, :, :]
+    w = np.clip(np.minimum(boxes1[..., 2], boxes2[..., 2]) - np.maximum(boxes1[..., 0], boxes2[..., 0]), 0, None)
+    h = np.clip(np.minimum(boxes1[..., 3], boxes2[..., 3]) - np.maximum(boxes1[..., 1], boxes2[..., 1]), 0, None)
+    inter = w * h
+    area1 = (boxes1[..., 2] - boxes1[..., 0]) * (boxes1[..., 3] - boxes1[..., 1])
+    area2 = (boxes2[..., 2] - boxes2[..., 0]) * (boxes2[..., 3] - boxes2[..., 1])
+    return inter / np.maximum(area1 + area2 - inter, 1e-6)
+
+class Detections:
+    def __init__(self, boxes=None, scores=None, landmarks=None, frame=None):
+        '''
+        boxes: (N, 4) array-like, truncated to int32
+        scores: (N,) confidences, 1 for backends without any
+        landmarks: (N, 5, 2) points or None
+        frame: the frame (or FramePyramid) the boxes refer to
+        '''
+        if boxes is None:
+            boxes = np.empty((0, 4), dtype=np.int32)
+        self.boxes = np.asarray(boxes).reshape(-1, 4).astype(np.int32)
+        if scores is None:
+            scores = np.ones(len(self.boxes), dtype=np.float32)
+        self.scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+        self.landmarks = None if landmarks is None else np.asarray(landmarks, dtype=np.float32).reshape(-1, 5, 2)
+        self.frame = frame
+
+    @classmethod
+    def concat(cls, detections, frame=None):
+        detections = list(detections)
+        if not detections:
+            return cls(frame=frame)
+        landmarks = None
+        if all(d.landmarks is not None for d in detections):
+            landmarks = np.concatenate([d.landmarks for d in detections])
+        return cls(np.concatenate([d.boxes for d in detections]),
+                   np.concatenate([d.scores for d in detections]),
+                   landmarks, frame)
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def __iter__(self):
+        return iter([tuple(box) for box in self.boxes.tolist()])
+
+    def __getitem__(self, index):
+        '''An int gives the (x1, y1, x2, y2) tuple of a face; a slice, mask or index array gives a Detections.'''
+        if isinstance(index, (int, np.integer)):
+            return tuple(self.boxes[index].tolist())
+        return Detections(self.boxes[index], self.scores[index],
+                          None if self.landmarks is None else self.landmarks[index], self.frame)
+
+    def __repr__(self):
+        return f'Detections({len(self)} faces, landmarks={self.landmarks is not None})'
+
+    @property
+    def widths(self):
+        return self.boxes[:, 2] - self.boxes[:, 0]
+
+    @property
+    def heights(self):
+        return self.boxes[:, 3] - self.boxes[:, 1]
+
+    @property
+    def areas(self):
+        return self.widths * self.heights
+
+    def scale(self, factor):
+        if factor == 1:
+            return self
+        return Detections(np.round(self.boxes * factor), self.scores,
+                          None if self.landmarks is None else self.landmarks * factor, self.frame)
+
+    def offset(self, x, y):
+        return Detections(self.boxes + (x, y, x, y), self.scores,
+                          None if self.landmarks is None else self.landmarks + (x, y), self.frame)
+
+    def clip(self, width=None, height=None):
+        '''Zero negative coordinates, and clip to (width, height) when given.'''
+        boxes = np.maximum(self.boxes, 0)
+        if width is not None:
+            boxes[:, 0::2] = np.minimum(boxes[:, 0::2], width)
+        if height is not None:
+            boxes[:, 1::2] = np.minimum(boxes[:, 1::2], height)
+        return Detections(boxes, self.scores, self.landmarks, self.frame)
+
+    def in_size_ranges(self, size_ranges):
+        '''Mask of the faces whose size fits one of the (wmin, hmin, wmax, hmax) ranges.'''
+        widths, heights = self.widths, self.heights
+        mask = np.zeros(len(self), dtype=bool)
+        for wmin, hmin, wmax, hmax in size_ranges:
+            mask |= (wmin <= widths) & (widths <= wmax) & (hmin <= heights) & (heights <= hmax)
+        return mask
+
+    def crops(self, target_size=None):
+        '''Face crops from the source frame, see FramePyramid.roi for target_size.'''
+        if isinstance(self.frame, FramePyramid):
+            return [self.frame.roi(box, target_size) for box in self]
+        return [self.frame[y1:y2, x1:x2] for x1, y1, x2, y2 in self]
+
+    def relative_landmarks(self):
+        '''Landmarks as fractions of their box (see recognition.roi_landmarks), one entry per face, None without landmarks.'''
+        if self.landmarks is None:
+            return [None] * len(self)
+        origin = self.boxes[:, None, :2]
+        size = np.maximum(self.boxes[:, None, 2:] - origin, 1)
+        return list((self.landmarks - origin) / size)
@@ -4,29 +4,53 @@ import cv2
 import time
 import logging
 import numpy as np
+from collections import OrderedDict
 
 sys.path.append(os.path.abspath(os.path.join(__file__, os.path.pardir)))
 
-def import_tensorflow():
-    import tensorflow as tf
-    import tensorflow.compat.v1 as tf
-    import tensorflow.keras as keras
-    from tensorflow.compat.v1.keras.backend import set_session
-
-    # set allow_growth for tensorflow
-    oldinit = tf.Session.__init__
-    def new_tfinit(session, target='', graph=None, config=None):
-        print("Set config.gpu_options.allow_growth to True")
-        config = tf.ConfigProto()
-        config.gpu_options.allow_growth = True
-        oldinit(session, target, graph, config)
-    tf.Session.__init__ = new_tfinit
-
-    config = tf.ConfigProto()
-    config.gpu_options.allow_growth = True  # dynamically grow the memory used on the GPU
-    config.log_device_placement = True  # to log device placement (on which device the operation ran)
-    sess = tf.Session(config=config)
-    set_session(sess)
+from .detections import Detections
+from .filters import FaceFilter
+from ..utils.pyramid import FramePyramid
+from ..utils.backend import BackendRegistry, import_tensorflow
+
+# each backend is imported only when a FaceDetector of that type is created
+DETECTORS = BackendRegistry('detector')
+
+@DETECTORS.register('yolo')
+def _load_yolo():
+    from yolo.yolo import YOLO
+    return YOLO
+
+@DETECTORS.register('haar')
+def _load_haar():
+    return cv2.CascadeClassifier
+
+@DETECTORS.register('hog')
+def _load_hog():
+    import face_recognition
+    return face_recognition
+
+@DETECTORS.register('mtcnn')
+def _load_mtcnn():
+    import_tensorflow()
+    from mtcnn import MTCNN
+    return MTCNN
+
+@DETECTORS.register('mtcnn_torch')
+def _load_mtcnn_torch():
+    sys.path.append(os.path.abspath(os.path.join(__file__, os.path.pardir, os.path.pardir, 'face_recognition')))
+    import mtcnn_torch
+    return mtcnn_torch
+
+@DETECTORS.register('facenet_pytorch')
+def _load_facenet_pytorch():
+    from facenet_pytorch import MTCNN
+    return MTCNN
+
+@DETECTORS.register('faceboxes')
+def _load_faceboxes():
+    import faceboxes_package
+    return faceboxes_package
 
 logging.basicConfig(level=logging.DEBUG)
 
@@ -34,68 +58,207 @@ class FaceDetector:
     def __init__(self, type, scale=1, **kwargs):
         self.type = type
         self.scale = scale
+        # roi: ROI (fractions of the frame) the network is restricted to, None for the full frame
+        self.roi = kwargs.pop('roi', None)
+        if kwargs.get('quantize') and kwargs.get('runtime', 'eager') != 'eager':
+            print('Quantization only applies to the eager runtime!')
+            raise NameError
+        backend = DETECTORS.load(self.type)
         if self.type == 'yolo':
-            from yolo.yolo import YOLO
-            self.face_detector = YOLO(img_size=kwargs['model_img_size'])
+            self.face_detector = backend(img_size=kwargs['model_img_size'])
         elif self.type == 'haar':
-            self.face_detector = cv2.CascadeClassifier('cascade_model/cascade_ignore_shirt.xml')
+            self.face_detector = backend('cascade_model/cascade_ignore_shirt.xml')
         elif self.type == 'mtcnn':
-            import_tensorflow()
-            from mtcnn import MTCNN
             kwargs['min_face_size'] //= self.scale
             self.min_face_size = kwargs['min_face_size']
-            self.face_detector = MTCNN(**kwargs)
+            self.face_detector = backend(**kwargs)
         elif self.type == 'mtcnn_torch':
-            import mtcnn_torch as mtcnn
-            pnet, rnet, onet = mtcnn.get_net_caffe('mtcnn_torch/model')
-            self.face_detector = mtcnn.FaceDetector(pnet, rnet, onet, device='cuda:0')
+            import torch
+            mtcnn = backend
+            # quantize: None, 'static' (calibrated on the `calibration` frames) or 'dynamic', int8 runs on CPU
+            self.quantize = kwargs.get('quantize')
+            # runtime: 'eager', or the graphs exported by face_detection/export.py: 'torchscript' or 'onnx' (CPU)
+            self.runtime = kwargs.get('runtime', 'eager')
+            if self.quantize or self.runtime == 'onnx':
+                device = 'cpu'
+            else:
+                device = kwargs.get('device') or ('cuda:0' if torch.cuda.is_available() else 'cpu')
+            self.min_face_size = kwargs.get('min_face_size', 12) // self.scale
+            # packed: one P-Net pass over every pyramid level tiled in a canvas
+            self.packed = kwargs.get('packed', False)
+            if self.runtime == 'eager':
+                # the caffe weights shipped with the package, independent of the working directory
+                pnet, rnet, onet = mtcnn.get_net_caffe(os.path.join(os.path.dirname(os.path.abspath(mtcnn.__file__)), 'deploy', 'models'))
+            else:
+                from .export import RUNTIMES, FORMATS, default_export_path
+                load = RUNTIMES.load(self.runtime)
+                folder = kwargs.get('model_path')
+                pnet, rnet, onet = [load(os.path.join(folder, name + FORMATS[self.runtime]) if folder else
+                                         default_export_path('mtcnn_torch', self.runtime, name), device, 3)
+                                    for name in ('pnet', 'rnet', 'onet')]
+            self.face_detector = mtcnn.FaceDetector(pnet, rnet, onet, device=device)
+            if self.quantize:
+                from .quantization import calibration_frames, quantize_mtcnn
+                frames = []
+                if self.quantize == 'static':
+                    frames = [self._detector_input(frame)[0] for frame in
+                              calibration_frames(kwargs['calibration'], kwargs.get('calibration_size', 100))]
+                pnet, rnet, onet = quantize_mtcnn(self.face_detector, frames, self.quantize,
+                                                  minsize=self.min_face_size, packed=self.packed)
+                self.face_detector = mtcnn.FaceDetector(pnet, rnet, onet, device=device)
+            # shares the networks, used by detect_batch()
+            self.batch_detector = mtcnn.BatchImageDetector(pnet, rnet, onet, device=device)
         elif self.type == 'facenet_pytorch':
-            from facenet_pytorch import MTCNN
-            self.face_detector = MTCNN(image_size=150, select_largest=False, keep_all=True, post_process=False, margin=40, device='cuda')
+            self.face_detector = backend(image_size=150, select_largest=False, keep_all=True, post_process=False, margin=40, device='cuda')
         elif self.type == 'faceboxes':
             import torch
-            import faceboxes_package as fb
+            fb = backend
             torch.set_grad_enabled(False)
+            # device: 'cpu', 'cuda', 'cuda:1', ... defaults to the GPU when there is one
+            # quantize: None, 'static' (calibrated on the `calibration` frames) or 'dynamic', int8 runs on CPU
+            self.quantize = kwargs.get('quantize')
+            # runtime: 'eager', or a graph exported by face_detection/export.py: 'torchscript' or 'onnx' (CPU)
+            self.runtime = kwargs.get('runtime', 'eager')
+            if self.quantize or self.runtime == 'onnx':
+                self.device = torch.device('cpu')
+            else:
+                self.device = torch.device(kwargs.get('device') or ('cuda' if torch.cuda.is_available() else 'cpu'))
+            if kwargs.get('num_threads'):
+                torch.set_num_threads(kwargs['num_threads'])
             # net and model
-            self.net = fb.FaceBoxes(phase='test', size=None, num_classes=2)    # initialize detector
-            weight_path = os.path.abspath(os.path.join(fb.__file__, '../weights/FaceBoxes.pth'))
-            self.net = fb.load_model(self.net, weight_path, False)
-            self.net.eval()
-            print('Finished loading model!')
-            print(self.net)
-            fb.cudnn.benchmark = True
-            self.device = torch.device("cuda")
+            if self.runtime == 'eager':
+                self.net = fb.FaceBoxes(phase='test', size=None, num_classes=2)    # initialize detector
+                weight_path = os.path.abspath(os.path.join(fb.__file__, '../weights/FaceBoxes.pth'))
+                self.net = fb.load_model(self.net, weight_path, self.device.type == 'cpu')
+                self.net.eval()
+                print('Finished loading model!')
+                print(self.net)
+            else:
+                from .export import RUNTIMES, default_export_path
+                model_path = kwargs.get('model_path') or default_export_path('faceboxes', self.runtime)
+                self.net = RUNTIMES.load(self.runtime)(model_path, self.device)
+                print(f'Loaded {self.runtime} model {model_path}')
+            if self.device.type == 'cuda':
+                fb.cudnn.benchmark = True
             self.net = self.net.to(self.device)
             self.threshold = kwargs['threshold']
+            # input_bucket: None, a multiple (e.g. 32) or a fixed (width, height); frames are padded
+            # up to the bucket so a camera only ever needs one set of anchors
+            self.input_bucket = kwargs.get('input_bucket')
+            self.prior_cache_size = kwargs.get('prior_cache_size', 16)
+            self._prior_cache = OrderedDict()
+            if self.quantize:
+                from .quantization import calibration_frames, quantize_model
+                inputs = []
+                if self.quantize == 'static':
+                    inputs = [self._faceboxes_input([self._detector_input(frame)[0]]) for frame in
+                              calibration_frames(kwargs['calibration'], kwargs.get('calibration_size', 100))]
+                self.net = quantize_model(self.net, inputs, self.quantize)
             
-    def detect(self, frame, size_ranges=[], brightness_ranges=[], filter=False):
-        def is_in_size_ranges(box):
-            left, top, right, bottom = box
-            width = right - left
-            height = bottom - top
-            for wmin,hmin,wmax,hmax in size_ranges:
-                if wmin <= width <= wmax and hmin <= height <= hmax:
-                    return 
-            return False
-        def is_in_brightness_ranges(box):
-            left, top, right, bottom = box
-            for brightness_range in brightness_ranges:
-                vmin,vmax = brightness_range 
-                hsv = cv2.cvtColor(frame[top:bottom,left:right,:], cv2.COLOR_BGR2HSV)
-                brightness = cv2.mean(hsv)[2]
-                if vmin <= brightness <= vmax:
-                    return True
-            return False
-        def zero_negative(box):
-            return tuple([b if b > 0 else 0 for b in box])
-
-        frame = cv2.resize(frame, (0,0), fx=1/self.scale, fy=1/self.scale, interpolation=cv2.INTER_LINEAR)
+    def detect(self, frame, size_ranges=[], brightness_ranges=[], filter=False, regions=None, roi=None):
+        '''
+        Detect faces in a frame (or FramePyramid), optionally only inside regions given in full frame
+        coordinates and inside a ROI (defaults to the detector's one).
+        Returns a Detections in full frame coordinates, also kept in self.boxes.
+        '''
+        source = frame
+        frame, frame_scale = self._detector_input(frame)
+        roi = self.roi if roi is None else roi
+        height, width = frame.shape[:2]
+
+        rects = None
+        if regions is not None:
+            rects = [[int(v / frame_scale) for v in region] for region in regions]
+        if roi is not None:
+            rects = roi.restrict(rects if rects is not None else [(0, 0, width, height)], width, height)
+
+        if rects is None:
+            detections = self._detect(frame)
+        else:
+            # only run the network on the given regions and map boxes back
+            found = []
+            for x1, y1, x2, y2 in rects:
+                x1, y1 = max(x1, 0), max(y1, 0)
+                x2, y2 = min(x2, width), min(y2, height)
+                if x2 - x1 < 12 or y2 - y1 < 12:
+                    continue
+                crop = frame[y1:y2, x1:x2] if roi is None else roi.crop(frame, (x1, y1, x2, y2))
+                found.append(self._detect(crop).offset(x1, y1))
+            detections = Detections.concat(found)
+        if roi is not None:
+            detections = detections[roi.contains(detections, width, height)]
+
+        # zero negative value in box
+        detections = detections.clip().scale(frame_scale)
+        detections.frame = source
+
+        if filter:
+            detections = detections[FaceFilter(brightness_ranges, size_ranges=size_ranges)(detections)]
+        self.boxes = detections
+        return self.boxes
+
+    def detect_batch(self, frames, rois=None):
+        '''
+        Detect faces in a list of frames (or FramePyramids), e.g. one per camera, and return
+        one Detections per frame. rois: one ROI (or None) per frame, defaults to the detector's one.
+        Inputs of the same size share a single forward pass.
+        '''
+        if rois is None:
+            rois = [self.roi] * len(frames)
+        if self.type == 'faceboxes':
+            detect = self._faceboxes_detect
+        elif self.type == 'mtcnn_torch':
+            detect = self._mtcnn_torch_detect
+        else:
+            detect = lambda batch: [self._detect(frame) for frame in batch]
+        inputs = []
+        groups = {}
+        results = [Detections(frame=frame) for frame in frames]
+        for i, (frame, roi) in enumerate(zip(frames, rois)):
+            frame, frame_scale = self._detector_input(frame)
+            origin = (0, 0)
+            if roi is not None:
+                # a single crop around every ROI shape, so cameras with the same ROI still share a batch
+                rects = roi.rects(frame.shape[1], frame.shape[0])
+                if not rects:
+                    inputs.append(None)
+                    continue
+                x1, y1 = min(r[0] for r in rects), min(r[1] for r in rects)
+                x2, y2 = max(r[2] for r in rects), max(r[3] for r in rects)
+                origin = (x1, y1)
+                size = (frame.shape[1], frame.shape[0])
+                frame = roi.crop(frame, (x1, y1, x2, y2))
+            else:
+                size = None
+            inputs.append((frame, frame_scale, origin, size))
+            groups.setdefault(frame.shape, []).append(i)
+        for indices in groups.values():
+            batch_detections = detect([inputs[i][0] for i in indices])
+            for i, detections in zip(indices, batch_detections):
+                _, frame_scale, origin, size = inputs[i]
+                detections = detections.offset(*origin)
+                if size is not None:
+                    detections = detections[rois[i].contains(detections, *size)]
+                results[i] = detections.clip().scale(frame_scale)
+                results[i].frame = frames[i]
+        return results
+
+    def _detector_input(self, frame):
+        if isinstance(frame, FramePyramid):
+            # reuse the detector level built once by the capture stage
+            frame_scale = frame.scale('detector') if 'detector' in frame else 1
+            return frame.level(frame_scale), frame_scale
+        frame_scale = self.scale
+        if frame_scale != 1:
+            frame = cv2.resize(frame, (0,0), fx=1/frame_scale, fy=1/frame_scale, interpolation=cv2.INTER_LINEAR)
+        return frame, frame_scale
 
+    def _detect(self, frame):
         if self.type == 'yolo':
             boxes = self.face_detector.detect(frame)
             boxes = [(y1,x1,y2,x2) for x1,y1,x2,y2 in boxes]
         elif self.type == 'hog':
-            import face_recognition
+            face_recognition = DETECTORS.load('hog')
             boxes = face_recognition.face_locations(frame, number_of_times_to_upsample=1)
             # boxes format: css (top, right, bottom, left)
             boxes = [(y1, x1, y2, x2) for x1, y1, x2, y2 in boxes]
@@ -109,10 +272,11 @@ class FaceDetector:
                 boxes.append(face['box'])
             boxes = [(x,y,x+w,y+h) for x,y,w,h in boxes]
         elif self.type == 'mtcnn_torch':
-            boxes = []
-            _boxes, landmarks = detector.detect(img)
-            for box in _boxes:
-                boxes.append(tuple([int(box[i]) for i in range(len(box))]))
+            boxes, landmarks = self.face_detector.detect(frame, minsize=self.min_face_size, packed=self.packed, bgr=True)
+            if len(boxes) == 0:
+                return Detections()
+            # five (x, y) points per face: eyes, nose, mouth corners
+            return Detections(boxes.cpu().numpy(), self.face_detector.scores.cpu().numpy(), landmarks.cpu().numpy())
         elif self.type == 'facenet_pytorch':
             boxes_, probs = self.face_detector.detect(frame)
             boxes = []
@@ -121,70 +285,115 @@ class FaceDetector:
                     box = tuple(map(int, box))
                     boxes.append(box)
         elif self.type == 'faceboxes':
-            import torch
-            import faceboxes_package as fb
-            from faceboxes_package.data.config import cfg
-            from faceboxes_package.config import model_cfg
-
-            # print(cfg)
-            # print(model_cfg)
-
-            img = np.float32(frame)
-            im_height, im_width, _ = img.shape
-            scale = torch.Tensor([img.shape[1], img.shape[0], img.shape[1], img.shape[0]])
-            img -= (104, 117, 123)
-            img = img.transpose(2, 0, 1)
-            img = torch.from_numpy(img).unsqueeze(0)
-            img = img.to(self.device)
-            scale = scale.to(self.device)
-
-            loc, conf = self.net(img)  # forward pass
-            priorbox = fb.PriorBox(cfg, image_size=(im_height, im_width))
-            priors = priorbox.forward()
-            priors = priors.to(self.device)
-            prior_data = priors.data
-            boxes = fb.decode(loc.data.squeeze(0), prior_data, cfg['variance'])
-            ### Importance when resizing
-            # boxes = boxes * scale / resize
-            boxes = boxes * scale
-            boxes = boxes.cpu().numpy()
-            scores = conf.squeeze(0).data.cpu().numpy()[:, 1]
-
-            # ignore low scores
-            inds = np.where(scores > model_cfg['confidence_threshold'])[0]
-            boxes = boxes[inds]
-            scores = scores[inds]
-
-            # keep top-K before NMS
-            order = scores.argsort()[::-1][:model_cfg['top_k']]
-            boxes = boxes[order]
-            scores = scores[order]
-
-            # do NMS
-            dets = np.hstack((boxes, scores[:, np.newaxis])).astype(np.float32, copy=False)
-            #keep = py_cpu_nms(dets, args.nms_threshold)
-            keep = fb.nms(dets, model_cfg['nms_threshold'], force_cpu=False)
-            dets = dets[keep, :]
-
-            # keep top-K faster NMS
-            dets = dets[:model_cfg['keep_top_k'], :]
-            boxes = []
-            for b in dets:
-                if b[4] < self.threshold:
-                    continue
-                b = list(map(int, b))
-                boxes.append(b[0:4])
+            return self._faceboxes_detect([frame])[0]
         ### End method overloading
+        return Detections(boxes)
 
-    
-        # zero negative value in box
-        boxes = list(map(zero_negative, boxes))
-        self.boxes = [tuple(map(lambda v: v*self.scale,box)) for box in boxes]
+    def _faceboxes_detect(self, frames):
+        '''Run FaceBoxes on a list of frames of the same size as one NCHW batch, returns the Detections of each frame.'''
+        import torch
+        import faceboxes_package as fb
+        from faceboxes_package.data.config import cfg
+        from faceboxes_package.config import model_cfg
 
-        if filter:
-            boxes = [box for box in boxes if is_in_size_ranges(box)]
-            boxes = [box for box in boxes if is_in_brightness_ranges(box)]
-        return self.boxes
+        frame_height, frame_width = frames[0].shape[:2]
+        img = self._faceboxes_input(frames)
+        _, _, im_height, im_width = img.shape
+        scale = torch.Tensor([im_width, im_height, im_width, im_height])
+        scale = scale.to(self.device)
+
+        loc, conf = self.net(img)  # forward pass
+        prior_data = self._priors(im_height, im_width)
+        # decode the boxes of every frame at once
+        num_frames, num_priors = loc.shape[:2]
+        boxes = fb.decode(loc.data.reshape(-1, 4), prior_data.repeat(num_frames, 1), cfg['variance'])
+        ### Importance when resizing
+        # boxes = boxes * scale / resize
+        boxes = (boxes * scale).view(num_frames, num_priors, 4)
+        if (im_height, im_width) != (frame_height, frame_width):
+            # drop the padding of the bucket
+            boxes[..., 0::2] = boxes[..., 0::2].clamp(0, frame_width)
+            boxes[..., 1::2] = boxes[..., 1::2].clamp(0, frame_height)
+        scores = conf.data[..., 1]
+
+        # keep top-K of each frame before NMS, then ignore low scores
+        scores, order = scores.topk(min(model_cfg['top_k'], num_priors), dim=1)
+        boxes = boxes.gather(1, order[..., None].expand(-1, -1, 4))
+        labels = torch.arange(num_frames, device=scores.device)[:, None].expand_as(order)
+        valid = scores > model_cfg['confidence_threshold']
+        boxes, scores, labels = boxes[valid], scores[valid], labels[valid]
+
+        # one NMS over the whole batch, the boxes of each frame are offset by its index
+        dets = torch.cat([boxes, scores[:, None]], 1).cpu().numpy().astype(np.float32, copy=False)
+        labels = labels.cpu().numpy()
+        keep = fb.batched_nms(dets, labels, model_cfg['nms_threshold'], force_cpu=self.device.type == 'cpu')
+        dets = dets[keep]
+        boxes, scores, labels = dets[:, :4], dets[:, 4], labels[keep]
+
+        batch_detections = []
+        for i in range(num_frames):
+            # keep is sorted by decreasing score, keep top-K faster NMS
+            inds = np.where(labels == i)[0][:model_cfg['keep_top_k']]
+            inds = inds[scores[inds] >= self.threshold]
+            batch_detections.append(Detections(boxes[inds], scores[inds]))
+        return batch_detections
+
+    def _faceboxes_input(self, frames):
+        '''Normalised NCHW tensor of frames of the same size, padded to the input bucket.'''
+        import torch
+        img = np.stack([self._pad_to_bucket(np.float32(frame)) for frame in frames])
+        img -= (104, 117, 123)
+        img = img.transpose(0, 3, 1, 2)
+        img = torch.from_numpy(img)
+        return img.to(self.device)
+
+    def _mtcnn_torch_detect(self, frames):
+        '''Run the batched MTCNN on a list of frames of the same size, returns the Detections of each frame.'''
+        boxes, landmarks = self.batch_detector.detect(frames, minsize=self.min_face_size, packed=self.packed, bgr=True)
+        if len(boxes) == 0:
+            return [Detections() for _ in frames]
+        boxes = boxes.cpu().numpy()
+        scores = self.batch_detector.scores.cpu().numpy()
+        landmarks = landmarks.cpu().numpy()
+        # the last column is the index of the frame of each box
+        return [Detections(boxes[boxes[:, 4] == i, :4], scores[boxes[:, 4] == i], landmarks[boxes[:, 4] == i])
+                for i in range(len(frames))]
+
+    def _pad_to_bucket(self, img):
+        '''Pad (bottom, right) a float frame up to its input bucket with the mean pixel, which is zero after normalisation.'''
+        if self.input_bucket is None:
+            return img
+        height, width = img.shape[:2]
+        if isinstance(self.input_bucket, int):
+            bucket = self.input_bucket
+            target_height = -(-height // bucket) * bucket
+            target_width = -(-width // bucket) * bucket
+        else:
+            target_width, target_height = self.input_bucket
+            if width > target_width or height > target_height:
+                # larger than the fixed bucket: fall back to the size of the frame
+                target_width, target_height = max(width, target_width), max(height, target_height)
+        if (target_height, target_width) == (height, width):
+            return img
+        padded = np.empty((target_height, target_width, img.shape[2]), dtype=img.dtype)
+        padded[...] = (104, 117, 123)
+        padded[:height, :width] = img
+        return padded
+
+    def _priors(self, im_height, im_width):
+        '''FaceBoxes anchors of an input resolution, generated once and kept on the device (LRU).'''
+        key = (im_height, im_width)
+        priors = self._prior_cache.get(key)
+        if priors is not None:
+            self._prior_cache.move_to_end(key)
+            return priors
+        import faceboxes_package as fb
+        from faceboxes_package.data.config import cfg
+        priors = fb.PriorBox(cfg, image_size=key).forward().to(self.device)
+        self._prior_cache[key] = priors
+        if len(self._prior_cache) > self.prior_cache_size:
+            self._prior_cache.popitem(last=False)
+        return priors
 
     def draw_bounding_box(self, frame, boxes, color):
         for box in boxes:
@@ -0,0 +1,147 @@
+'''
+Export of the torch detectors (FaceBoxes, MTCNN P/R/O-Net) to a frozen TorchScript or ONNX graph,
+and the runtimes FaceDetector(..., runtime='torchscript' | 'onnx') loads them with.
+The exported graphs are called like the eager modules, so the detection code does not change.
+Usage: python -m blueeyes.face_detection.export {faceboxes,mtcnn_torch} [--format onnx] [--output path]
+'''
+import os
+import logging
+import torch
+
+from ..utils.backend import BackendRegistry
+
+logging.basicConfig(level=logging.DEBUG)
+
+FORMATS = {'torchscript': '.pt', 'onnx': '.onnx'}
+# input size of the example traced through each net, P-Net and FaceBoxes take any size
+MTCNN_INPUT_SIZES = {'pnet': (12, 12), 'rnet': (24, 24), 'onet': (48, 48)}
+
+def default_export_path(detector_type, format, net=None):
+    '''Exported FaceBoxes graph next to its weights, MTCNN graphs next to the caffe weights (one per net).'''
+    here = os.path.dirname(os.path.abspath(__file__))
+    if detector_type == 'faceboxes':
+        return os.path.join(here, 'faceboxes_package', 'weights', 'FaceBoxes' + FORMATS[format])
+    return os.path.join(here, os.path.pardir, 'face_recognition', 'mtcnn_torch', 'model', net + FORMATS[format])
+
+class _Outputs(torch.nn.Module):
+    '''Keep the first num_outputs outputs: the MTCNN nets return an empty landmark tensor that ONNX cannot export.'''
+    def __init__(self, net, num_outputs):
+        super(_Outputs, self).__init__()
+        self.net = net
+        self.num_outputs = num_outputs
+
+    def forward(self, x):
+        return self.net(x)[:self.num_outputs]
+
+def export_model(net, example, path, format='torchscript', dynamic_axes=None, output_names=('output',)):
+    net = net.cpu().eval()
+    example = example.cpu()
+    with torch.no_grad():
+        if format == 'torchscript':
+            module = torch.jit.trace(net, example)
+            if hasattr(torch.jit, 'freeze'):
+                # inline the weights as constants (torch >= 1.8)
+                module = torch.jit.freeze(module)
+            module.save(path)
+        elif format == 'onnx':
+            output_names = list(output_names)
+            axes = {'input': dynamic_axes or {0: 'batch'}}
+            axes.update({name: {0: 'batch'} for name in output_names})
+            torch.onnx.export(net, example, path, input_names=['input'], output_names=output_names,
+                              dynamic_axes=axes, opset_version=11)
+        else:
+            print('Export format not found!')
+            raise NameError
+    logging.debug(f'Exported {type(net).__name__} to {path}')
+    return path
+
+def export_faceboxes(net, path=None, format='torchscript', input_size=(540, 960)):
+    '''FaceBoxes with a dynamic batch and input size, input_size (height, width) is only the traced example.'''
+    path = path or default_export_path('faceboxes', format)
+    example = torch.zeros((1, 3) + tuple(input_size))
+    return export_model(net, example, path, format, {0: 'batch', 2: 'height', 3: 'width'}, ('loc', 'conf'))
+
+def export_mtcnn(pnet, rnet, onet, folder=None, format='torchscript'):
+    '''The three MTCNN nets, P-Net with a dynamic input size, R-Net / O-Net with a dynamic batch.'''
+    paths = []
+    for name, net in (('pnet', pnet), ('rnet', rnet), ('onet', onet)):
+        path = os.path.join(folder, name + FORMATS[format]) if folder else default_export_path('mtcnn_torch', format, name)
+        example = torch.zeros((1, 3) + MTCNN_INPUT_SIZES[name])
+        if name == 'onet':
+            output_names = ('prob', 'offset', 'landmarks')
+        else:
+            output_names = ('prob', 'offset')
+            net = _Outputs(net, 2) if format == 'onnx' else net
+        dynamic_axes = {0: 'batch', 2: 'height', 3: 'width'} if name == 'pnet' else {0: 'batch'}
+        paths.append(export_model(net, example, path, format, dynamic_axes, output_names))
+    return paths
+
+# runtimes of the exported graphs: each loader returns load(path, device, num_outputs)
+RUNTIMES = BackendRegistry('runtime')
+
+@RUNTIMES.register('torchscript')
+def _load_torchscript():
+    def load(path, device, num_outputs=None):
+        module = torch.jit.load(path, map_location=device)
+        if torch.device(device).type == 'cpu' and hasattr(torch.jit, 'optimize_for_inference'):
+            # fold conv + batchnorm and pick the MKLDNN kernels (torch >= 1.10)
+            module = torch.jit.optimize_for_inference(module)
+        return module
+    return load
+
+@RUNTIMES.register('onnx')
+def _load_onnxruntime():
+    import onnxruntime
+    return OnnxModule
+
+class OnnxModule:
+    '''An ONNX graph run by ONNX Runtime on CPU (whatever the device), called like the torch module it was exported from.'''
+    def __init__(self, path, device='cpu', num_outputs=None):
+        import onnxruntime
+        if not os.path.exists(path):
+            print(f'Exported model {path} not found!')
+            raise NameError
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # same thread budget as torch (FaceDetector num_threads)
+        options.intra_op_num_threads = torch.get_num_threads()
+        self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        # outputs dropped at export (MTCNN landmarks) are given back as empty tensors
+        self.num_outputs = num_outputs
+
+    def __call__(self, x):
+        outputs = self.session.run(None, {self.input_name: x.detach().cpu().numpy()})
+        outputs = [torch.from_numpy(output) for output in outputs]
+        while self.num_outputs and len(outputs) < self.num_outputs:
+            outputs.append(torch.empty(0))
+        return tuple(outputs)
+
+    def to(self, device):
+        return self
+
+    def eval(self):
+        return self
+
+if __name__ == '__main__':
+    import argparse
+    from .detector import DETECTORS
+
+    parser = argparse.ArgumentParser(description='Export a detector to TorchScript or ONNX')
+    parser.add_argument('detector', choices=['faceboxes', 'mtcnn_torch'])
+    parser.add_argument('--format', choices=list(FORMATS), default='torchscript')
+    parser.add_argument('--output', default=None, help='file (faceboxes) or folder (mtcnn_torch), defaults next to the weights')
+    parser.add_argument('--size', type=int, nargs=2, default=(540, 960), help='example input height width (faceboxes)')
+    args = parser.parse_args()
+
+    backend = DETECTORS.load(args.detector)
+    if args.detector == 'faceboxes':
+        net = backend.FaceBoxes(phase='test', size=None, num_classes=2)
+        weight_path = os.path.abspath(os.path.join(backend.__file__, '../weights/FaceBoxes.pth'))
+        net = backend.load_model(net, weight_path, True)
+        print(export_faceboxes(net, args.output, args.format, args.size))
+    else:
+        # the caffe weights get_net_caffe loads, independent of the working directory
+        model_dir = os.path.join(os.path.dirname(os.path.abspath(backend.__file__)), 'deploy', 'models')
+        pnet, rnet, onet = backend.get_net_caffe(model_dir)
+        print('\n'.join(export_mtcnn(pnet, rnet, onet, args.output, args.format)))
@@ -10,7 +10,7 @@ import torch.backends.cudnn as cudnn
 import numpy as np
 from .data import cfg
 from .layers.functions.prior_box import PriorBox
-from .utils.nms_wrapper import nms
+from .utils.nms_wrapper import nms, batched_nms
 #from utils.nms.py_cpu_nms import py_cpu_nms
 from .models.faceboxes import FaceBoxes
 from .utils.box_utils import decode
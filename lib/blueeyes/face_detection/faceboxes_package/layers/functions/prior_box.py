@@ -14,30 +14,37 @@ class PriorBox(object):
         self.image_size = image_size
         self.feature_maps = [[ceil(self.image_size[0]/step), ceil(self.image_size[1]/step)] for step in self.steps]
 
+    def _cell_anchors(self, k):
+        # (offset_x, offset_y, min_size) of every anchor of a cell, in the order of the original loops
+        cell = []
+        for min_size in self.min_sizes[k]:
+            if min_size == 32:
+                offsets = [0, 0.25, 0.5, 0.75]
+            elif min_size == 64:
+                offsets = [0, 0.5]
+            else:
+                offsets = [0.5]
+            for oy, ox in product(offsets, offsets):
+                cell.append((ox, oy, min_size))
+        return np.array(cell, dtype=np.float32)
+
     def forward(self):
+        height, width = self.image_size
         anchors = []
         for k, f in enumerate(self.feature_maps):
-            min_sizes = self.min_sizes[k]
-            for i, j in product(range(f[0]), range(f[1])):
-                for min_size in min_sizes:
-                    s_kx = min_size / self.image_size[1]
-                    s_ky = min_size / self.image_size[0]
-                    if min_size == 32:
-                        dense_cx = [x*self.steps[k]/self.image_size[1] for x in [j+0, j+0.25, j+0.5, j+0.75]]
-                        dense_cy = [y*self.steps[k]/self.image_size[0] for y in [i+0, i+0.25, i+0.5, i+0.75]]
-                        for cy, cx in product(dense_cy, dense_cx):
-                            anchors += [cx, cy, s_kx, s_ky]
-                    elif min_size == 64:
-                        dense_cx = [x*self.steps[k]/self.image_size[1] for x in [j+0, j+0.5]]
-                        dense_cy = [y*self.steps[k]/self.image_size[0] for y in [i+0, i+0.5]]
-                        for cy, cx in product(dense_cy, dense_cx):
-                            anchors += [cx, cy, s_kx, s_ky]
-                    else:
-                        cx = (j + 0.5) * self.steps[k] / self.image_size[1]
-                        cy = (i + 0.5) * self.steps[k] / self.image_size[0]
-                        anchors += [cx, cy, s_kx, s_ky]
+            step = self.steps[k]
+            cell = self._cell_anchors(k)
+            # (f0, f1, anchors per cell) grids, row-major over the cells like product(range(f0), range(f1))
+            i = np.arange(f[0], dtype=np.float32)[:, None, None]
+            j = np.arange(f[1], dtype=np.float32)[None, :, None]
+            cx = (j + cell[:, 0]) * step / width
+            cy = (i + cell[:, 1]) * step / height
+            cx, cy = np.broadcast_arrays(cx, cy)
+            s_kx = np.broadcast_to(cell[:, 2] / width, cx.shape)
+            s_ky = np.broadcast_to(cell[:, 2] / height, cx.shape)
+            anchors.append(np.stack([cx, cy, s_kx, s_ky], axis=-1).reshape(-1, 4))
         # back to torch land
-        output = torch.Tensor(anchors).view(-1, 4)
+        output = torch.from_numpy(np.concatenate(anchors).astype(np.float32))
         if self.clip:
             output.clamp_(max=1, min=0)
         return output
@@ -5,8 +5,25 @@
 # Written by Ross Girshick
 # --------------------------------------------------------
 
-from .nms.cpu_nms import cpu_nms, cpu_soft_nms
-from .nms.gpu_nms import gpu_nms
+import numpy as np
+
+from .nms.py_cpu_nms import py_cpu_nms
+
+# the compiled extensions are optional: without them (e.g. GPU-less boxes) NMS falls back to NumPy
+try:
+    from .nms.cpu_nms import cpu_nms, cpu_soft_nms
+except ImportError:
+    cpu_nms = None
+try:
+    from .nms.gpu_nms import gpu_nms
+except ImportError:
+    gpu_nms = None
+# prebuilt torchvision kernel, used when the extensions are not compiled before the NumPy loop
+try:
+    import torch
+    from torchvision.ops import nms as torchvision_nms
+except ImportError:
+    torchvision_nms = None
 
 
 # def nms(dets, thresh, force_cpu=False):
@@ -25,7 +42,29 @@ def nms(dets, thresh, force_cpu=False):
 
     if dets.shape[0] == 0:
         return []
-    if force_cpu:
+    if not force_cpu and gpu_nms is not None:
+        return gpu_nms(dets, thresh)
+    if cpu_nms is not None:
         #return cpu_soft_nms(dets, thresh, method = 0)
         return cpu_nms(dets, thresh)
-    return gpu_nms(dets, thresh)
+    if torchvision_nms is not None:
+        boxes = torch.from_numpy(dets[:, :4]).float()
+        # torchvision uses continuous coordinates, +1 on x2, y2 gives the same areas as py_cpu_nms
+        boxes = torch.cat([boxes[:, :2], boxes[:, 2:] + 1], 1)
+        return torchvision_nms(boxes, torch.from_numpy(dets[:, 4]).float(), thresh).numpy()
+    return py_cpu_nms(dets, thresh)
+
+
+def batched_nms(dets, labels, thresh, force_cpu=False):
+    """
+    NMS of the boxes of several frames in one nms() call: the boxes of each frame are shifted by
+    label * (max coordinate + 2) so boxes of different frames never overlap.
+    labels: index of the frame of each box. Returns the indexes to keep, by decreasing score.
+    """
+    if dets.shape[0] == 0:
+        return []
+    dets = dets.astype(np.float32, copy=True)
+    # a common translation does not change the overlaps, it makes every coordinate >= 0
+    dets[:, :4] -= dets[:, :4].min()
+    dets[:, :4] += (np.asarray(labels, dtype=np.float32) * (dets[:, :4].max() + 2))[:, np.newaxis]
+    return nms(dets, thresh, force_cpu)
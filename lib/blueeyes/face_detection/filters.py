@@ -0,0 +1,81 @@
+'''
+Face filter stage between the detector and the feature extractor.
+Brightness (mean HSV value, like cv2.mean on the HSV crop), sharpness (variance of the Laplacian)
+and size of every box come from one V channel and one Laplacian map of the area around the boxes,
+summed per box with integral images, instead of one colour conversion per box.
+'''
+import cv2
+import numpy as np
+
+from ..utils.pyramid import FramePyramid
+
+class FaceFilter:
+    def __init__(self, brightness_ranges=(), min_sharpness=None, size_ranges=(), min_size=None):
+        '''
+        brightness_ranges: [(vmin, vmax)] of the mean V value, a face passes if it is strictly inside one
+        min_sharpness: minimum variance of the Laplacian (blur), None to skip
+        size_ranges: [(wmin, hmin, wmax, hmax)] in pixels, a face passes if it fits one
+        min_size: minimum of the smaller side in pixels, None to skip
+        '''
+        self.brightness_ranges = list(brightness_ranges)
+        self.min_sharpness = min_sharpness
+        self.size_ranges = list(size_ranges)
+        self.min_size = min_size
+
+    def stats(self, detections, frame=None):
+        '''Per box brightness, sharpness, width and height arrays; frame defaults to the detections' one.'''
+        frame = detections.frame if frame is None else frame
+        if isinstance(frame, FramePyramid):
+            frame = frame.full
+        height, width = frame.shape[:2]
+        boxes = detections.clip(width, height).boxes
+        stats = {
+            'width': boxes[:, 2] - boxes[:, 0],
+            'height': boxes[:, 3] - boxes[:, 1],
+            'brightness': np.zeros(len(boxes), dtype=np.float32),
+            'sharpness': np.zeros(len(boxes), dtype=np.float32),
+        }
+        areas = stats['width'] * stats['height']
+        if not (areas > 0).any() or not (self.brightness_ranges or self.min_sharpness is not None):
+            return stats
+
+        # the maps only cover the area around the boxes
+        x1, y1 = boxes[:, :2].min(axis=0)
+        x2, y2 = boxes[:, 2:].max(axis=0)
+        area = frame[y1:y2, x1:x2]
+        # V of HSV is the max of the B, G, R channels
+        value = area.max(axis=2) if area.ndim == 3 else area
+        boxes = boxes - (x1, y1, x1, y1)
+        areas = np.maximum(areas, 1)
+
+        if self.brightness_ranges:
+            stats['brightness'] = _box_sums(cv2.integral(value), boxes) / areas
+        if self.min_sharpness is not None:
+            laplacian = cv2.Laplacian(value, cv2.CV_32F)
+            sums, squares = cv2.integral2(laplacian, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+            mean = _box_sums(sums, boxes) / areas
+            stats['sharpness'] = _box_sums(squares, boxes) / areas - mean ** 2
+        return stats
+
+    def __call__(self, detections, frame=None):
+        '''Boolean mask over the detections of the faces that pass every criterion.'''
+        stats = self.stats(detections, frame)
+        mask = (stats['width'] > 0) & (stats['height'] > 0)
+        if self.brightness_ranges:
+            brightness = stats['brightness']
+            in_range = np.zeros(len(mask), dtype=bool)
+            for vmin, vmax in self.brightness_ranges:
+                in_range |= (vmin < brightness) & (brightness < vmax)
+            mask &= in_range
+        if self.min_sharpness is not None:
+            mask &= stats['sharpness'] >= self.min_sharpness
+        if self.size_ranges:
+            mask &= detections.in_size_ranges(self.size_ranges)
+        if self.min_size is not None:
+            mask &= np.minimum(stats['width'], stats['height']) >= self.min_size
+        return mask
+
+def _box_sums(integral, boxes):
+    # sum of the pixels of each box from an integral image (one extra row and column)
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    return (integral[y2, x2] - integral[y1, x2] - integral[y2, x1] + integral[y1, x1]).astype(np.float64)
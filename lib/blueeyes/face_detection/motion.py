@@ -0,0 +1,127 @@
+'''
+Cheap motion stage in front of FaceDetector.
+Background subtraction (or frame differencing) runs on a downscaled grey frame;
+static frames skip detection entirely and moving frames only send the bounding
+regions of motion to the detector.
+'''
+import cv2
+import numpy as np
+
+from ..utils.pyramid import FramePyramid
+
+class MotionGate:
+    def __init__(self, method='mog2', scale=4, threshold=25, min_area=0.001, padding=0.25,
+                 max_coverage=0.6, refresh_every=30):
+        '''
+        method: 'mog2' (background subtraction) or 'diff' (difference with a running average)
+        scale: downscale factor of the frame used for motion analysis
+        threshold: grey level difference considered as motion ('diff' method)
+        min_area: minimum motion blob area, as a fraction of the frame area
+        padding: fraction of the region size added around each region so whole faces fit in
+        max_coverage: above this fraction of the frame, the full frame is returned as one region
+        refresh_every: force a full frame region every N frames (0 to disable), so a person standing
+            still, absorbed into the background model, is still detected
+        '''
+        self.method = method
+        self.scale = scale
+        self.threshold = threshold
+        self.min_area = min_area
+        self.padding = padding
+        self.max_coverage = max_coverage
+        self.refresh_every = refresh_every
+        if method == 'mog2':
+            self.subtractor = cv2.createBackgroundSubtractorMOG2(history=500, varThreshold=16, detectShadows=False)
+        elif method == 'diff':
+            self.background = None
+        else:
+            print('Motion method not found!')
+            raise NameError
+        self.regions = []
+        self.frame_count = 0
+        self.static_count = 0
+
+    def _foreground(self, gray):
+        if self.method == 'mog2':
+            mask = self.subtractor.apply(gray)
+        else:
+            if self.background is None:
+                self.background = gray.astype(np.float32)
+            diff = cv2.absdiff(gray, cv2.convertScaleAbs(self.background))
+            cv2.accumulateWeighted(gray, self.background, 0.05)
+            _, mask = cv2.threshold(diff, self.threshold, 255, cv2.THRESH_BINARY)
+        return cv2.dilate(mask, None, iterations=2)
+
+    def update(self, frame):
+        '''
+        Feed a frame (ndarray or FramePyramid with an optional 'motion' level) and return the
+        motion regions as (x1, y1, x2, y2) boxes in full frame coordinates. An empty list means
+        the frame is static and detection can be skipped.
+        '''
+        if isinstance(frame, FramePyramid):
+            scale = frame.scale('motion') if 'motion' in frame else self.scale
+            small = frame.level(scale)
+            height, width = frame.shape[:2]
+        else:
+            scale = self.scale
+            small = cv2.resize(frame, (0,0), fx=1/scale, fy=1/scale, interpolation=cv2.INTER_AREA)
+            height, width = frame.shape[:2]
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        gray = cv2.GaussianBlur(gray, (5, 5), 0)
+        mask = self._foreground(gray)
+
+        self.frame_count += 1
+        if self.refresh_every and self.frame_count % self.refresh_every == 0:
+            self.regions = [(0, 0, width, height)]
+            return self.regions
+
+        contours = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+        min_area = self.min_area * mask.shape[0] * mask.shape[1]
+        rects = []
+        for contour in contours:
+            if cv2.contourArea(contour) < min_area:
+                continue
+            x, y, w, h = cv2.boundingRect(contour)
+            pad_x, pad_y = int(w*self.padding), int(h*self.padding)
+            rects.append((
+                max(0, (x - pad_x)*scale),
+                max(0, (y - pad_y)*scale),
+                min(width, (x + w + pad_x)*scale),
+                min(height, (y + h + pad_y)*scale),
+            ))
+        rects = self._merge(rects)
+
+        if not rects:
+            self.static_count += 1
+        elif sum((x2-x1)*(y2-y1) for x1, y1, x2, y2 in rects) > self.max_coverage * width * height:
+            rects = [(0, 0, width, height)]
+        self.regions = rects
+        return self.regions
+
+    @staticmethod
+    def _merge(rects):
+        # merge overlapping regions so that no face is detected twice
+        rects = list(rects)
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(rects)):
+                for j in range(i + 1, len(rects)):
+                    a, b = rects[i], rects[j]
+                    if a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]:
+                        rects[i] = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                        del rects[j]
+                        merged = True
+                        break
+                if merged:
+                    break
+        return rects
+
+    def is_static(self):
+        return not self.regions
+
+    def stats(self):
+        return {
+            'frames': self.frame_count,
+            'static': self.static_count,
+            'regions': len(self.regions),
+        }
@@ -0,0 +1,57 @@
+'''
+Face quality score in [0, 1] per detection, to spend the feature extraction on the best frames only.
+Combines the pose (frontal from the landmarks, same side test as mtcnn_torch's filter_side_face),
+the sharpness (variance of the Laplacian, see FaceFilter), the resolution and the detector score.
+'''
+import numpy as np
+
+from .filters import FaceFilter
+
+class QualityScorer:
+    def __init__(self, target_size=150, sharpness_scale=100, weights=None):
+        '''
+        target_size: smaller face side (pixels) at which the resolution is rated 1, the dlib input size
+        sharpness_scale: Laplacian variance rated 1
+        weights: exponents of the weighted geometric mean of pose, sharpness, resolution and score
+        '''
+        self.target_size = target_size
+        self.sharpness_scale = sharpness_scale
+        self.weights = {'pose': 1, 'sharpness': 1, 'resolution': 1, 'score': 0.5}
+        if weights:
+            self.weights.update(weights)
+        self.face_filter = FaceFilter(min_sharpness=0)
+
+    def components(self, detections, frame=None):
+        '''Per face pose, sharpness, resolution and score ratings in [0, 1].'''
+        stats = self.face_filter.stats(detections, frame)
+        return {
+            'pose': pose_quality(detections),
+            'sharpness': np.clip(stats['sharpness'] / self.sharpness_scale, 0, 1),
+            'resolution': np.clip(np.minimum(stats['width'], stats['height']) / self.target_size, 0, 1),
+            'score': np.clip(detections.scores, 0, 1),
+        }
+
+    def __call__(self, detections, frame=None):
+        '''float32 quality of every face of a Detections, frame defaults to the detections' one.'''
+        if len(detections) == 0:
+            return np.zeros(0, dtype=np.float32)
+        components = self.components(detections, frame)
+        total = sum(self.weights.values())
+        log_quality = sum(weight * np.log(np.maximum(components[name], 1e-6))
+                          for name, weight in self.weights.items())
+        return np.exp(log_quality / total).astype(np.float32)
+
+def pose_quality(detections):
+    '''
+    1 for a frontal face, down to 0 as the nose moves from the middle of the eyes to an eye;
+    0 when both eyes are on the same side of the box center (side face). 1 without landmarks.
+    '''
+    if detections.landmarks is None:
+        return np.ones(len(detections), dtype=np.float32)
+    landmarks = detections.landmarks
+    mid = (detections.boxes[:, 0] + detections.boxes[:, 2]) / 2
+    left_eye, right_eye, nose = landmarks[:, 0, 0], landmarks[:, 1, 0], landmarks[:, 2, 0]
+    frontal = (left_eye - mid) * (right_eye - mid) <= 0
+    eye_distance = np.maximum(np.abs(right_eye - left_eye), 1)
+    yaw = np.abs(nose - (left_eye + right_eye) / 2) / eye_distance
+    return np.where(frontal, np.clip(1 - 2 * yaw, 0, 1), 0).astype(np.float32)
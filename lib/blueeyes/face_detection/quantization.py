@@ -0,0 +1,131 @@
+'''
+Post-training int8 quantisation of the detector networks (FaceBoxes, MTCNN P/R/O-Net) for CPU inference.
+static: FX graph mode quantisation, activations calibrated on a set of our own frames
+dynamic: only the weights of the Linear layers in int8, no calibration; this covers the R-Net / O-Net
+heads, FaceBoxes is all convolutions and stays in float32
+Quantised models only run on CPU (x86 / fbgemm, or qnnpack on ARM).
+Needs torch >= 1.13 (torch.ao.quantization, QConfigMapping, prepare_fx with example_inputs), see requirements.txt.
+'''
+import os
+import cv2
+import copy
+import logging
+import numpy as np
+
+from .detections import box_iou
+
+logging.basicConfig(level=logging.DEBUG)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+def calibration_frames(source, limit=100):
+    '''Calibration frames from a folder of images, a video file or a list of decoded frames.'''
+    if not isinstance(source, str):
+        return list(source)[:limit]
+    frames = []
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            if len(frames) >= limit:
+                break
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                frame = cv2.imread(os.path.join(source, name))
+                if frame is not None:
+                    frames.append(frame)
+    else:
+        cap = cv2.VideoCapture(source)
+        while len(frames) < limit:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(frame)
+        cap.release()
+    if not frames:
+        print(f'No calibration frame found in {source}!')
+        raise NameError
+    return frames
+
+def quantized_engine():
+    '''Select the int8 kernels of this machine ('x86' only exists from torch 2.0, fbgemm before).'''
+    import torch
+    for engine in ('x86', 'fbgemm', 'qnnpack'):
+        if engine in torch.backends.quantized.supported_engines:
+            torch.backends.quantized.engine = engine
+            return engine
+    print('No int8 engine in this torch build!')
+    raise NameError
+
+def quantize_model(model, calibration_inputs=None, mode='static'):
+    '''int8 copy of a float model, calibration_inputs: input tensors run through the model (static mode).'''
+    import torch
+    from torch.ao.quantization import quantize_dynamic, get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    engine = quantized_engine()
+    model = copy.deepcopy(model).cpu().eval()
+    if hasattr(model, 'device'):
+        # the MTCNN nets create their empty landmark output on self.device
+        model.device = torch.device('cpu')
+    if mode == 'dynamic':
+        return quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    if mode != 'static':
+        print('Quantization mode not found!')
+        raise NameError
+    if not calibration_inputs:
+        print('Static quantization needs calibration inputs!')
+        raise NameError
+    prepared = prepare_fx(model, get_default_qconfig_mapping(engine), example_inputs=(calibration_inputs[0].cpu(),))
+    with torch.no_grad():
+        for x in calibration_inputs:
+            prepared(x.cpu())
+    logging.debug(f'{type(model).__name__} calibrated on {len(calibration_inputs)} inputs ({engine})')
+    return convert_fx(prepared)
+
+def record_inputs(modules, run, limit=200):
+    '''Call run() and return, for each module, the (at most limit) input tensors it was called with.'''
+    inputs = [[] for _ in modules]
+    def hook(i):
+        def record(module, args):
+            if len(inputs[i]) < limit:
+                inputs[i].append(args[0].detach().cpu())
+        return record
+    handles = [module.register_forward_pre_hook(hook(i)) for i, module in enumerate(modules)]
+    try:
+        run()
+    finally:
+        for handle in handles:
+            handle.remove()
+    return inputs
+
+def quantize_mtcnn(face_detector, frames, mode='static', **detect_kwargs):
+    '''
+    int8 (pnet, rnet, onet) of a float mtcnn_torch FaceDetector. For static mode each net is calibrated
+    on the inputs it actually receives while the float detector runs on the calibration frames.
+    '''
+    nets = [face_detector.pnet, face_detector.rnet, face_detector.onet]
+    if mode == 'static':
+        def run():
+            for frame in frames:
+                face_detector.detect(frame, bgr=True, **detect_kwargs)
+        inputs = record_inputs(nets, run)
+    else:
+        inputs = [None] * len(nets)
+    return tuple(quantize_model(net, net_inputs, mode) for net, net_inputs in zip(nets, inputs))
+
+def compare_detections(reference, candidate, iou_threshold=0.5):
+    '''
+    Greedy IoU matching of candidate boxes (e.g. of the int8 model) to reference boxes (the float model)
+    of one frame. Returns the number of matches, of reference / candidate boxes and the IoU of each match.
+    '''
+    result = {'matched': 0, 'reference': len(reference), 'candidate': len(candidate), 'ious': []}
+    if len(reference) == 0 or len(candidate) == 0:
+        return result
+    ious = box_iou(reference.boxes, candidate.boxes)
+    while True:
+        i, j = np.unravel_index(np.argmax(ious), ious.shape)
+        if ious[i, j] < iou_threshold:
+            break
+        result['matched'] += 1
+        result['ious'].append(float(ious[i, j]))
+        ious[i, :] = -1
+        ious[:, j] = -1
+    return result
@@ -0,0 +1,93 @@
+'''
+Per-camera region of interest for FaceDetector.
+Shapes are given as fractions of the frame size, like Camera's crop, so the same ROI works
+at every pyramid level: rectangles (x1, y1, x2, y2) or polygons [(x, y), ...].
+Only the bounding rectangles of the shapes are fed to the network; polygons are masked
+with the mean pixel inside their rectangle and faces whose center falls outside are dropped.
+'''
+import cv2
+import numpy as np
+
+# FaceBoxes / caffe mean pixel (BGR), zero after normalisation
+MEAN_PIXEL = (104, 117, 123)
+
+class ROI:
+    def __init__(self, shapes, fill=MEAN_PIXEL):
+        self.shapes = []
+        for shape in shapes:
+            if len(shape) == 4 and np.isscalar(shape[0]):
+                x1, y1, x2, y2 = shape
+                shape = [(x1, y1), (x2, y1), (x2, y2), (x1, y2)]
+                self.shapes.append((np.float32(shape), True))
+            else:
+                self.shapes.append((np.float32(shape).reshape(-1, 2), False))
+        if not self.shapes:
+            print('ROI needs at least one shape!')
+            raise NameError
+        self.fill = fill
+        self._masks = {}
+
+    @property
+    def polygonal(self):
+        return not all(is_rect for _, is_rect in self.shapes)
+
+    def _points(self, width, height):
+        return [np.round(points * (width, height)).astype(np.int32) for points, _ in self.shapes]
+
+    def rects(self, width, height):
+        '''Pixel bounding rectangles (x1, y1, x2, y2) of the shapes in a frame of this size.'''
+        rects = []
+        for points in self._points(width, height):
+            x1, y1 = np.maximum(points.min(axis=0), 0)
+            x2, y2 = np.minimum(points.max(axis=0), (width, height))
+            if x2 > x1 and y2 > y1:
+                rects.append((int(x1), int(y1), int(x2), int(y2)))
+        return rects
+
+    def restrict(self, regions, width, height):
+        '''Intersect regions (pixel rectangles) with the ROI rectangles, empty intersections are dropped.'''
+        rects = []
+        for rx1, ry1, rx2, ry2 in self.rects(width, height):
+            for x1, y1, x2, y2 in regions:
+                x1, y1, x2, y2 = max(x1, rx1), max(y1, ry1), min(x2, rx2), min(y2, ry2)
+                if x2 > x1 and y2 > y1:
+                    rects.append((x1, y1, x2, y2))
+        return rects
+
+    def mask(self, width, height):
+        '''uint8 mask of the ROI in a frame of this size, cached per size.'''
+        key = (width, height)
+        if key not in self._masks:
+            mask = np.zeros((height, width), dtype=np.uint8)
+            cv2.fillPoly(mask, self._points(width, height), 1)
+            self._masks[key] = mask
+        return self._masks[key]
+
+    def coverage(self, width, height):
+        '''Fraction of the frame the network still sees: area of the union of the ROI rectangles.'''
+        covered = np.zeros((height, width), dtype=bool)
+        for x1, y1, x2, y2 in self.rects(width, height):
+            covered[y1:y2, x1:x2] = True
+        return covered.mean()
+
+    def crop(self, frame, rect):
+        '''The frame inside rect, with the pixels outside the polygons set to the fill value.'''
+        x1, y1, x2, y2 = rect
+        crop = frame[y1:y2, x1:x2]
+        if not self.polygonal:
+            return crop
+        inside = self.mask(frame.shape[1], frame.shape[0])[y1:y2, x1:x2]
+        if inside.all():
+            return crop
+        crop = crop.copy()
+        crop[inside == 0] = self.fill
+        return crop
+
+    def contains(self, detections, width, height):
+        '''Mask of the detections (in the coordinates of a frame of this size) whose box center lies inside the ROI.'''
+        if len(detections) == 0:
+            return np.zeros(0, dtype=bool)
+        boxes = detections.boxes
+        cx = np.clip((boxes[:, 0] + boxes[:, 2]) // 2, 0, width - 1)
+        cy = np.clip((boxes[:, 1] + boxes[:, 3]) // 2, 0, height - 1)
+        return self.mask(width, height)[cy, cx] > 0
@@ -29,25 +29,27 @@ class BatchImageDetector(object):
 
         self.onet.eval()  # Onet has dropout layer.
 
-    def _preprocess(self, imgs):
+    def _preprocess(self, imgs, bgr=False):
 
         # Convert image from rgb to bgr for Compatible with original caffe model.
-        tmp = []
-        for i, img in enumerate(imgs):
-            tmp.append(cv2.cvtColor(img, cv2.COLOR_RGB2BGR))
-
-        imgs = np.stack(tmp)
-        imgs = imgs.transpose(0, 3, 1, 2)
-        imgs = torch.FloatTensor(imgs).to(self.device)
+        if bgr:
+            imgs = np.stack(imgs)
+        else:
+            tmp = []
+            for i, img in enumerate(imgs):
+                tmp.append(cv2.cvtColor(img, cv2.COLOR_RGB2BGR))
+            imgs = np.stack(tmp)
+        imgs = np.ascontiguousarray(imgs.transpose(0, 3, 1, 2))
+        imgs = torch.from_numpy(imgs).to(self.device).float()
         imgs = func.imnormalize(imgs)
 
         return imgs
 
-    def detect(self, imgs, threshold=[0.6, 0.7, 0.9], factor=0.7, minsize=12, nms_threshold=[0.7, 0.7, 0.3]):
+    def detect(self, imgs, threshold=[0.6, 0.7, 0.9], factor=0.7, minsize=12, nms_threshold=[0.7, 0.7, 0.3], packed=False, bgr=False):
 
-        imgs = self._preprocess(imgs)
+        imgs = self._preprocess(imgs, bgr)
         stage_one_boxes = self.stage_one(
-            imgs, threshold[0], factor, minsize, nms_threshold[0])
+            imgs, threshold[0], factor, minsize, nms_threshold[0], packed)
         stage_two_boxes = self.stage_two(
             imgs, stage_one_boxes, threshold[1], nms_threshold[1])
         stage_three_boxes, landmarks = self.stage_three(
@@ -198,7 +200,7 @@ class BatchImageDetector(object):
         return landmarks
 
     @_no_grad
-    def stage_one(self, imgs, threshold, factor, minsize, nms_threshold):
+    def stage_one(self, imgs, threshold, factor, minsize, nms_threshold, packed=False):
         """Stage one of mtcnn detection.
         
         Args:
@@ -207,6 +209,7 @@ class BatchImageDetector(object):
             factor (float): Image pyramid scaling ratio.
             minsize (int): The minimum size of reserve bounding boxes.
             nms_threshold (float): retain boxes that satisfy overlap <= thresh
+            packed (bool): run P-Net once on all the pyramid levels packed in one canvas.
         
         Returns:
             torch.IntTensor: All bounding boxes with image label output by stage one detection. [n, 5]
@@ -214,7 +217,6 @@ class BatchImageDetector(object):
 
         width = imgs.shape[-2]
         height = imgs.shape[-1]
-        num_img = imgs.shape[0]
 
         # Compute valid scales
         scales = []
@@ -238,11 +240,18 @@ class BatchImageDetector(object):
         candidate_offsets = torch.empty(
             0, dtype=torch.float32, device=self.device)
         all_img_labels = torch.empty(0, dtype=torch.int32, device=self.device)
-        for w, h, f in scales:
-            resize_img = torch.nn.functional.interpolate(
-                imgs, size=(w, h), mode='bilinear')
-            p_distribution, box_regs, _ = self.pnet(resize_img)
-
+        if packed:
+            # every level tiled in one canvas, a single P-Net pass
+            levels = func.packed_pnet(self.pnet, imgs, scales)
+        else:
+            levels = []
+            for w, h, f in scales:
+                resize_img = torch.nn.functional.interpolate(
+                    imgs, size=(w, h), mode='bilinear')
+                p_distribution, box_regs, _ = self.pnet(resize_img)
+                levels.append((p_distribution, box_regs, f))
+
+        for p_distribution, box_regs, f in levels:
             candidate, scores, offsets, img_labels = self._generate_bboxes(
                 p_distribution, box_regs, f, threshold)
 
@@ -259,14 +268,10 @@ class BatchImageDetector(object):
             candidate_boxes = self._refine_boxes(
                 candidate_boxes, width, height)
             
-            final_boxes = torch.empty(0, dtype=torch.int32, device=self.device)
-            final_img_labels = torch.empty(0, dtype=torch.int32, device=self.device)
-            for i in range(num_img):
-                mask = all_img_labels == i
-                keep = func.nms(candidate_boxes[mask].cpu().numpy(),
-                            candidate_scores[mask].cpu().numpy(), nms_threshold)
-                final_boxes = torch.cat([final_boxes, candidate_boxes[mask][keep]])
-                final_img_labels = torch.cat([final_img_labels, all_img_labels[mask][keep]])
+            # nms of every image in one call
+            keep = func.batched_nms(candidate_boxes, candidate_scores, all_img_labels, nms_threshold)
+            final_boxes = candidate_boxes[keep]
+            final_img_labels = all_img_labels[keep]
 
             return torch.cat([final_boxes, final_img_labels.unsqueeze(1 )], -1)
         else:
@@ -285,18 +290,8 @@ class BatchImageDetector(object):
         lablels = boxes[:, -1]
         boxes = boxes[:, :4]
 
-        num_img = imgs.shape[0]
-
         # get candidate faces
-        candidate_faces = list()
-
-        for box, label in zip(boxes, lablels):
-            im = imgs[label, :, box[1]: box[3], box[0]: box[2]].unsqueeze(0)
-            im = torch.nn.functional.interpolate(
-                im, size=(24, 24), mode='bilinear')
-            candidate_faces.append(im)
-        
-        candidate_faces = torch.cat(candidate_faces, 0)
+        candidate_faces = func.crop_resize(imgs, boxes, 24, lablels)
 
         # rnet forward pass
         p_distribution, box_regs, _ = self.rnet(candidate_faces)
@@ -314,14 +309,10 @@ class BatchImageDetector(object):
             boxes = self._convert_to_square(boxes)
             boxes = self._refine_boxes(boxes, width, height)
 
-            final_boxes = torch.empty(0, dtype=torch.int32, device=self.device)
-            final_img_labels = torch.empty(0, dtype=torch.int32, device=self.device)
-            for i in range(num_img):
-                mask = labels == i
-                keep = func.nms(boxes[mask].cpu().numpy(),
-                            scores[mask].cpu().numpy(), nms_threshold)
-                final_boxes = torch.cat([final_boxes, boxes[mask][keep]])
-                final_img_labels = torch.cat([final_img_labels, labels[mask][keep]])
+            # nms of every image in one call
+            keep = func.batched_nms(boxes, scores, labels, nms_threshold)
+            final_boxes = boxes[keep]
+            final_img_labels = labels[keep]
 
             return torch.cat([final_boxes, final_img_labels.unsqueeze(1 )], -1)
 
@@ -333,6 +324,7 @@ class BatchImageDetector(object):
     @_no_grad
     def stage_three(self, imgs, boxes, threshold, nms_threshold):
         # no candidate face found.
+        self.scores = torch.empty(0, device=self.device)
         if boxes.shape[0] == 0:
             return boxes, torch.empty(0, device=self.device, dtype=torch.int32)
 
@@ -342,18 +334,8 @@ class BatchImageDetector(object):
         labels = boxes[:, -1]
         boxes = boxes[:, :4]
 
-        num_img = imgs.shape[0]
-
         # get candidate faces
-        candidate_faces = list()
-
-        for box, label in zip(boxes, labels):
-            im = imgs[label, :, box[1]: box[3], box[0]: box[2]].unsqueeze(0)
-            im = torch.nn.functional.interpolate(
-                im, size=(48, 48), mode='bilinear')
-            candidate_faces.append(im)
-        
-        candidate_faces = torch.cat(candidate_faces, 0)
+        candidate_faces = func.crop_resize(imgs, boxes, 48, labels)
 
         p_distribution, box_regs, landmarks = self.onet(candidate_faces)
 
@@ -375,21 +357,12 @@ class BatchImageDetector(object):
             boxes = self._calibrate_box(boxes, box_regs)
             boxes = self._refine_boxes(boxes, width, height)
 
-            final_boxes = torch.empty(0, dtype=torch.int32, device=self.device)
-            final_img_labels = torch.empty(0, dtype=torch.int32, device=self.device)
-            final_landmarks = torch.empty(0, dtype=torch.int32, device=self.device)
-            for i in range(num_img):
-                
-                # nms
-                mask = labels == i
-                keep = func.nms(boxes[mask].cpu().numpy(),
-                            scores[mask].cpu().numpy(), nms_threshold)
-                final_boxes = torch.cat([final_boxes, boxes[mask][keep]])
-                final_img_labels = torch.cat([final_img_labels, labels[mask][keep]])
-
-                # compute face landmark points
-                landm = landmarks  [mask][keep]
-                final_landmarks = torch.cat([final_landmarks, landm])
+            # nms of every image in one call
+            keep = func.batched_nms(boxes, scores, labels, nms_threshold)
+            final_boxes = boxes[keep]
+            final_img_labels = labels[keep]
+            final_landmarks = landmarks[keep]
+            self.scores = scores[keep]
 
             return torch.cat([final_boxes, final_img_labels.unsqueeze(1 )], -1), final_landmarks
 
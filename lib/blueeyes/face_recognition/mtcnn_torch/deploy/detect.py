@@ -2,6 +2,7 @@ import math
 import cv2
 import torch
 import time
+import numpy as np
 
 import mtcnn_torch.utils.functional as func
 
@@ -28,34 +29,40 @@ class FaceDetector(object):
         self.onet.eval()  # Onet has dropout layer.
     
     def to_script(self):
+        # _Net.to_script returns the traced module, it does not trace in place
         if isinstance(self.pnet, torch.nn.Module):
-            self.pnet.to_script()
+            self.pnet = self.pnet.to_script()
         
         if isinstance(self.rnet, torch.nn.Module):
-            self.rnet.to_script()
+            self.rnet = self.rnet.to_script()
 
         if isinstance(self.onet, torch.nn.Module):
-            self.onet.to_script()
+            self.onet = self.onet.to_script()
         return self
 
-    def _preprocess(self, img):
+    def _preprocess(self, img, bgr=False):
 
         if isinstance(img, str):
             img = cv2.imread(img)
 
         # Convert image from rgb to bgr for Compatible with original caffe model.
-        img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
-        img = img.transpose(2, 0, 1)
-        img = torch.FloatTensor(img).to(self.device)
+        if not bgr:
+            img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+        img = np.ascontiguousarray(img.transpose(2, 0, 1))
+        img = torch.from_numpy(img).to(self.device).float()
         img = func.imnormalize(img)
         img = img.unsqueeze(0)
 
         return img
 
-    def detect(self, img, threshold=[0.6, 0.7, 0.85], factor=0.7, minsize=12, nms_threshold=[0.7, 0.7, 0.3]):
+    def detect(self, img, threshold=[0.6, 0.7, 0.85], factor=0.7, minsize=12, nms_threshold=[0.7, 0.7, 0.3], packed=False, bgr=False):
+        """
+        Returns the boxes [n, 4] and landmarks [n, 5, 2] (eyes, nose, mouth corners) of the faces,
+        their O-Net scores are kept in self.scores. Set bgr=True for images read by OpenCV.
+        """
 
-        img = self._preprocess(img)
-        stage_one_boxes = self.stage_one(img, threshold[0], factor, minsize, nms_threshold[0])
+        img = self._preprocess(img, bgr)
+        stage_one_boxes = self.stage_one(img, threshold[0], factor, minsize, nms_threshold[0], packed)
         stage_two_boxes = self.stage_two(img, stage_one_boxes, threshold[1], nms_threshold[1])
         stage_three_boxes, landmarks = self.stage_three(
             img, stage_two_boxes, threshold[2], nms_threshold[2])
@@ -207,7 +214,7 @@ class FaceDetector(object):
         return landmarks
 
     @_no_grad
-    def stage_one(self, img, threshold, factor, minsize, nms_threshold):
+    def stage_one(self, img, threshold, factor, minsize, nms_threshold, packed=False):
         width = img.shape[2]
         height = img.shape[3]
 
@@ -230,11 +237,18 @@ class FaceDetector(object):
         candidate_boxes = torch.empty((0, 4), dtype=torch.int32, device=self.device)
         candidate_scores = torch.empty((0), device=self.device)
         candidate_offsets = torch.empty((0, 4), dtype=torch.float32, device=self.device)
-        for w, h, f in scales:
-            resize_img = torch.nn.functional.interpolate(
-                img, size=(w, h), mode='bilinear')
-            p_distribution, box_regs, _ = self.pnet(resize_img)
-
+        if packed:
+            # every level tiled in one canvas, a single P-Net pass
+            levels = func.packed_pnet(self.pnet, img, scales)
+        else:
+            levels = []
+            for w, h, f in scales:
+                resize_img = torch.nn.functional.interpolate(
+                    img, size=(w, h), mode='bilinear')
+                p_distribution, box_regs, _ = self.pnet(resize_img)
+                levels.append((p_distribution, box_regs, f))
+
+        for p_distribution, box_regs, f in levels:
             candidate, scores, offsets = self._generate_bboxes(
                 p_distribution, box_regs, f, threshold)
 
@@ -245,7 +259,7 @@ class FaceDetector(object):
         # nms
         if candidate_boxes.shape[0] != 0:
             candidate_boxes = self._calibrate_box(candidate_boxes, candidate_offsets)
-            keep = func.nms(candidate_boxes.cpu().numpy(), candidate_scores.cpu().numpy(), nms_threshold, device=self.device)
+            keep = func.nms_torch(candidate_boxes, candidate_scores, nms_threshold)
             return candidate_boxes[keep]
         else:
             return candidate_boxes
@@ -264,15 +278,7 @@ class FaceDetector(object):
         boxes = self._refine_boxes(boxes, width, height)
 
         # get candidate faces
-        candidate_faces = list()
-
-        for box in boxes:
-            im = img[:, :, box[1]: box[3], box[0]: box[2]]
-            im = torch.nn.functional.interpolate(
-                im, size=(24, 24), mode='bilinear')
-            candidate_faces.append(im)
-        
-        candidate_faces = torch.cat(candidate_faces, 0)
+        candidate_faces = func.crop_resize(img, boxes, 24)
 
         # rnet forward pass
         p_distribution, box_regs, _ = self.rnet(candidate_faces)
@@ -287,13 +293,14 @@ class FaceDetector(object):
         if boxes.shape[0] > 0:
             boxes = self._calibrate_box(boxes, box_regs)
             # nms
-            keep = func.nms(boxes.cpu().numpy(), scores.cpu().numpy(), nms_threshold, device=self.device)
+            keep = func.nms_torch(boxes, scores, nms_threshold)
             boxes = boxes[keep]
         return boxes
 
     @_no_grad
     def stage_three(self, img, boxes, threshold, nms_threshold):
         # no candidate face found.
+        self.scores = torch.empty(0, device=self.device)
         if boxes.shape[0] == 0:
             return boxes, torch.empty(0, device=self.device, dtype=torch.int32)
 
@@ -304,15 +311,7 @@ class FaceDetector(object):
         boxes = self._refine_boxes(boxes, width, height)
 
         # get candidate faces
-        candidate_faces = list()
-
-        for box in boxes:
-            im = img[:, :, box[1]: box[3], box[0]: box[2]]
-            im = torch.nn.functional.interpolate(
-                im, size=(48, 48), mode='bilinear')
-            candidate_faces.append(im)
-        
-        candidate_faces = torch.cat(candidate_faces, 0)
+        candidate_faces = func.crop_resize(img, boxes, 48)
 
         p_distribution, box_regs, landmarks = self.onet(candidate_faces)
 
@@ -333,8 +332,9 @@ class FaceDetector(object):
             boxes = self._refine_boxes(boxes, width, height)
             
             # nms
-            keep = func.nms(boxes.cpu().numpy(), scores.cpu().numpy(), nms_threshold, device=self.device)
+            keep = func.nms_torch(boxes, scores, nms_threshold)
             boxes = boxes[keep]
             landmarks = landmarks[keep]
+            self.scores = scores[keep]
             
         return boxes, landmarks
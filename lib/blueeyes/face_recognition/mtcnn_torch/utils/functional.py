@@ -2,8 +2,12 @@ import cv2
 import torch
 import numpy as np
 
-from mtcnn_torch.utils.nms.cpu_nms import cpu_nms
-from mtcnn_torch.utils.nms.gpu_nms import gpu_nms
+
+# torchvision ships a prebuilt nms kernel (cpu and cuda); without it nms falls back to NumPy
+try:
+    from torchvision.ops import nms as _torchvision_nms
+except ImportError:
+    _torchvision_nms = None
 
 def IoU(box, boxes):
     """Compute IoU between detect box and gt boxes
@@ -40,23 +44,150 @@ def nms(dets, scores, thresh, device="cpu"):
     greedily select boxes with high confidence
     keep boxes overlap <= thresh
     rule out overlap > thresh
-    :param dets: [[x1, y1, x2, y2 score]]
+    :param dets: [[x1, y1, x2, y2]]
+    :param scores: [score]
     :param thresh: retain overlap <= thresh
-    :return: indexes to keep
+    :param device: unused, kept for compatibility (see nms_torch for tensors)
+    :return: indexes to keep, by decreasing score
     """
-    if isinstance(device, str):
-        device = torch.device(device)
+    dets = np.asarray(dets, dtype=np.float32)
+    scores = np.asarray(scores, dtype=np.float32)
+    x1, y1, x2, y2 = dets[:, 0], dets[:, 1], dets[:, 2], dets[:, 3]
+    areas = (x2 - x1 + 1) * (y2 - y1 + 1)
+    order = scores.argsort()[::-1]
+
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        w = np.maximum(0.0, np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]) + 1)
+        h = np.maximum(0.0, np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]) + 1)
+        inter = w * h
+        ovr = inter / (areas[i] + areas[rest] - inter)
+        order = rest[ovr <= thresh]
+
+    return np.array(keep, dtype=np.int64)
+
+
+def nms_torch(boxes, scores, thresh):
+    """
+    nms on tensors, stays on the device of the boxes when torchvision is available.
+    :param boxes: tensor [n, 4] x1, y1, x2, y2 in pixels (inclusive)
+    :param scores: tensor [n]
+    :return: LongTensor of indexes to keep, by decreasing score
+    """
+    if boxes.shape[0] == 0:
+        return torch.empty(0, dtype=torch.long, device=boxes.device)
+    if _torchvision_nms is not None:
+        boxes = boxes.float()
+        # torchvision uses continuous coordinates, +1 on x2, y2 gives the same areas as above
+        boxes = torch.cat([boxes[:, :2], boxes[:, 2:] + 1], 1)
+        return _torchvision_nms(boxes, scores.float(), thresh)
+    keep = nms(boxes.cpu().numpy(), scores.cpu().numpy(), thresh)
+    return torch.from_numpy(keep).to(boxes.device)
 
-    if device.type == 'cpu':
-        ret = cpu_nms(dets.astype(np.float32), scores.astype(np.float32), thresh)
-    
-    else:
-        dets = np.concatenate([dets.astype(np.float32), scores.astype(np.float32).reshape(-1, 1)], 1)
-        ret = gpu_nms(dets , thresh, device_id=device.index)
 
-    return ret
+def batched_nms(boxes, scores, labels, thresh):
+    """
+    nms of the boxes of several images in one call: the boxes of each image are shifted by
+    label * (max coordinate + 1) so boxes of different images never overlap.
+    :param labels: tensor [n], index of the image of each box
+    :return: LongTensor of indexes to keep, by decreasing score
+    """
+    if boxes.shape[0] == 0:
+        return torch.empty(0, dtype=torch.long, device=boxes.device)
+    # a common translation does not change the overlaps, it makes every coordinate >= 0
+    boxes = boxes.float()
+    boxes = boxes - boxes.min()
+    offsets = labels.float() * (boxes.max() + 2)
+    return nms_torch(boxes + offsets[:, None], scores, thresh)
 
     
+def crop_resize(imgs, boxes, size, labels=None):
+    """
+    Crop every box out of a NCHW batch and resize it to size x size with a single grid_sample,
+    RoIAlign-style (bilinear, pixel centers like interpolate(..., align_corners=False)).
+    :param imgs: FloatTensor [n, c, H, W]
+    :param boxes: IntTensor [k, 4] x1, y1, x2, y2, x2 and y2 excluded like img[..., y1:y2, x1:x2]
+    :param size: output side, 24 for rnet and 48 for onet
+    :param labels: image index of each box, None when every box belongs to imgs[0]
+    :return: FloatTensor [k, c, size, size]
+    """
+    n, c, height, width = imgs.shape
+    k = boxes.shape[0]
+    if k == 0:
+        return imgs.new_empty((0, c, size, size))
+    boxes = boxes.float()
+    w = (boxes[:, 2] - boxes[:, 0]).clamp(min=1)
+    h = (boxes[:, 3] - boxes[:, 1]).clamp(min=1)
+    # affine map from the output grid to the normalized coordinates of the crop
+    theta = boxes.new_zeros((k, 2, 3))
+    theta[:, 0, 0] = w / width
+    theta[:, 0, 2] = (2 * boxes[:, 0] + w) / width - 1
+    theta[:, 1, 1] = h / height
+    theta[:, 1, 2] = (2 * boxes[:, 1] + h) / height - 1
+    grid = torch.nn.functional.affine_grid(theta, (k, c, size, size), align_corners=False)
+
+    if labels is None or n == 1:
+        # expand does not copy the image for each box
+        return torch.nn.functional.grid_sample(imgs[:1].expand(k, -1, -1, -1), grid,
+                                               mode='bilinear', padding_mode='border', align_corners=False)
+    out = imgs.new_empty((k, c, size, size))
+    labels = labels.long()
+    for i in labels.unique():
+        mask = labels == i
+        m = int(mask.sum())
+        out[mask] = torch.nn.functional.grid_sample(imgs[i:i + 1].expand(m, -1, -1, -1), grid[mask],
+                                                    mode='bilinear', padding_mode='border', align_corners=False)
+    return out
+
+
+def pack_pyramid(sizes, canvas_width):
+    """
+    Shelf-pack the pyramid levels into one canvas. Offsets are even so that the stride 2
+    of P-Net keeps every level on its own output grid.
+    :param sizes: [(height, width)] of the levels, largest first
+    :param canvas_width: minimum canvas width, usually the width of the image
+    :return: [(y, x)] offset of each level, (canvas_height, canvas_width)
+    """
+    canvas_width = max([canvas_width] + [w for _, w in sizes])
+    positions = []
+    shelf_y = shelf_h = x = 0
+    for h, w in sizes:
+        if x + w > canvas_width:
+            shelf_y += shelf_h + shelf_h % 2
+            shelf_h = x = 0
+        positions.append((shelf_y, x))
+        x += w + w % 2
+        shelf_h = max(shelf_h, h)
+    canvas_height = shelf_y + shelf_h + shelf_h % 2
+    return positions, (canvas_height, canvas_width)
+
+
+def packed_pnet(pnet, imgs, scales):
+    """
+    Run P-Net once on every pyramid level tiled into a single canvas instead of once per level.
+    :param imgs: FloatTensor [n, c, H, W]
+    :param scales: [(height, width, factor)] of the levels
+    :return: [(probs, offsets, factor)] per level, the P-Net outputs of the level alone
+    """
+    n, c = imgs.shape[:2]
+    positions, (canvas_h, canvas_w) = pack_pyramid([(h, w) for h, w, _ in scales], imgs.shape[3])
+    canvas = imgs.new_zeros((n, c, canvas_h, canvas_w))
+    for (h, w, _), (y, x) in zip(scales, positions):
+        canvas[:, :, y:y + h, x:x + w] = torch.nn.functional.interpolate(imgs, size=(h, w), mode='bilinear')
+    probs, offsets, _ = pnet(canvas)
+
+    levels = []
+    for (h, w, f), (y, x) in zip(scales, positions):
+        # output cell i sees the input pixels [2i, 2i + 12), keep the cells that lie inside the level
+        rows, cols = (h - 12) // 2 + 1, (w - 12) // 2 + 1
+        window = (slice(None), slice(None), slice(y // 2, y // 2 + rows), slice(x // 2, x // 2 + cols))
+        levels.append((probs[window], offsets[window], f))
+    return levels
+
+
 def imnormalize(img):
     """
     Normalize pixel value from (0, 255) to (-1, 1) 
@@ -10,21 +10,56 @@ import threading
 import multiprocessing
 import numpy as np
 from time import time
-from scipy.spatial import distance
 
 from functools import partial
 
-from tqdm.notebook import tqdm
-
-from tensorflow.keras.models import Model, load_model
-
-# KNN classifier
-from sklearn.neighbors import KNeighborsClassifier
-
-from sklearn.utils import shuffle
-from skimage.transform import resize
-
-import face_recognition
+from ..utils.pyramid import FramePyramid
+from ..face_detection.detections import Detections
+from ..utils.backend import BackendRegistry, import_tensorflow
+
+# feature extractor and classifier backends, imported only when they are selected
+EXTRACTORS = BackendRegistry('feature extractor')
+CLASSIFIERS = BackendRegistry('classifier')
+
+@EXTRACTORS.register('dlib')
+def _load_dlib():
+    import dlib
+    return dlib
+
+@EXTRACTORS.register('face_recognition')
+def _load_face_recognition():
+    import face_recognition
+    return face_recognition
+
+@EXTRACTORS.register('vggface')
+def _load_vggface():
+    import_tensorflow()
+    import keras_vggface
+    return keras_vggface
+
+@EXTRACTORS.register('mobilenet')
+@CLASSIFIERS.register('nn')
+def _load_keras():
+    import_tensorflow()
+    import tensorflow.keras.models
+    return tensorflow.keras.models
+
+@EXTRACTORS.register('openface')
+def _load_openface():
+    sys.path.append('../../OpenFacePytorch')
+    import torch
+    from OpenFacePytorch import OpenFace
+    return OpenFace
+
+@CLASSIFIERS.register('knn', 'svm')
+def _load_sklearn():
+    # the pickled models need sklearn to be unpickled
+    import sklearn
+    return joblib
+
+@CLASSIFIERS.register('euclid', 'kmeans')
+def _load_numpy():
+    return np
 
 # def preprocess_image__(x):
 #         # Resize the image to have the shape of (128, 128)
@@ -57,16 +92,57 @@ def preprocess_image(img, target_size, norm=False):
         black = np.expand_dims(black, axis=0)
     return black
 
-def face_roi(frame, box):
+def face_roi(frame, box, target_size=None):
+    if isinstance(frame, FramePyramid):
+        # take the crop from the smallest pyramid level that still covers target_size
+        return frame.roi(box, target_size)
     (x1, y1, x2, y2) = box
     return frame[y1:y2, x1:x2]
 
+def roi_landmarks(box, landmarks):
+    '''Face landmarks [(x, y)] in frame coordinates to fractions of the box, as FeatureExtractor.feed takes them.'''
+    if landmarks is None:
+        return None
+    x1, y1, x2, y2 = box[:4]
+    return (np.asarray(landmarks, dtype=np.float32) - (x1, y1)) / (max(x2 - x1, 1), max(y2 - y1, 1))
+
+def _preprocessed_points(shape, points, target_size):
+    # where points given as fractions of a crop of this shape land in preprocess_image(crop, target_size)
+    height, width = shape[:2]
+    scale = target_size / max(height, width)
+    points = points * (width * scale, height * scale)
+    if height >= width:
+        points[:, 0] += (target_size - int(round(width * scale))) // 2
+    else:
+        points[:, 1] += (target_size - int(round(height * scale))) // 2
+    return points
+
+# dlib's nose point is the base of the nose (subnasale), MTCNN gives the tip: fraction of the way
+# from the tip to the mouth center where the base is placed (test/landmark_benchmark.py measures it)
+NOSE_BASE = 0.35
+# half of an eye width as a fraction of the distance between the eye centers
+EYE_CORNER = 0.207
+
+def dlib_five_points(points):
+    '''
+    MTCNN points (left eye, right eye, nose tip, mouth left, mouth right) to the order of dlib's
+    5 point model (right eye outer/inner corner, left eye outer/inner corner, nose base).
+    The eye corners are estimated from the eye centers, the nose base from the nose tip and the mouth.
+    '''
+    left_eye, right_eye, nose = points[0], points[1], points[2]
+    mouth = (points[3] + points[4]) / 2
+    d = EYE_CORNER * (right_eye - left_eye)
+    return [right_eye + d, right_eye - d, left_eye - d, left_eye + d, nose + NOSE_BASE * (mouth - nose)]
+
 class TrainOption(enum.Enum):
     RETRAIN = 1
     UPDATE = 2
     RUNONLY = 3
 
 class FeatureExtractor:
+    # side of the square face crop feed() preprocesses every face to (the dlib chip input)
+    target_size = 150
+
     def __init__(self, model_type='face_recognition', model_dir=None):
         self.model_dir = '/home/huy/face_recog/models/mobilenetv2_checkpoint_60-0.96.hdf5'
         self.input_shape = ()
@@ -74,50 +150,51 @@ class FeatureExtractor:
         self.model_type = model_type
         
         # load model
+        self.backend = EXTRACTORS.load(model_type)
         if model_type == 'dlib':
-            import dlib
+            dlib = self.backend
             model_path = os.path.abspath(os.path.join(__file__, '../../../../models/feature_extraction/dlib_face_recognition_resnet_model_v1.dat'))
             shape_predictor_path = os.path.abspath(os.path.join(__file__, '../../../../models/feature_extraction/shape_predictor_5_face_landmarks.dat'))
             self.shape_predictor = dlib.shape_predictor(shape_predictor_path)
             self.model = dlib.face_recognition_model_v1(model_path)
         elif model_type == 'vggface':
-            import keras_vggface
-            from keras_vggface.utils import preprocess_input
-
+            keras_vggface = self.backend
             self.model = keras_vggface.VGGFace(model='resnet50', include_top=False, input_shape=(224,224,3), pooling='avg')
             self.input_shape = (224, 224, 3)
             self.output_shape = (1,256)
         elif model_type == 'mobilenet':
-            self.model = load_model(self.model_dir)
-            self.model = Model(self.model.inputs, self.model.layers[-3].output)
+            models = self.backend
+            self.model = models.load_model(self.model_dir)
+            self.model = models.Model(self.model.inputs, self.model.layers[-3].output)
             self.input_shape = self.model.input_shape[1:]
             self.output_shape = self.model.output_shape[1:]
             self.model.use_learning_phase = False
         elif model_type == 'face_recognition':
-            import face_recognition
+            pass
         elif model_type == 'openface':
             # Open Face feature extractor
-            sys.path.append('../../OpenFacePytorch')
-            import torch
-            from OpenFacePytorch import OpenFace
-            self.model = OpenFace.prepareOpenFace()
+            self.model = self.backend.prepareOpenFace()
             self.model = self.model.eval()
-        else:
-            print('Feature Extractor type not found!')
-            raise NameError
             
-    def feed(self, input_data):
+    def feed(self, input_data, face_landmarks=None):
+        '''face_landmarks: optional five points per face from the detector (see roi_landmarks), None to predict them.'''
 #         if input_data != input_shape:
 #             print('Input shape not match!')
 #             raise ValueError
         features = []
-        input_data = [preprocess_image(img, 150) for img in input_data]
+        shapes = [img.shape for img in input_data]
+        input_data = [preprocess_image(img, self.target_size) for img in input_data]
         if self.model_type == 'dlib': 
-            import dlib
+            dlib = self.backend
             landmarks = []
-            for img in input_data:
+            for i, img in enumerate(input_data):
                 box = dlib.rectangle(0, 0, img.shape[0], img.shape[1])
-                landmark = self.shape_predictor(img, box)
+                if face_landmarks is not None and face_landmarks[i] is not None:
+                    # reuse the detector landmarks instead of running the shape predictor
+                    points = _preprocessed_points(shapes[i], face_landmarks[i], self.target_size)
+                    landmark = dlib.full_object_detection(box, [dlib.point(int(round(x)), int(round(y))) for x, y in dlib_five_points(points)])
+                else:
+                    landmark = self.shape_predictor(img, box)
                 objs = dlib.full_object_detections()
                 objs.append(landmark)
                 landmarks.append(objs)
@@ -126,7 +203,7 @@ class FeatureExtractor:
         elif self.model_type == 'face_recognition':
             for img in input_data:
                 known_face_box = [(0, img.shape[1], img.shape[0], 0)]
-                features.append(face_recognition.face_encodings(img, known_face_locations=known_face_box)[0])
+                features.append(self.backend.face_encodings(img, known_face_locations=known_face_box)[0])
         elif self.model_type == 'mobilenet':
             input_data = cv2.resize(input_data, self.input_shape[0:2])
             input_data = input_data.astype(np.float32) / 255
@@ -150,15 +227,138 @@ class FeatureExtractor:
         yhat = self.vgg_model.predict(sample)
         return yhat
 
+class CentroidClassifier:
+    '''
+    Nearest neighbour over a gallery of embeddings, every query-to-gallery distance of a batch from one
+    float32 GEMM: |q - g|^2 = |q|^2 - 2 q.g + |g|^2, with the gallery squared norms computed once.
+    metric: 'euclidean', or 'cosine' (L2-normalised embeddings, distance 1 - cos)
+    centroids: average the gallery embeddings of each label first (nearest centroid)
+    '''
+    def __init__(self, gallery, labels, metric='euclidean', centroids=False, batch_size=256):
+        gallery = np.asarray(gallery, dtype=np.float32)
+        gallery = gallery.reshape(-1, gallery.shape[-1])
+        labels = np.asarray(labels)
+        if len(labels) != len(gallery):
+            print('Gallery and labels sizes do not match!')
+            raise NameError
+        if metric not in ('euclidean', 'cosine'):
+            print('Metric not found!')
+            raise NameError
+        if centroids:
+            labels, inverse = np.unique(labels, return_inverse=True)
+            sums = np.zeros((len(labels), gallery.shape[1]), dtype=np.float32)
+            np.add.at(sums, inverse, gallery)
+            gallery = sums / np.bincount(inverse)[:, None]
+        self.metric = metric
+        self.labels = labels
+        self.gallery = self._normalize(gallery) if metric == 'cosine' else gallery
+        self.sq_norms = np.einsum('ij,ij->i', self.gallery, self.gallery)
+        # queries per GEMM, bounds the (batch, gallery) distance matrix
+        self.batch_size = batch_size
+
+    @staticmethod
+    def _normalize(x):
+        return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+
+    def _distances(self, queries):
+        dots = queries @ self.gallery.T
+        if self.metric == 'cosine':
+            return 1 - dots
+        sq_dist = np.einsum('ij,ij->i', queries, queries)[:, None] - 2 * dots + self.sq_norms
+        return np.sqrt(np.maximum(sq_dist, 0))
+
+    def kneighbors(self, queries, k=1):
+        '''(labels, distances) of the k nearest gallery entries of each query, both (N, k), nearest first.'''
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.gallery.shape[1])
+        if self.metric == 'cosine':
+            queries = self._normalize(queries)
+        k = min(k, len(self.gallery))
+        indices = np.empty((len(queries), k), dtype=np.int64)
+        distances = np.empty((len(queries), k), dtype=np.float32)
+        for start in range(0, len(queries), self.batch_size):
+            d = self._distances(queries[start:start + self.batch_size])
+            top = np.argpartition(d, k - 1, axis=1)[:, :k]
+            top_d = np.take_along_axis(d, top, axis=1)
+            order = np.argsort(top_d, axis=1)
+            indices[start:start + len(d)] = np.take_along_axis(top, order, axis=1)
+            distances[start:start + len(d)] = np.take_along_axis(top_d, order, axis=1)
+        return self.labels[indices], distances
+
+    def predict(self, queries, threshold):
+        '''Nearest label of each query, 'unknown' when it is further than threshold.'''
+        labels, distances = self.kneighbors(queries, 1)
+        return [str(label) if distance <= threshold else 'unknown' for label, distance in zip(labels[:, 0], distances[:, 0])]
+
+# extractor of the current worker process / thread of a ParallelFeatureExtractor
+_worker_extractor = None
+_thread_extractors = threading.local()
+
+def _init_process_worker(model_type):
+    global _worker_extractor
+    _worker_extractor = FeatureExtractor(model_type=model_type)
+
+def _process_feed(input_data, face_landmarks):
+    # dlib vectors do not pickle, send numpy arrays back
+    return [np.asarray(f, dtype=np.float32) for f in _worker_extractor.feed(input_data, face_landmarks)]
+
+class ParallelFeatureExtractor:
+    '''
+    FeatureExtractor sharding the crops of a call across a pool of workers, each with its own models
+    (for dlib its own shape_predictor and face_recognition_model_v1). Features come back in input order.
+    pool: 'thread' (dlib releases the GIL) or 'process'; both give the features as float32 numpy arrays
+    '''
+    def __init__(self, model_type='dlib', num_workers=None, pool='thread'):
+        from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+        self.model_type = model_type
+        self.num_workers = num_workers or os.cpu_count()
+        self.pool_type = pool
+        self.target_size = FeatureExtractor.target_size
+        if pool == 'thread':
+            self.pool = ThreadPoolExecutor(self.num_workers, initializer=self._init_thread)
+        elif pool == 'process':
+            self.pool = ProcessPoolExecutor(self.num_workers, initializer=_init_process_worker, initargs=(model_type,))
+        else:
+            print('Extractor pool not found!')
+            raise NameError
+
+    def _init_thread(self):
+        _thread_extractors.extractor = FeatureExtractor(model_type=self.model_type)
+
+    @staticmethod
+    def _thread_feed(input_data, face_landmarks):
+        return [np.asarray(f, dtype=np.float32) for f in _thread_extractors.extractor.feed(input_data, face_landmarks)]
+
+    def feed(self, input_data, face_landmarks=None):
+        if len(input_data) == 0:
+            return []
+        # one contiguous shard per worker keeps a single descriptor batch per worker
+        shards = np.array_split(np.arange(len(input_data)), min(self.num_workers, len(input_data)))
+        feed = self._thread_feed if self.pool_type == 'thread' else _process_feed
+        futures = [self.pool.submit(feed, [input_data[i] for i in shard],
+                                    None if face_landmarks is None else [face_landmarks[i] for i in shard])
+                   for shard in shards]
+        features = []
+        for future in futures:
+            features.extend(future.result())
+        return features
+
+    def close(self):
+        self.pool.shutdown()
+
 class FaceRecognition:
     FRAME_COUNT_TO_DECIDE = 10
-    def __init__(self, model_dir='', model_path='', feature_extractor_type='face_recognition', knn_opts=(7, 'euclidean', 'distance') , classifier_method='distance', trainopt=TrainOption.RUNONLY):
+    def __init__(self, model_dir='', model_path='', feature_extractor_type='face_recognition', knn_opts=(7, 'euclidean', 'distance') , classifier_method='distance', trainopt=TrainOption.RUNONLY, extractor_workers=0, extractor_pool='thread'):
         self.target_size = 128
         self.model_dir = model_dir
         self.result_buffer = []
         self.feature_extractor_type = feature_extractor_type
         self.classifier_method = classifier_method
-        self.feature_extractor = FeatureExtractor(model_type=feature_extractor_type)
+        if extractor_workers:
+            # shard the faces of a frame across extractor_workers threads / processes
+            self.feature_extractor = ParallelFeatureExtractor(feature_extractor_type, extractor_workers, extractor_pool)
+        else:
+            self.feature_extractor = FeatureExtractor(model_type=feature_extractor_type)
+        CLASSIFIERS.load(classifier_method)
             
         # if not os.path.exists(os.path.join(model_dir, 'model.dat')) or trainopt==TrainOption.RETRAIN:
         #     self.model = []
@@ -210,18 +410,27 @@ class FaceRecognition:
             self.knn = pickle.load(open(self.model_dir + '/knn_clf.pkl', 'rb'))
         elif self.classifier_method == 'nn':
             MODEL_DIR = '/home/huy/face_recog/models/nn/'
-            self.model = load_model(MODEL_DIR + 'mobilenetv2_checkpoint_60-0.96.hdf5')
+            self.model = CLASSIFIERS.load('nn').load_model(MODEL_DIR + 'mobilenetv2_checkpoint_60-0.96.hdf5')
             self.classes = np.load(MODEL_DIR + 'classes.npy')
         elif self.classifier_method == 'euclid':
             with open(os.path.join(self.model_dir, 'model.dat'), 'rb') as model_file:
                 self.model = np.load(model_file, allow_pickle=True)
             with open(os.path.join(self.model_dir, 'classes.dat'), 'rb') as classes_file:
                 self.classes = np.load(classes_file, allow_pickle=True)
+            # model: (identities, samples per identity, feature size), one class per identity
+            samples = self.model.shape[1] if self.model.ndim == 3 else 1
+            self.centroid_classifier = CentroidClassifier(self.model, np.repeat(self.classes, samples))
         elif self.classifier_method == 'svm':
             self.svm_clf = joblib.load(kwargs['model_path'])
 
-    def extract_feature(self, frames):
-        features = self.feature_extractor.feed(frames)
+    def extract_feature(self, frames, landmarks=None):
+        '''frames: face crops or a Detections (cropped at the extractor target size); landmarks: per face (see roi_landmarks) or a Detections.'''
+        if isinstance(frames, Detections):
+            landmarks = frames
+            frames = frames.crops(self.feature_extractor.target_size)
+        if isinstance(landmarks, Detections):
+            landmarks = landmarks.relative_landmarks()
+        features = self.feature_extractor.feed(frames, landmarks)
         return features
 
     def _knn_recog(self, features, **kwargs):
@@ -275,26 +484,13 @@ class FaceRecognition:
 #         return result
 
     def _distance_recog(self, features, recog_level=1, threshold=0.5):
+        result = []
         try:
-            result = []
-            for feature in features:
-                predict_label = 'unknown'
-                prepare_list = np.repeat([[feature]], len(self.model), axis=0)
-                result_list = np.linalg.norm(prepare_list-self.model, axis=2)
-                min_distance = np.min(result_list)
-                # print(min_distance, np.argmin(result_list))
-                # print(prepare_list.shape, self.model.shape, result_list.shape)
-                predict_label = [self.classes[np.argmin(result_list)]]
-                
-                if min_distance > threshold:
-                    result.append('unknown')
-                else:
-                    result.append(predict_label)
+            # all the query-to-gallery distances of the frame in one GEMM
+            result = self.centroid_classifier.predict(features, threshold)
         except:
-            # print(result_list)
             traceback.print_exc()
-            print('target_face.shape', features.shape)
-            print('np.argmin(result_list)', np.argmin(result_list))
+            print('features shape', np.shape(features))
         return result
         # match_count = 0
         # total_count = 0
@@ -334,6 +530,26 @@ class FaceRecognition:
             traceback.print_exc()
         return result
 
+    def predict_proba(self, features):
+        '''(classes, (N, C) class probabilities) of the knn, svm and nn classifiers.'''
+        if self.classifier_method == 'knn':
+            return self.knn.classes_, self.knn.predict_proba(features)
+        elif self.classifier_method == 'svm':
+            return self.svm_clf.classes_, self.svm_clf.predict_proba(features)
+        elif self.classifier_method == 'nn':
+            return self.classes, self.model.predict(np.asarray(features))
+        print(f'{self.classifier_method} classifier has no probabilities!')
+        raise NameError
+
+    def recog_proba(self, features, **kwargs):
+        '''recog() labels with the class probabilities of each feature (None without), from one classifier call.'''
+        if self.classifier_method not in ('knn', 'svm', 'nn'):
+            return self.recog(features, **kwargs), None
+        classes, probas = self.predict_proba(features)
+        best = np.argmax(probas, axis=1)
+        result = [str(classes[j]) if proba[j] >= kwargs['threshold'] else 'unknown' for j, proba in zip(best, probas)]
+        return [r.split('_')[0] for r in result], probas
+
     def recog(self, features, **kwargs):
         if self.classifier_method == 'knn':
             result = self._knn_recog(features, **kwargs)
@@ -426,6 +642,7 @@ class ModelTraining:
         return parts
 
     def process_batch(self, d):
+        from tqdm import tqdm
         count = 0
         features = []
         ids = []
@@ -470,6 +687,7 @@ class ModelTraining:
         return output
 
     def train_knn(self, features, labels, K=7, metric='euclidean', weights='distance', output_model_location='.'):
+        from sklearn.neighbors import KNeighborsClassifier
         knn = KNeighborsClassifier(n_neighbors=K, metric=metric, weights=weights)
         model_pkl = open(os.path.join(output_model_location, 'knn_clf.pkl'), 'wb')
         knn.fit(features, labels)
@@ -1 +1,2 @@
-from .tracking import Object, Tracking
\ No newline at end of file
+from .tracking import Object, Tracking
+from .selection import TopKSelector
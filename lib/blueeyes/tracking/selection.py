@@ -0,0 +1,86 @@
+'''
+Per-track top-K frame selection in front of the feature extraction.
+Faces are followed from frame to frame by box overlap (no feature needed), and a face is only
+sent to the extractor while its track has fewer than K embeddings or when it beats the worst of
+the K best qualities kept for the track. Extractor calls then grow with the number of people
+instead of frames x faces.
+'''
+import numpy as np
+
+from ..face_detection.detections import box_iou
+
+class _Track:
+    def __init__(self, box, frame_count):
+        self.box = box
+        self.qualities = []
+        self.last_seen = frame_count
+
+class TopKSelector:
+    def __init__(self, k=10, iou_threshold=0.3, max_missed=10):
+        '''
+        k: embeddings kept per track
+        iou_threshold: minimum overlap with the last box of a track to continue it
+        max_missed: frames without a match after which a track is dropped
+        '''
+        self.k = k
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.tracks = []
+        self.frame_count = 0
+        self.selected = 0
+        self.seen = 0
+
+    def _match(self, boxes):
+        # greedy IoU matching of the boxes to the tracks, -1 for a new track
+        matches = np.full(len(boxes), -1)
+        if not self.tracks or len(boxes) == 0:
+            return matches
+        ious = box_iou(boxes, np.array([track.box for track in self.tracks]))
+        while True:
+            i, j = np.unravel_index(np.argmax(ious), ious.shape)
+            if ious[i, j] < self.iou_threshold:
+                break
+            matches[i] = j
+            ious[i, :] = -1
+            ious[:, j] = -1
+        return matches
+
+    def select(self, detections, qualities):
+        '''Boolean mask of the faces of a Detections whose embedding should be extracted this frame.'''
+        self.frame_count += 1
+        mask = np.zeros(len(detections), dtype=bool)
+        matches = self._match(detections.boxes)
+        for i, (box, quality) in enumerate(zip(detections.boxes, qualities)):
+            if matches[i] < 0:
+                track = _Track(box, self.frame_count)
+                self.tracks.append(track)
+            else:
+                track = self.tracks[matches[i]]
+                track.box = box
+                track.last_seen = self.frame_count
+            if len(track.qualities) < self.k:
+                track.qualities.append(quality)
+                mask[i] = True
+            elif quality > min(track.qualities):
+                track.qualities.remove(min(track.qualities))
+                track.qualities.append(quality)
+                mask[i] = True
+        self.tracks = [track for track in self.tracks if self.frame_count - track.last_seen <= self.max_missed]
+        self.seen += len(detections)
+        self.selected += int(mask.sum())
+        return mask
+
+    def reset(self, box):
+        '''
+        Forget the qualities of the track of a box, e.g. once its tracking object is decided and cleared,
+        so its next K faces are extracted again for the next decision.
+        '''
+        if not self.tracks:
+            return
+        ious = box_iou([box], [track.box for track in self.tracks])[0]
+        j = int(np.argmax(ious))
+        if ious[j] >= self.iou_threshold:
+            self.tracks[j].qualities = []
+
+    def stats(self):
+        return {'tracks': len(self.tracks), 'faces': self.seen, 'selected': self.selected}
@@ -10,26 +10,60 @@ import time
 import threading
 import numpy as np
 
+from ..face_detection.detections import box_iou
+
 class Object:
-    def __init__(self, box, feature, face_img):
-        self.time = time.time()
+    def __init__(self, box, feature, face_img, t=None):
+        self.time = time.time() if t is None else t
         self.bounding_boxes = [box]
+        # latest position, also moved by the faces that were not sent to the feature extractor
+        self.box = box
         self.features = [feature]
         self.prediction = []
         self.face_imgs = [face_img]
+        # label of each feature, classified once on arrival, with the running votes and probabilities
+        self.labels = []
+        self.votes = {}
+        self.proba_sum = None
+        self.proba_count = 0
+        self.last_proba = None
     def insert(self, box, feature, face_img):
         self.bounding_boxes.append(box)
+        self.box = box
         self.features.append(feature)
         self.face_imgs.append(face_img)
+    def vote(self, label, proba=None):
+        self.labels.append(label)
+        self.votes[label] = self.votes.get(label, 0) + 1
+        self.last_proba = proba
+        if proba is not None:
+            self.proba_sum = proba if self.proba_sum is None else self.proba_sum + proba
+            self.proba_count += 1
+    def majority(self):
+        '''Most voted label and its share of the votes, ties go to the label voted first.'''
+        if not self.votes:
+            return None, 0
+        label = max(self.votes, key=self.votes.get)
+        return label, self.votes[label] / len(self.labels)
+    def mean_proba(self):
+        return None if self.proba_sum is None else self.proba_sum / self.proba_count
     def get_location(self):
-        box = self.bounding_boxes[-1]
+        box = self.box
         x = (box[1]+box[3])/2
         return x
-    def live_time(self):
-        return time.time() - self.time
+    def live_time(self, now=None):
+        if now is None:
+            now = time.time()
+        return now - self.time
     def clear_except_last(self):
         self.bounding_boxes = [self.bounding_boxes[-1]]
         self.features = [self.features[-1]]
+        if self.labels:
+            self.labels = [self.labels[-1]]
+            self.votes = {self.labels[0]: 1}
+            # keep the probabilities of the last feature with its label
+            self.proba_sum = self.last_proba
+            self.proba_count = 0 if self.last_proba is None else 1
     
 class Tracking:
     def __init__(self, method, deadline = 400, threshold = 0.5, max_live_time = 10, **kwargs):
@@ -39,16 +73,58 @@ class Tracking:
         self.max_live_time = max_live_time
         self.method = method
         self.FRAME_WIDTH = kwargs['FRAME_WIDTH']
-    def push(self, faces_info):
-        if not self.buffer:
-            for info in faces_info:
+        # replaced by the media clock of a replayed clip to make runs deterministic
+        self.clock = kwargs.get('clock', time.time)
+        # classify(features) -> (labels, probabilities or None), e.g. FaceRecognition.recog_proba;
+        # each feature is classified once when it is pushed and its vote is kept on its object
+        self.classify = kwargs.get('classify')
+    def push(self, faces_info, votes=None):
+        if votes is None:
+            votes = self._classify([info[1] for info in faces_info])
+        new_objects = not self.buffer
+        for info, vote in zip(faces_info, votes):
+            if new_objects:
                 box, feature, face_img = info
-                self.buffer.append(Object(box, feature, face_img))
-        else:
-            for info in faces_info:
-                self._asign_to_obj(info)
+                obj = Object(box, feature, face_img, self.clock())
+                self.buffer.append(obj)
+            else:
+                obj = self._asign_to_obj(info)
+            if vote is not None and obj is not None:
+                obj.vote(*vote)
         # self._check_buffer_status()
 
+    def push_detections(self, detections, features, face_imgs=None):
+        '''push() the faces of a Detections one by one, face_imgs default to its crops.'''
+        if face_imgs is None:
+            face_imgs = detections.crops()
+        # one classifier call for the faces of the frame
+        votes = self._classify(list(features))
+        for face_info, vote in zip(zip(detections, features, face_imgs), votes):
+            self.push([face_info], [vote])
+
+    def move(self, boxes, iou_threshold=0.3):
+        '''Move the objects overlapping faces pushed without a feature (left out of the extraction this frame).'''
+        boxes = np.asarray(list(boxes)).reshape(-1, 4)
+        if not self.buffer or len(boxes) == 0:
+            return
+        ious = box_iou(boxes, [obj.box for obj in self.buffer])
+        for i, j in enumerate(np.argmax(ious, axis=1)):
+            if ious[i, j] >= iou_threshold:
+                self.buffer[j].box = tuple(boxes[i].tolist())
+
+    def _classify(self, features):
+        if self.classify is None or len(features) == 0:
+            return [None] * len(features)
+        labels, probas = self.classify(features)
+        return [(label, None if probas is None else probas[i]) for i, label in enumerate(labels)]
+
+    def decision(self, i):
+        '''Majority label of object i and its share of the votes, from the votes kept while pushing.'''
+        if i < self.count():
+            return self.buffer[i].majority()
+        else:
+            return None
+
     def count(self):
         return len(self.buffer)
     
@@ -81,9 +157,9 @@ class Tracking:
         i = 0
         while i < len(self.buffer):
             if self.buffer[i].get_location() > self.deadline \
-                    or self.buffer[i].live_time() > self.max_live_time \
-                    or self.box_history(i)[-1][0] > self.FRAME_WIDTH*0.8 \
-                    or self.box_history(i)[-1][0] < self.FRAME_WIDTH*0.2:
+                    or self.buffer[i].live_time(self.clock()) > self.max_live_time \
+                    or self.buffer[i].box[0] > self.FRAME_WIDTH*0.8 \
+                    or self.buffer[i].box[0] < self.FRAME_WIDTH*0.2:
                 del(self.buffer[i])
                 i -= 1
             i += 1
@@ -95,9 +171,12 @@ class Tracking:
             prepare_list = np.repeat([feature], len(last_features), axis=0)
             distances = np.linalg.norm(prepare_list-last_features, axis=1)
             if np.min(distances) < self.threshold:
-                self.buffer[np.argmin(distances)].insert(box, feature, face_img)
+                obj = self.buffer[np.argmin(distances)]
+                obj.insert(box, feature, face_img)
             else:
-                self.buffer.append(Object(box, feature))
+                obj = Object(box, feature, face_img, self.clock())
+                self.buffer.append(obj)
+            return obj
         if self.method == 'distance':
             centers = []
             for obj in self.buffer:
@@ -1,2 +1,10 @@
 from .camera import Camera
-from .wdt import WDT
\ No newline at end of file
+from .camera_pool import CameraPool
+from .process_camera import ProcessCameraPool
+from .backend import BackendRegistry, import_tensorflow
+from .benchmark import Benchmark
+from .frame_buffer import FrameRingBuffer, FrameSlot
+from .frameskip import AdaptiveFrameSkip
+from .pyramid import FramePyramid
+from .replay import ReplayCamera
+from .wdt import WDT
@@ -0,0 +1,68 @@
+'''
+Lazy backend registry: detector, feature extractor and classifier backends are
+registered by name with a loader, and the loader (with its heavy imports such as
+TensorFlow, torch or dlib) only runs the first time the backend is selected.
+'''
+import time
+import logging
+
+logging.basicConfig(level=logging.DEBUG)
+
+class BackendRegistry:
+    def __init__(self, kind):
+        self.kind = kind
+        self._loaders = {}
+        self._loaded = {}
+
+    def register(self, *names):
+        def decorator(loader):
+            for name in names:
+                self._loaders[name] = loader
+            return loader
+        return decorator
+
+    def load(self, name):
+        '''Import the backend on first use and return what its loader returned.'''
+        if name not in self._loaders:
+            print(f'{self.kind} backend {name} not found!')
+            raise NameError
+        if name not in self._loaded:
+            t = time.time()
+            self._loaded[name] = self._loaders[name]()
+            logging.debug(f'Loaded {self.kind} backend {name} in {time.time() - t:.2f}s')
+        return self._loaded[name]
+
+    def names(self):
+        return list(self._loaders)
+
+    def loaded(self):
+        return list(self._loaded)
+
+    def __contains__(self, name):
+        return name in self._loaders
+
+_tensorflow_session = None
+
+def import_tensorflow():
+    '''Import TensorFlow with allow_growth set on every session; runs once, only for the TF backends.'''
+    global _tensorflow_session
+    import tensorflow.compat.v1 as tf
+    if _tensorflow_session is not None:
+        return tf
+    from tensorflow.compat.v1.keras.backend import set_session
+
+    # set allow_growth for tensorflow
+    oldinit = tf.Session.__init__
+    def new_tfinit(session, target='', graph=None, config=None):
+        print("Set config.gpu_options.allow_growth to True")
+        config = tf.ConfigProto()
+        config.gpu_options.allow_growth = True
+        oldinit(session, target, graph, config)
+    tf.Session.__init__ = new_tfinit
+
+    config = tf.ConfigProto()
+    config.gpu_options.allow_growth = True  # dynamically grow the memory used on the GPU
+    config.log_device_placement = True  # to log device placement (on which device the operation ran)
+    _tensorflow_session = tf.Session(config=config)
+    set_session(_tensorflow_session)
+    return tf
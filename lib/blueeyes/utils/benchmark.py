@@ -0,0 +1,79 @@
+'''
+Throughput benchmark collected while the pipeline runs: frames/s, per-stage
+timings and the recognition events produced, summarised at the end of a run.
+'''
+import json
+import time
+import numpy as np
+from contextlib import contextmanager
+from collections import defaultdict
+
+class Benchmark:
+    def __init__(self, name=''):
+        self.name = name
+        self.stage_times = defaultdict(list)
+        self.events = []
+        self.frames = 0
+        self.start_time = None
+        self.end_time = None
+
+    def start(self):
+        self.start_time = time.time()
+        return self
+
+    def stop(self):
+        self.end_time = time.time()
+
+    def frame(self, execution_time=None):
+        '''Count a processed frame, optionally with a {stage: seconds} dict of its timings.'''
+        if self.start_time is None:
+            self.start()
+        self.frames += 1
+        if execution_time:
+            for name, seconds in execution_time.items():
+                self.stage_times[name].append(seconds)
+
+    @contextmanager
+    def stage(self, name):
+        t = time.time()
+        try:
+            yield
+        finally:
+            self.stage_times[name].append(time.time() - t)
+
+    def event(self, **kwargs):
+        self.events.append(kwargs)
+
+    def summary(self):
+        end_time = self.end_time or time.time()
+        elapsed = end_time - self.start_time if self.start_time else 0.0
+        stages = {}
+        for name, times in self.stage_times.items():
+            times = np.asarray(times)
+            stages[name] = {
+                'count': int(times.size),
+                'total': float(times.sum()),
+                'mean': float(times.mean()),
+                'p50': float(np.percentile(times, 50)),
+                'p95': float(np.percentile(times, 95)),
+                'max': float(times.max()),
+            }
+        return {
+            'name': self.name,
+            'frames': self.frames,
+            'elapsed': elapsed,
+            'fps': self.frames / elapsed if elapsed > 0 else 0.0,
+            'stages': stages,
+            'events': self.events,
+        }
+
+    def report(self, path=None):
+        summary = self.summary()
+        print(f"{summary['name']}: {summary['frames']} frames in {summary['elapsed']:.2f}s ({summary['fps']:.2f} frames/s)")
+        for name, stage in summary['stages'].items():
+            print(f"  {name:<16} mean {stage['mean']*1000:8.2f}ms  p95 {stage['p95']*1000:8.2f}ms  total {stage['total']:8.2f}s")
+        print(f"  {len(summary['events'])} recognition events")
+        if path is not None:
+            with open(path, 'w') as f:
+                json.dump(summary, f, indent=2, default=str)
+        return summary
@@ -1,17 +1,35 @@
 import os
 import cv2
-import queue
+import time
 import logging
-import threading
+import numpy as np
 from threading import Thread, Lock
 
+from .frame_buffer import FrameRingBuffer
+from .pyramid import FramePyramid
+from .reconnect import StreamHealth
+
 logging.basicConfig(level=logging.DEBUG)
 
+def crop_frame(frame, crop):
+    # crop: (top, right, bottom, left) given as fraction of the frame size
+    height, width = frame.shape[:2]
+    h1 = int(crop[0]*height)
+    h2 = int((1-crop[2])*height)
+    w1 = int(crop[3]*width)
+    w2 = int((1-crop[1])*width)
+    return frame[h1:h2, w1:w2]
+
 class Camera(Thread):
     lock = Lock()
-    def __init__(self, source, frameskip=1, crop=(0.1, 0, 0, 0)):
+    def __init__(self, source, frameskip=1, crop=(0.1, 0, 0, 0), buffer_size=3, pyramid_scales=None,
+                 stall_timeout=5, max_failures=25):
         Thread.__init__(self)
-        self.cap = cv2.VideoCapture(source)
+        # a stalled live stream is reopened with exponential backoff, network streams get a read timeout
+        self.health = StreamHealth(source, stall_timeout=stall_timeout, max_failures=max_failures)
+        self.cap = self.health.open()
+        # capture reopened in the background, swapped in by the decoding thread
+        self._next_cap = None
         self.source = source
         self.source_frame_width = self.cap.get(cv2.CAP_PROP_FRAME_WIDTH) 
         self.source_frame_height = self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
@@ -19,15 +37,37 @@ class Camera(Thread):
         self.frame_height = int(self.source_frame_height*(1 - crop[0]+crop[2]))
         self.frameskip = frameskip
         self.crop = crop
-        self.img_queue = queue.Queue(maxsize=1)
+        # decoded frames live in preallocated slots, consumers borrow them without copying
+        self.buffer = FrameRingBuffer(buffer_size)
+        if self.source_frame_width and self.source_frame_height:
+            self.buffer.allocate((int(self.source_frame_height), int(self.source_frame_width), 3))
+        self.skipped = 0
+        # (lost, decoded) buffer counters at the previous drop_rate() call
+        self._drop_marks = (0, 0)
+        # levels built for every frame returned by read_pyramid(), e.g. {'detector': 2, 'display': 2}
+        self.pyramid_scales = pyramid_scales
         self.state = 'run'
-        if os.path.exists(source):
+        if os.path.exists(str(source)):
             self.is_video = True
         else:
             self.is_video = False
 
     def restart(self):
-        self.cap = cv2.VideoCapture(self.source)
+        '''Reopen the stream in the background, the decoding thread swaps the new capture in.'''
+        self.health.reconnect_async(self._hand_over, lambda: self.state == 'run')
+
+    def _hand_over(self, cap):
+        # reconnect thread: never touch self.cap here, the decoding thread may be inside grab()
+        self._next_cap = cap
+
+    def _swap_capture(self):
+        cap, self._next_cap = self._next_cap, None
+        with self.lock:
+            old, self.cap = self.cap, cap
+        old.release()
+
+    def reconnecting(self):
+        return self.health.reconnecting
         
     def get(self, param):
         if param == cv2.CAP_PROP_FRAME_WIDTH:
@@ -38,43 +78,131 @@ class Camera(Thread):
 
     def isOpened(self):
         return self.cap.isOpened()
+
+    def _decode_into_slot(self):
+        '''Decode the next frame into a slot, None when a video file is still waiting for the consumer.'''
+        if self.is_video:
+            # a file is never dropped: the decoder waits until the consumer gives a slot back
+            slot = self.buffer.acquire(overwrite=False, timeout=0.1)
+            if slot is None:
+                return None
+        else:
+            slot = self.buffer.acquire()
+        if slot is None:
+            # every slot is busy, skip decoding this frame
+            return self.cap.grab()
+        index, image = slot
+        if image is None:
+            ret, frame = self.cap.read()
+        else:
+            ret, frame = self.cap.read(image=image)
+        if not ret:
+            self.buffer.abort(index)
+            return False
+        capture_ts = time.time()
+        if image is None or frame.ctypes.data != image.ctypes.data:
+            # first frame or the stream changed resolution
+            self.buffer.allocate(frame.shape)
+            image = self.buffer.image(index)
+            np.copyto(image, frame)
+        self.buffer.commit(index, capture_ts, crop_frame(image, self.crop))
+        return True
+
     def run(self):
         frame_count = 0
+        self.health.frame()
+        if not self.is_video:
+            # notices a stall even while grab() is still blocked
+            self.health.watch(self._hand_over, lambda: self.state == 'run')
         while self.state == 'run':
-            ret, frame = self.cap.read()
+            if self._next_cap is not None:
+                self._swap_capture()
+            if self.health.reconnecting:
+                time.sleep(0.01)
+                continue
+            if frame_count % max(1, self.frameskip) == 0:
+                ret = self._decode_into_slot()
+                if ret is None:
+                    continue
+            else:
+                ret = self.cap.grab()
+                self.skipped += ret
             if ret:
-                if frame_count % self.frameskip == 0:
-                    if frame_count > 1000:
-                        frame_count = 0
-                    h1 = int(self.crop[0]*self.source_frame_height)
-                    h2 = int((1-self.crop[2])*self.source_frame_height)
-                    w1 = int(self.crop[3]*self.source_frame_width)
-                    w2 = int((1-self.crop[1])*self.source_frame_width)
-                    frame = frame[h1:h2, w1:w2]
-                    try:
-                        self.img_queue.put_nowait(frame)
-                    except queue.Full:
-                        pass
+                self.health.frame()
                 frame_count += 1
+                if frame_count > 1000:
+                    frame_count = 0
             elif self.is_video:
                 self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            elif self.health.failure():
+                self.restart()
+        self.cap.release()
 
     def set(self, parameter, value):
+        if parameter == 'skip':
+            self.frameskip = value
+            return
         if self.lock.acquire(False):
             self.cap.set(parameter, value)
             self.lock.release()
-        if parameter == 'skip':
-            self.frameskip = value
+
+    def borrow(self, timeout=None):
+        '''
+        Zero-copy read: return a FrameSlot (seq, timestamp, frame) or None on timeout.
+        The frame is only valid until the slot is given back with release().
+        Like read(), a live stream gives its freshest frame and a video file the next one in order.
+        '''
+        return self.buffer.borrow(timeout, latest=not self.is_video)
+
+    def release(self, slot):
+        self.buffer.release(slot)
+
     def read(self):
-        try:
-            frame = self.img_queue.get()
-            self.img_queue.task_done()    
-            return (True, frame)
-        except queue.Empty:
+        slot = self.borrow()
+        if slot is None:
             print('empty image queue')
             return (False, [])
+        # the caller owns the returned frame, so it is copied out of the slot
+        frame = slot.frame.copy()
+        self.buffer.release(slot)
+        return (True, frame)
+
+    def read_pyramid(self):
+        '''
+        Zero-copy read: the pyramid is built on the borrowed slot, which stays out of the ring
+        buffer until pyramid.release() is called.
+        '''
+        slot = self.borrow()
+        if slot is None:
+            print('empty image queue')
+            return (False, None)
+        pyramid = FramePyramid(slot.frame, self.pyramid_scales, seq=slot.seq, timestamp=slot.timestamp,
+                               release=lambda: self.buffer.release(slot))
+        return (True, pyramid)
+
+    def occupancy(self):
+        return self.buffer.occupancy()
+
+    def drop_rate(self):
+        '''
+        Share of the frames decoded since the previous call that never reached the consumer (overwritten,
+        replaced by a newer one or without a free slot). Unlike occupancy() it does not pin near 1 as soon
+        as the consumer is slower than the camera.
+        '''
+        stats = self.buffer.stats()
+        lost = stats['dropped'] + stats['overrun']
+        decoded = stats['written'] + stats['overrun']
+        last_lost, last_decoded = self._drop_marks
+        self._drop_marks = (lost, decoded)
+        return (lost - last_lost) / max(decoded - last_decoded, 1)
+
+    def stats(self):
+        stats = self.buffer.stats()
+        stats['skipped'] = self.skipped
+        stats.update(self.health.stats())
+        return stats
+
     def stop(self):
         self.state = 'stop'
     def __del__(self):
         self.stop()
-        
\ No newline at end of file
@@ -0,0 +1,306 @@
+'''
+Multiplex many video sources (RTSP, video files, webcams) in one process.
+Sources are decoded by a bounded set of worker threads and the frames are
+delivered in a fair round-robin so that one detector/recognizer instance can
+serve every camera.
+The captures are opened by the workers themselves, so slow RTSP handshakes of
+different shards run in parallel instead of one after another in the constructor.
+'''
+import os
+import cv2
+import time
+import logging
+from threading import Thread, Condition
+
+from .camera import crop_frame
+from .pyramid import FramePyramid
+from .reconnect import StreamHealth
+
+logging.basicConfig(level=logging.DEBUG)
+
+class _Source:
+    def __init__(self, source_id, source, frameskip, crop, stall_timeout=5, max_failures=25):
+        self.source_id = source_id
+        self.source = source
+        self.frameskip = max(1, frameskip)
+        self.crop = crop
+        self.health = StreamHealth(source, stall_timeout=stall_timeout, max_failures=max_failures)
+        # opened by the worker owning this source, see open()
+        self.cap = None
+        # capture reopened in the background, swapped in by the worker on its next grab()
+        self._next_cap = None
+        self.is_video = isinstance(source, str) and os.path.exists(source)
+        self.frame_index = -1
+        # latest decoded frame waiting for the consumer: (frame_index, capture_ts, frame)
+        self.pending = None
+        self.decoded = 0
+        self.delivered = 0
+        self.dropped = 0
+        # (dropped, decoded) at the previous CameraPool.drop_rate() call
+        self.drop_marks = (0, 0)
+
+    def open(self, is_running=lambda: True):
+        self.cap = self.health.open()
+        self.health.frame()
+        if not self.is_video:
+            # notices a stall even while the worker is still blocked in grab()
+            self.health.watch(self._reconnected, is_running)
+
+    def grab(self, is_running=lambda: True):
+        if self._next_cap is not None:
+            old, self.cap, self._next_cap = self.cap, self._next_cap, None
+            old.release()
+        if self.health.reconnecting:
+            # the capture is being reopened in the background, the rest of the shard keeps going
+            return False
+        ret = self.cap.grab()
+        if not ret:
+            if self.is_video:
+                self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            elif self.health.failure():
+                self.health.reconnect_async(self._reconnected, is_running)
+            return False
+        self.health.frame()
+        self.frame_index += 1
+        return True
+
+    def _reconnected(self, cap):
+        # reconnect thread: the worker may still be inside grab() on the old capture, it swaps itself
+        self._next_cap = cap
+
+    def retrieve(self):
+        ret, frame = self.cap.retrieve()
+        if not ret:
+            return None
+        self.decoded += 1
+        if any(self.crop):
+            frame = crop_frame(frame, self.crop)
+        return frame
+
+    def release(self):
+        if self.cap is not None:
+            self.cap.release()
+        if self._next_cap is not None:
+            self._next_cap.release()
+
+class _SourceHandle:
+    '''
+    Camera-like view of one source of a pool (frameskip, get, set, drop_rate, reconnecting),
+    e.g. for an AdaptiveFrameSkip per camera.
+    '''
+    def __init__(self, pool, source_id):
+        self.pool = pool
+        self.source_id = source_id
+
+    @property
+    def frameskip(self):
+        return self.pool._find(self.source_id).frameskip
+
+    def get(self, param):
+        return self.pool.get(self.source_id, param)
+
+    def set(self, parameter, value):
+        self.pool.set(self.source_id, parameter, value)
+
+    def drop_rate(self):
+        return self.pool.drop_rate(self.source_id)
+
+    def reconnecting(self):
+        return self.pool.reconnecting(self.source_id)
+
+class CameraPool:
+    '''
+    Usage:
+        pool = CameraPool({'gate1': 'rtsp://...', 'gate2': 'clip.mp4', 'webcam': 0}, num_workers=2)
+        pool.start()
+        for source_id, frame_index, capture_ts, frame in pool:
+            ...
+        pool.stop()
+    or, with pyramid_scales, source_id, pyramid = pool.read_pyramid() like Camera.read_pyramid().
+    '''
+    def __init__(self, sources, num_workers=None, frameskip=1, crop=(0, 0, 0, 0), stall_timeout=5, max_failures=25,
+                 pyramid_scales=None):
+        self.state = 'stop'
+        self._workers = []
+        self._cond = Condition()
+        self._next = 0
+        if not isinstance(sources, dict):
+            sources = dict(enumerate(sources))
+        if not sources:
+            raise ValueError(f'{type(self).__name__} needs at least one source')
+        if num_workers is None:
+            num_workers = min(len(sources), os.cpu_count() or 1)
+        self.num_workers = max(1, min(num_workers, len(sources)))
+        self.frameskip = frameskip
+        self.crop = crop
+        self.stall_timeout = stall_timeout
+        self.max_failures = max_failures
+        self.pyramid_scales = pyramid_scales
+        self.sources = [self._make_source(i, source_id, source) for i, (source_id, source) in enumerate(sources.items())]
+        self._by_id = {src.source_id: src for src in self.sources}
+
+    def _make_source(self, index, source_id, source):
+        return _Source(source_id, source, self.frameskip, self.crop, self.stall_timeout, self.max_failures)
+
+    def __len__(self):
+        return len(self.sources)
+
+    def source_ids(self):
+        return [src.source_id for src in self.sources]
+
+    def source(self, source_id):
+        return _SourceHandle(self, source_id)
+
+    def isOpened(self):
+        '''False until the workers opened every capture, see wait_opened().'''
+        return all(src.cap is not None and src.cap.isOpened() for src in self.sources)
+
+    def wait_opened(self, timeout=10):
+        deadline = time.time() + timeout
+        while time.time() < deadline and any(src.cap is None for src in self.sources):
+            time.sleep(0.05)
+        return self.isOpened()
+
+    def get(self, source_id, param):
+        src = self._find(source_id)
+        if src.cap is None:
+            return 0
+        value = src.cap.get(param)
+        # size of the cropped frames, like Camera.get
+        if param == cv2.CAP_PROP_FRAME_WIDTH:
+            return int((1 - self.crop[1]) * value) - int(self.crop[3] * value)
+        if param == cv2.CAP_PROP_FRAME_HEIGHT:
+            return int((1 - self.crop[2]) * value) - int(self.crop[0] * value)
+        return value
+
+    def set(self, source_id, parameter, value):
+        src = self._find(source_id)
+        if parameter == 'skip':
+            src.frameskip = max(1, value)
+        elif src.cap is not None:
+            src.cap.set(parameter, value)
+
+    def _find(self, source_id):
+        return self._by_id[source_id]
+
+    def start(self):
+        self.state = 'run'
+        # each worker owns a fixed shard of the sources, so a capture is never touched by two threads
+        for i in range(self.num_workers):
+            shard = self.sources[i::self.num_workers]
+            worker = Thread(target=self._decode, args=(shard,), daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        return self
+
+    def _decode(self, shard):
+        for src in shard:
+            if self.state == 'run':
+                src.open(lambda: self.state == 'run')
+        while self.state == 'run':
+            got_frame = False
+            for src in shard:
+                if not src.grab(lambda: self.state == 'run'):
+                    continue
+                got_frame = True
+                if src.frame_index % src.frameskip != 0:
+                    continue
+                frame = src.retrieve()
+                if frame is None:
+                    continue
+                with self._cond:
+                    if src.pending is not None:
+                        src.dropped += 1
+                    src.pending = (src.frame_index, time.time(), frame)
+                    self._cond.notify()
+            if not got_frame:
+                # every source of this shard failed to deliver, avoid spinning
+                time.sleep(0.01)
+        for src in shard:
+            src.release()
+
+    def read(self, timeout=None):
+        '''
+        Return the next (source_id, frame_index, capture_ts, frame) in round-robin order,
+        or None when no frame arrived within timeout.
+        '''
+        deadline = None if timeout is None else time.time() + timeout
+        n = len(self.sources)
+        with self._cond:
+            while self.state == 'run':
+                for k in range(n):
+                    i = (self._next + k) % n
+                    src = self.sources[i]
+                    if src.pending is not None:
+                        item = src.pending
+                        src.pending = None
+                        src.delivered += 1
+                        self._next = i + 1
+                        self._on_delivered(src, item)
+                        frame_index, capture_ts, frame = item[:3]
+                        return (src.source_id, frame_index, capture_ts, frame)
+                if deadline is None:
+                    self._cond.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return None
+                    self._cond.wait(remaining)
+        return None
+
+    def read_pyramid(self, timeout=None):
+        '''
+        Next (source_id, FramePyramid) in round-robin order, (None, None) when no frame arrived within timeout.
+        The full level is the frame read() returns, with the same lifetime; release() is a no-op
+        kept for the Camera interface.
+        '''
+        item = self.read(timeout)
+        if item is None:
+            return (None, None)
+        source_id, frame_index, capture_ts, frame = item
+        return (source_id, FramePyramid(frame, self.pyramid_scales, seq=frame_index, timestamp=capture_ts))
+
+    def _on_delivered(self, src, item):
+        # called with the lock held when a pending frame is handed to the consumer
+        pass
+
+    def __iter__(self):
+        while self.state == 'run':
+            item = self.read(timeout=1)
+            if item is not None:
+                yield item
+
+    def drop_rate(self, source_id):
+        '''Share of the frames of source_id decoded since the previous call that a newer frame replaced unread.'''
+        src = self._find(source_id)
+        dropped, decoded = src.dropped, src.decoded
+        last_dropped, last_decoded = src.drop_marks
+        src.drop_marks = (dropped, decoded)
+        return (dropped - last_dropped) / max(decoded - last_decoded, 1)
+
+    def reconnecting(self, source_id=None):
+        '''True while source_id (any source when None) is being reopened.'''
+        stats = self.stats()
+        source_ids = stats if source_id is None else [source_id]
+        return any(stats[sid]['reconnecting'] for sid in source_ids)
+
+    def stats(self):
+        return {src.source_id: {
+                    'decoded': src.decoded,
+                    'delivered': src.delivered,
+                    'dropped': src.dropped,
+                    'reconnects': src.health.reconnects,
+                    'reconnecting': src.health.reconnecting,
+                    'stalled': src.health.stalled(),
+                } for src in self.sources}
+
+    def stop(self):
+        self.state = 'stop'
+        with self._cond:
+            self._cond.notify_all()
+        for worker in self._workers:
+            worker.join(timeout=1)
+        self._workers = []
+
+    def __del__(self):
+        self.stop()
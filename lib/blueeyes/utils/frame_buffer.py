@@ -0,0 +1,146 @@
+'''
+Ring buffer of preallocated frame slots shared between a decoder thread and
+its consumers. The decoder writes straight into a free slot (cv2.VideoCapture.read(image=...)),
+consumers borrow READY slots without copying and give them back with release().
+A live stream overwrites the oldest unread frame when the consumer falls behind, a video file
+acquires with overwrite=False so the decoder waits for a free slot and no frame is lost.
+'''
+import time
+import numpy as np
+from threading import Condition
+
+FREE, WRITING, READY, BORROWED = range(4)
+
+class FrameSlot:
+    __slots__ = ('index', 'seq', 'timestamp', 'frame')
+    def __init__(self, index, seq, timestamp, frame):
+        self.index = index
+        self.seq = seq
+        self.timestamp = timestamp
+        self.frame = frame
+
+class FrameRingBuffer:
+    def __init__(self, capacity=3, shape=None, dtype=np.uint8):
+        if capacity < 2:
+            raise ValueError('FrameRingBuffer needs at least 2 slots')
+        self.capacity = capacity
+        self.dtype = dtype
+        self.shape = None
+        self._images = [None] * capacity
+        self._state = [FREE] * capacity
+        self._slots = [None] * capacity
+        self._cond = Condition()
+        self._next_seq = 0
+        # counters
+        self.written = 0
+        self.delivered = 0
+        self.dropped = 0    # READY frames overwritten before any consumer saw them
+        self.overrun = 0    # decoded frames thrown away because every slot was busy
+        if shape is not None:
+            self.allocate(shape)
+
+    def allocate(self, shape):
+        '''
+        (Re)allocate the slot images, e.g. on the first frame or when the stream resolution changes.
+        Borrowed frames keep a reference to their old image so they stay valid.
+        '''
+        with self._cond:
+            self.shape = tuple(shape)
+            self._images = [np.empty(self.shape, dtype=self.dtype) for _ in range(self.capacity)]
+
+    def acquire(self, overwrite=True, timeout=None):
+        '''
+        Reserve a slot for the decoder. Returns (index, image) where image may be None when
+        the buffer is not allocated yet, or None when every slot is borrowed/being written.
+        With overwrite=False the oldest READY frame is never reused: wait up to timeout for
+        a FREE slot and return None (not counted as overrun) when none was given back.
+        '''
+        with self._cond:
+            if not overwrite:
+                if not self._cond.wait_for(lambda: FREE in self._state, timeout):
+                    return None
+            index = None
+            if FREE in self._state:
+                index = self._state.index(FREE)
+            elif overwrite:
+                ready = [i for i, state in enumerate(self._state) if state == READY]
+                if ready:
+                    index = min(ready, key=lambda i: self._slots[i].seq)
+                    self.dropped += 1
+            if index is None:
+                self.overrun += 1
+                return None
+            self._state[index] = WRITING
+            self._slots[index] = None
+            return index, self._images[index]
+
+    def image(self, index):
+        return self._images[index]
+
+    def commit(self, index, timestamp=None, frame=None):
+        '''
+        Publish a written slot. frame is an optional view (e.g. a crop) of the slot image.
+        '''
+        if timestamp is None:
+            timestamp = time.time()
+        with self._cond:
+            if frame is None:
+                frame = self._images[index]
+            self._slots[index] = FrameSlot(index, self._next_seq, timestamp, frame)
+            self._next_seq += 1
+            self._state[index] = READY
+            self.written += 1
+            # the decoder may wait on the same condition for a FREE slot
+            self._cond.notify_all()
+
+    def abort(self, index):
+        with self._cond:
+            self._state[index] = FREE
+            self._slots[index] = None
+            self._cond.notify_all()
+
+    def borrow(self, timeout=None, latest=False):
+        '''
+        Take the oldest READY frame (or the newest one when latest=True, dropping the older ones)
+        without copying it. The slot must be given back with release().
+        Returns None on timeout.
+        '''
+        with self._cond:
+            if not self._cond.wait_for(lambda: READY in self._state, timeout):
+                return None
+            ready = sorted((i for i, state in enumerate(self._state) if state == READY),
+                           key=lambda i: self._slots[i].seq)
+            if latest:
+                for i in ready[:-1]:
+                    self._state[i] = FREE
+                    self._slots[i] = None
+                    self.dropped += 1
+                index = ready[-1]
+            else:
+                index = ready[0]
+            self._state[index] = BORROWED
+            self.delivered += 1
+            return self._slots[index]
+
+    def release(self, slot):
+        with self._cond:
+            if self._state[slot.index] == BORROWED and self._slots[slot.index] is slot:
+                self._state[slot.index] = FREE
+                self._slots[slot.index] = None
+                self._cond.notify_all()
+
+    def occupancy(self):
+        # fraction of the slots holding frames that nobody consumed yet
+        with self._cond:
+            return self._state.count(READY) / self.capacity
+
+    def stats(self):
+        with self._cond:
+            return {
+                'written': self.written,
+                'delivered': self.delivered,
+                'dropped': self.dropped,
+                'overrun': self.overrun,
+                'ready': self._state.count(READY),
+                'borrowed': self._state.count(BORROWED),
+            }
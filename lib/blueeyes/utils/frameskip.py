@@ -0,0 +1,97 @@
+'''
+Adaptive frame-skip controller driven by pipeline backpressure.
+The controller is fed the end-to-end latency of every processed frame (capture
+timestamp to end of processing) and the share of decoded frames the capture buffer
+dropped since the previous frame (see Camera.drop_rate), and steers the camera
+frameskip against a target latency.
+'''
+import math
+import logging
+
+logging.basicConfig(level=logging.DEBUG)
+
+class AdaptiveFrameSkip:
+    def __init__(self, target_latency=0.2, min_skip=1, max_skip=10, smoothing=0.3,
+                 hysteresis=0.2, max_drop_rate=0.5, cooldown=5, camera=None):
+        self.target_latency = target_latency
+        self.min_skip = min_skip
+        self.max_skip = max_skip
+        self.smoothing = smoothing
+        self.hysteresis = hysteresis
+        # above this share of decoded frames dropped before processing, the pipeline is overloaded
+        self.max_drop_rate = max_drop_rate
+        # number of frames to wait after a change so that its effect shows up in the latency
+        self.cooldown = cooldown
+        self.camera = camera
+        self.skip = min_skip
+        self.latency = 0.0
+        self.latency_ewma = None
+        self.drop_rate = 0.0
+        self.updates = 0
+        self.increases = 0
+        self.decreases = 0
+        self._since_change = 0
+        if camera is not None:
+            self.attach(camera)
+
+    def attach(self, camera):
+        self.camera = camera
+        self.skip = min(max(camera.frameskip, self.min_skip), self.max_skip)
+        camera.set('skip', self.skip)
+
+    def update(self, latency, drop_rate=0.0, num_faces=None):
+        '''
+        Feed the measurements of one processed frame and return the frameskip to use.
+        drop_rate: share of the frames decoded since the previous update that were dropped unprocessed.
+        num_faces, when given, lets the controller go back to every frame (after the cooldown) when the scene is empty.
+        '''
+        self.updates += 1
+        self._since_change += 1
+        self.latency = latency
+        self.drop_rate = drop_rate
+        if self.latency_ewma is None:
+            self.latency_ewma = latency
+        else:
+            self.latency_ewma += self.smoothing * (latency - self.latency_ewma)
+
+        overloaded = self.latency_ewma > self.target_latency * (1 + self.hysteresis) \
+            or drop_rate > self.max_drop_rate
+        underloaded = self.latency_ewma < self.target_latency * (1 - self.hysteresis) \
+            and drop_rate <= self.max_drop_rate
+
+        skip = self.skip
+        if self._since_change >= self.cooldown:
+            if num_faces == 0 and not overloaded:
+                skip = self.min_skip
+            elif overloaded:
+                # grow proportionally to how far we are above the target
+                skip = math.ceil(self.skip * max(self.latency_ewma / self.target_latency, 1.5))
+            elif underloaded:
+                skip = self.skip - 1
+        self._set_skip(min(max(skip, self.min_skip), self.max_skip))
+        return self.skip
+
+    def _set_skip(self, skip):
+        if skip == self.skip:
+            return
+        if skip > self.skip:
+            self.increases += 1
+        else:
+            self.decreases += 1
+        logging.debug(f'frameskip {self.skip} -> {skip} (latency {self.latency_ewma:.3f}s, drop rate {self.drop_rate:.2f})')
+        self.skip = skip
+        self._since_change = 0
+        if self.camera is not None:
+            self.camera.set('skip', skip)
+
+    def metrics(self):
+        return {
+            'skip': self.skip,
+            'latency': self.latency,
+            'latency_ewma': self.latency_ewma,
+            'target_latency': self.target_latency,
+            'drop_rate': self.drop_rate,
+            'updates': self.updates,
+            'increases': self.increases,
+            'decreases': self.decreases,
+        }
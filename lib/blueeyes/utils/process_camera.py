@@ -0,0 +1,382 @@
+'''
+Out-of-process capture backend for CameraPool.
+Each group of sources is decoded in its own process, straight into
+multiprocessing.shared_memory slots; only (source_id, slot, frame_index, capture_ts)
+metadata crosses the pipe. The main process keeps its cores and the GIL for detection.
+'''
+import os
+import cv2
+import time
+import logging
+import threading
+import numpy as np
+import multiprocessing
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
+
+from .camera import crop_frame
+from .camera_pool import CameraPool
+from .reconnect import StreamHealth
+
+logging.basicConfig(level=logging.DEBUG)
+
+HEALTH_INTERVAL = 1
+
+def _decode_group(sources, conn, slots, frameskip, stall_timeout=5, max_failures=25):
+    '''
+    Child process: decode every source of the group into its own set of shared memory slots.
+    The StreamHealth of every source is sent back every HEALTH_INTERVAL seconds.
+    '''
+    health = {sid: StreamHealth(source, stall_timeout=stall_timeout, max_failures=max_failures)
+              for sid, source in sources.items()}
+    caps = {sid: health[sid].open() for sid in sources}
+    # captures reopened in the background, swapped in by the decoding loop
+    next_caps = {}
+    is_video = {sid: isinstance(source, str) and os.path.exists(source) for sid, source in sources.items()}
+    skip = {sid: max(1, frameskip) for sid in sources}
+    frame_index = {sid: -1 for sid in sources}
+    # shared memory blocks of each source by generation, a generation is unlinked once the parent attached the next
+    blocks = {sid: {} for sid in sources}
+    retired = []
+    views = {sid: None for sid in sources}
+    free = {sid: [] for sid in sources}
+    generation = {sid: 0 for sid in sources}
+    for sid, cap in caps.items():
+        if not cap.isOpened():
+            conn.send(('error', sid, f'cannot open {sources[sid]}'))
+
+    def open_slots(sid, frame):
+        # (re)create the slots of a source from the shape of its frames
+        shms = [shared_memory.SharedMemory(create=True, size=frame.nbytes) for _ in range(slots)]
+        views[sid] = [np.ndarray(frame.shape, dtype=frame.dtype, buffer=shm.buf) for shm in shms]
+        free[sid] = list(range(slots))
+        generation[sid] += 1
+        blocks[sid][generation[sid]] = shms
+        conn.send(('open', sid, generation[sid], [shm.name for shm in shms], frame.shape, frame.dtype.str))
+
+    def retire(sid, gen):
+        # the parent attached generation gen: the older blocks are unlinked, their memory is freed
+        # once the parent and this process have closed them
+        for old in [g for g in blocks[sid] if g < gen]:
+            for shm in blocks[sid].pop(old):
+                shm.unlink()
+                retired.append(shm)
+        still_used = []
+        for shm in retired:
+            try:
+                shm.close()
+            except BufferError:
+                # a view of the previous resolution is still referenced, retried on the next switch
+                still_used.append(shm)
+        retired[:] = still_used
+
+    def reconnected(sid):
+        def hand_over(cap):
+            # reconnect thread: the decoding loop may still be inside grab() on the old capture
+            next_caps[sid] = cap
+        return hand_over
+
+    running = True
+    for sid in sources:
+        if not is_video[sid]:
+            # notices a stall even while the loop is still blocked in grab()
+            health[sid].watch(reconnected(sid), lambda: running)
+    last_health = 0
+    try:
+        while running:
+            # the pipe is only used from this thread, not from the reconnect threads
+            if time.time() - last_health > HEALTH_INTERVAL:
+                last_health = time.time()
+                for sid in sources:
+                    conn.send(('health', sid, health[sid].stats()))
+            # control messages from the main process
+            while conn.poll():
+                msg = conn.recv()
+                if msg[0] == 'release':
+                    _, sid, gen, slot = msg
+                    # slots of a previous resolution are never reused
+                    if gen == generation[sid]:
+                        free[sid].append(slot)
+                elif msg[0] == 'opened':
+                    _, sid, gen = msg
+                    retire(sid, gen)
+                elif msg[0] == 'skip':
+                    _, sid, value = msg
+                    skip[sid] = max(1, value)
+                elif msg[0] == 'stop':
+                    running = False
+            got_frame = False
+            for sid in sources:
+                if sid in next_caps:
+                    old, caps[sid] = caps[sid], next_caps.pop(sid)
+                    old.release()
+                if health[sid].reconnecting:
+                    continue
+                cap = caps[sid]
+                if not cap.grab():
+                    if is_video[sid]:
+                        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    elif health[sid].failure():
+                        health[sid].reconnect_async(reconnected(sid), lambda: running)
+                    continue
+                health[sid].frame()
+                got_frame = True
+                frame_index[sid] += 1
+                if frame_index[sid] % skip[sid] != 0:
+                    continue
+                if views[sid] is None:
+                    ret, frame = cap.retrieve()
+                    if not ret:
+                        continue
+                    open_slots(sid, frame)
+                if not free[sid]:
+                    # the consumer still holds every slot of this source
+                    continue
+                slot = free[sid].pop()
+                view = views[sid][slot]
+                ret, frame = cap.retrieve(image=view)
+                if not ret:
+                    free[sid].append(slot)
+                    continue
+                if frame.ctypes.data != view.ctypes.data:
+                    # stream changed resolution
+                    open_slots(sid, frame)
+                    slot = free[sid].pop()
+                    np.copyto(views[sid][slot], frame)
+                conn.send(('frame', sid, slot, frame_index[sid], time.time()))
+            if not got_frame:
+                time.sleep(0.01)
+    except (EOFError, BrokenPipeError, KeyboardInterrupt):
+        pass
+    finally:
+        for cap in list(caps.values()) + list(next_caps.values()):
+            cap.release()
+        views.clear()
+        for shm in retired:
+            shm.close()
+        for generations in blocks.values():
+            for shms in generations.values():
+                for shm in shms:
+                    shm.close()
+                    shm.unlink()
+
+class _RemoteSource:
+    def __init__(self, source_id, source, group, frameskip=1):
+        self.source_id = source_id
+        self.source = source
+        self.group = group
+        # mirrors the frameskip of the decoding process, see ProcessCameraPool.set
+        self.frameskip = max(1, frameskip)
+        # attached blocks by generation, and the ones of previous generations still to close
+        self.shms = {}
+        self.retired = []
+        self.views = None
+        self.shape = None
+        self.generation = 0
+        self.opened = False
+        self.error = None
+        # (frame_index, capture_ts, frame, slot) waiting for the consumer
+        self.pending = None
+        self.held = None
+        self.decoded = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.drop_marks = (0, 0)
+        # last StreamHealth.stats() sent by the decoding process
+        self.health = {}
+
+class ProcessCameraPool(CameraPool):
+    '''
+    Same interface as CameraPool, with decoding done in num_processes child processes.
+    A delivered frame lives in shared memory and stays valid until the next frame of the
+    same source is read; copy it to keep it longer.
+    The decoders are spawned by default: forking a process that already runs torch / CUDA
+    threads is unsafe. With 'spawn' the main script must be guarded by if __name__ == '__main__'.
+    '''
+    def __init__(self, sources, num_processes=None, slots=3, frameskip=1, crop=(0, 0, 0, 0), start_method='spawn',
+                 stall_timeout=5, max_failures=25, pyramid_scales=None):
+        if slots < 2:
+            raise ValueError('ProcessCameraPool needs at least 2 slots per source')
+        self.slots = slots
+        self.context = multiprocessing.get_context(start_method)
+        self._processes = []
+        self._conns = []
+        self._send_locks = []
+        super(ProcessCameraPool, self).__init__(sources, num_processes, frameskip, crop, stall_timeout, max_failures,
+                                                pyramid_scales)
+
+    def _make_source(self, index, source_id, source):
+        # sources are spread over the decoding processes, opened there
+        return _RemoteSource(source_id, source, index % self.num_workers, self.frameskip)
+
+    def start(self):
+        self.state = 'run'
+        for group in range(self.num_workers):
+            group_sources = {src.source_id: src.source for src in self.sources if src.group == group}
+            parent_conn, child_conn = self.context.Pipe()
+            process = self.context.Process(target=_decode_group,
+                                           args=(group_sources, child_conn, self.slots, self.frameskip,
+                                                 self.stall_timeout, self.max_failures),
+                                           daemon=True)
+            process.start()
+            child_conn.close()
+            self._processes.append(process)
+            self._conns.append(parent_conn)
+            self._send_locks.append(threading.Lock())
+        receiver = threading.Thread(target=self._receive, daemon=True)
+        receiver.start()
+        self._workers.append(receiver)
+        return self
+
+    def _send(self, group, msg):
+        try:
+            with self._send_locks[group]:
+                self._conns[group].send(msg)
+        except (BrokenPipeError, OSError):
+            pass
+
+    def _release_slot(self, src, slot):
+        if slot is not None:
+            self._send(src.group, ('release', src.source_id, src.generation, slot))
+
+    def _attach(self, src, generation, names, shape, dtype):
+        shms = []
+        for name in names:
+            shm = shared_memory.SharedMemory(name=name)
+            try:
+                # the child process owns the segments and unlinks them
+                from multiprocessing import resource_tracker
+                resource_tracker.unregister(shm._name, 'shared_memory')
+            except Exception:
+                pass
+            shms.append(shm)
+        # the previous resolution is closed once the consumer moved to a frame of this one
+        for old in list(src.shms):
+            src.retired.extend(src.shms.pop(old))
+        src.shms[generation] = shms
+        src.views = [np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf) for shm in shms]
+        src.shape = tuple(shape)
+        src.generation = generation
+        src.opened = True
+
+    def _receive(self):
+        conns = list(self._conns)
+        while self.state == 'run' and conns:
+            for conn in wait(conns, timeout=0.5):
+                try:
+                    msg = conn.recv()
+                except (EOFError, OSError):
+                    conns.remove(conn)
+                    continue
+                kind, sid = msg[0], msg[1]
+                src = self._by_id[sid]
+                if kind == 'open':
+                    with self._cond:
+                        self._attach(src, *msg[2:])
+                        src.pending = None
+                        src.held = None
+                    # the child may unlink the blocks of the previous generations
+                    self._send(src.group, ('opened', sid, msg[2]))
+                elif kind == 'health':
+                    src.health = msg[2]
+                elif kind == 'error':
+                    logging.debug(f'Camera {sid}: {msg[2]}')
+                    src.error = msg[2]
+                elif kind == 'frame':
+                    _, _, slot, frame_index, capture_ts = msg
+                    frame = src.views[slot]
+                    if any(self.crop):
+                        frame = crop_frame(frame, self.crop)
+                    with self._cond:
+                        src.decoded += 1
+                        if src.pending is not None:
+                            src.dropped += 1
+                            self._release_slot(src, src.pending[3])
+                        src.pending = (frame_index, capture_ts, frame, slot)
+                        self._cond.notify()
+
+    def _on_delivered(self, src, item):
+        # the previous frame of this source is no longer used by the consumer
+        self._release_slot(src, src.held)
+        src.held = item[3]
+        if src.retired:
+            self._close_retired(src)
+
+    def _close_retired(self, src):
+        still_used = []
+        for shm in src.retired:
+            try:
+                shm.close()
+            except BufferError:
+                # the consumer still references a frame of the previous resolution
+                still_used.append(shm)
+        src.retired = still_used
+
+    def stats(self):
+        return {src.source_id: {
+                    'decoded': src.decoded,
+                    'delivered': src.delivered,
+                    'dropped': src.dropped,
+                    'reconnects': src.health.get('reconnects', 0),
+                    'reconnecting': src.health.get('reconnecting', False),
+                    'stalled': src.health.get('stalled', False),
+                } for src in self.sources}
+
+    def isOpened(self):
+        return all(src.error is None for src in self.sources)
+
+    def wait_opened(self, timeout=10):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if all(src.opened or src.error for src in self.sources):
+                break
+            time.sleep(0.05)
+        return all(src.opened for src in self.sources)
+
+    def get(self, source_id, param):
+        src = self._find(source_id)
+        if src.shape is None:
+            return 0
+        if param == cv2.CAP_PROP_FRAME_WIDTH:
+            return crop_frame(src.views[0], self.crop).shape[1]
+        if param == cv2.CAP_PROP_FRAME_HEIGHT:
+            return crop_frame(src.views[0], self.crop).shape[0]
+        return 0
+
+    def set(self, source_id, parameter, value):
+        if parameter == 'skip':
+            src = self._find(source_id)
+            src.frameskip = max(1, value)
+            self._send(src.group, ('skip', source_id, value))
+
+    def stop(self):
+        if self.state != 'run':
+            return
+        self.state = 'stop'
+        with self._cond:
+            self._cond.notify_all()
+        for group in range(len(self._conns)):
+            self._send(group, ('stop',))
+        for process in self._processes:
+            process.join(timeout=2)
+            if process.is_alive():
+                process.terminate()
+        for worker in self._workers:
+            worker.join(timeout=1)
+        for src in self.sources:
+            src.views = None
+            src.pending = None
+            src.held = None
+            for shm in [shm for shms in src.shms.values() for shm in shms] + src.retired:
+                try:
+                    shm.close()
+                except BufferError:
+                    # a frame view is still referenced by the consumer
+                    pass
+            src.shms = {}
+            src.retired = []
+        for conn in self._conns:
+            conn.close()
+        self._processes = []
+        self._conns = []
+        self._workers = []
@@ -0,0 +1,76 @@
+'''
+Small multi-resolution pyramid built once per captured frame.
+Every level is tagged with its downscale factor relative to the full frame, so
+box coordinates can be mapped between levels instead of hand-written v*scale / v//2.
+Levels sharing a factor (e.g. detector and display both at 1/2) are resized only once.
+'''
+import cv2
+
+class FramePyramid:
+    def __init__(self, frame, scales=None, interpolation=cv2.INTER_LINEAR, seq=None, timestamp=None, release=None):
+        # scales: {level_name: downscale factor}, e.g. {'detector': 2, 'display': 2}
+        # release: gives the full frame back to its owner (a Camera ring buffer slot), see release()
+        self.scales = {'full': 1}
+        if scales:
+            self.scales.update(scales)
+        self.interpolation = interpolation
+        self.seq = seq
+        self.timestamp = timestamp
+        self._levels = {1: frame}
+        self._release = release
+
+    @property
+    def full(self):
+        return self._levels[1]
+
+    @property
+    def shape(self):
+        return self.full.shape
+
+    def __contains__(self, name):
+        return name in self.scales
+
+    def __getitem__(self, name):
+        return self.level(self.scales[name])
+
+    def scale(self, name):
+        return self.scales[name]
+
+    def level(self, factor):
+        # levels are resized lazily the first time a stage asks for them
+        if factor not in self._levels:
+            self._levels[factor] = cv2.resize(self.full, (0, 0), fx=1/factor, fy=1/factor, interpolation=self.interpolation)
+        return self._levels[factor]
+
+    def release(self):
+        '''
+        Hand a borrowed full frame back to the camera. The full level and the crops taken from it
+        must not be used afterwards (copy what is kept), the downscaled levels stay valid.
+        '''
+        if self._release is not None:
+            self._release()
+            self._release = None
+
+    def map_boxes(self, boxes, src='full', dst='full'):
+        ratio = self.scales[src] / self.scales[dst]
+        if ratio == 1:
+            return [tuple(box) for box in boxes]
+        return [tuple(int(v*ratio) for v in box) for box in boxes]
+
+    def roi(self, box, target_size=None):
+        '''
+        Crop a box given in full-frame coordinates. With target_size, the crop is taken from the
+        coarsest computed level whose crop still has its largest side >= target_size, which saves
+        the downscaling work of the later resize to target_size.
+        '''
+        x1, y1, x2, y2 = box
+        factor = 1
+        if target_size is not None:
+            side = max(x2 - x1, y2 - y1)
+            for f in sorted(self._levels):
+                if side / f >= target_size:
+                    factor = f
+        if factor == 1:
+            return self.full[y1:y2, x1:x2]
+        x1, y1, x2, y2 = [int(v / factor) for v in box]
+        return self._levels[factor][y1:y2, x1:x2]
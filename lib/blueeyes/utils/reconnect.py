@@ -0,0 +1,139 @@
+'''
+Stall detection and in-place reconnect of live streams.
+A stream is considered dead after max_failures consecutive failed reads or when
+no frame arrived for stall_timeout seconds; it is then reopened with exponential
+backoff while the models stay loaded and the other streams keep running.
+The watch() thread checks the age of the last frame on its own, so a read blocked
+inside FFmpeg is noticed without waiting for it to fail.
+'''
+import os
+import cv2
+import time
+import logging
+from threading import Thread, Lock
+
+logging.basicConfig(level=logging.DEBUG)
+
+FFMPEG_OPTIONS = 'OPENCV_FFMPEG_CAPTURE_OPTIONS'
+_env_lock = Lock()
+
+def open_capture(source, read_timeout=None):
+    '''
+    cv2.VideoCapture of a source. A network stream (rtsp://, http://, ...) gets an FFmpeg socket
+    timeout of read_timeout seconds so a hung read returns ret=False; the option is only set while
+    this capture is opened, files and other captures of the process keep the FFmpeg defaults.
+    '''
+    if not read_timeout or not (isinstance(source, str) and '://' in source):
+        return cv2.VideoCapture(source)
+    with _env_lock:
+        previous = os.environ.get(FFMPEG_OPTIONS)
+        os.environ[FFMPEG_OPTIONS] = f'stimeout;{int(read_timeout * 1e6)}'
+        try:
+            return cv2.VideoCapture(source)
+        finally:
+            if previous is None:
+                del os.environ[FFMPEG_OPTIONS]
+            else:
+                os.environ[FFMPEG_OPTIONS] = previous
+
+class StreamHealth:
+    def __init__(self, source, stall_timeout=5, max_failures=25, backoff_initial=0.5, backoff_max=30, read_timeout=5):
+        '''read_timeout: FFmpeg socket timeout (seconds) of the network streams opened by open(), None for the default'''
+        self.source = source
+        self.read_timeout = read_timeout
+        self.stall_timeout = stall_timeout
+        self.max_failures = max_failures
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.backoff = backoff_initial
+        self.last_frame = time.time()
+        self.failures = 0
+        self.reconnects = 0
+        self.reconnecting = False
+        self._lock = Lock()
+
+    def frame(self):
+        self.last_frame = time.time()
+        self.failures = 0
+
+    def failure(self):
+        '''Record a failed read, return True when the stream should be reopened.'''
+        self.failures += 1
+        return self.needs_reconnect()
+
+    def stalled(self):
+        return time.time() - self.last_frame > self.stall_timeout
+
+    def open(self):
+        return open_capture(self.source, self.read_timeout)
+
+    def needs_reconnect(self):
+        return not self.reconnecting and (self.failures >= self.max_failures or self.stalled())
+
+    def _sleep(self, delay, is_running):
+        end = time.time() + delay
+        while is_running() and time.time() < end:
+            time.sleep(min(0.1, end - time.time()))
+
+    def reconnect(self, is_running=lambda: True, on_connected=None):
+        '''
+        Reopen the source with exponential backoff. Returns the new capture, or None when stopped.
+        on_connected(cap) is called before reconnecting is cleared, so the readers that skip the
+        stream while reconnecting never touch the old capture while it is swapped and released.
+        '''
+        self.reconnecting = True
+        try:
+            while is_running():
+                logging.debug(f'Stream {self.source} stalled, reconnecting in {self.backoff:.1f}s')
+                self._sleep(self.backoff, is_running)
+                cap = self.open()
+                if cap.isOpened() and cap.grab():
+                    logging.debug(f'Stream {self.source} reconnected')
+                    self.backoff = self.backoff_initial
+                    self.reconnects += 1
+                    self.frame()
+                    if on_connected is not None:
+                        on_connected(cap)
+                    return cap
+                cap.release()
+                self.backoff = min(self.backoff * 2, self.backoff_max)
+            return None
+        finally:
+            self.reconnecting = False
+
+    def _claim(self):
+        # only one reconnect at a time, whether started by a failed read or by the watchdog
+        with self._lock:
+            if self.reconnecting:
+                return False
+            self.reconnecting = True
+            return True
+
+    def reconnect_async(self, on_connected, is_running=lambda: True):
+        '''Reconnect in a background thread and hand the new capture to on_connected(cap).'''
+        if not self._claim():
+            return
+        Thread(target=self.reconnect, args=(is_running, on_connected), daemon=True).start()
+
+    def watch(self, on_connected, is_running=lambda: True, interval=0.5):
+        '''
+        Watchdog thread: when no frame arrived for stall_timeout seconds, even if the reader is still
+        blocked in grab(), reconnect in the background and hand the new capture to on_connected(cap).
+        The reader must swap it in on its own thread, the old capture may still be inside grab().
+        '''
+        def _run():
+            while is_running():
+                if self.stalled() and self._claim():
+                    logging.debug(f'Stream {self.source}: no frame for {time.time() - self.last_frame:.1f}s')
+                    self.reconnect(is_running, on_connected)
+                time.sleep(interval)
+        Thread(target=_run, daemon=True).start()
+
+    def stats(self):
+        return {
+            'failures': self.failures,
+            'reconnects': self.reconnects,
+            'reconnecting': self.reconnecting,
+            'stalled': self.stalled(),
+            'last_frame': self.last_frame,
+        }
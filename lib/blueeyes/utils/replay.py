@@ -0,0 +1,123 @@
+'''
+Lossless, deterministic replay of a recorded clip with the Camera interface.
+Every frame is delivered exactly once (no looping, no drop), either as fast as
+the pipeline consumes them or paced at a fixed simulated fps, then read()
+reports the end of the clip.
+'''
+import cv2
+import time
+import queue
+import logging
+from threading import Thread
+
+from .camera import crop_frame
+from .pyramid import FramePyramid
+
+logging.basicConfig(level=logging.DEBUG)
+
+_EOF = None
+
+class ReplayCamera(Thread):
+    def __init__(self, source, fps=None, frameskip=1, crop=(0, 0, 0, 0), pyramid_scales=None, queue_size=8):
+        Thread.__init__(self, daemon=True)
+        self.cap = cv2.VideoCapture(source)
+        self.source = source
+        # fps: None replays as fast as the consumer allows, otherwise frames are paced at this rate
+        self.fps = fps
+        self.source_fps = self.cap.get(cv2.CAP_PROP_FPS) or 25
+        self.frameskip = max(1, frameskip)
+        self.crop = crop
+        self.pyramid_scales = pyramid_scales
+        # blocking puts on a bounded queue: the decoder waits for the pipeline instead of dropping
+        self.frame_queue = queue.Queue(maxsize=queue_size)
+        self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.delivered = 0
+        self.media_time = 0.0
+        self.eof = False
+        self.state = 'run'
+
+    def get(self, param):
+        # size of the cropped frames, like Camera.get
+        if param == cv2.CAP_PROP_FRAME_WIDTH:
+            width = self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)
+            return int((1 - self.crop[1]) * width) - int(self.crop[3] * width)
+        if param == cv2.CAP_PROP_FRAME_HEIGHT:
+            height = self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+            return int((1 - self.crop[2]) * height) - int(self.crop[0] * height)
+        return self.cap.get(param)
+
+    def set(self, parameter, value):
+        # frameskip is fixed for the whole replay so runs stay comparable
+        if parameter != 'skip':
+            self.cap.set(parameter, value)
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def clock(self):
+        '''Media time of the last delivered frame, usable as a deterministic clock.'''
+        return self.media_time
+
+    def run(self):
+        index = 0
+        emitted = 0
+        start = time.time()
+        while self.state == 'run':
+            if index % self.frameskip != 0:
+                if not self.cap.grab():
+                    break
+                index += 1
+                continue
+            ret, frame = self.cap.read()
+            if not ret:
+                break
+            if self.fps:
+                delay = start + emitted / self.fps - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            if any(self.crop):
+                frame = crop_frame(frame, self.crop)
+            self._put((index, index / self.source_fps, time.time(), frame))
+            emitted += 1
+            index += 1
+        self.cap.release()
+        self._put(_EOF)
+
+    def _put(self, item):
+        while self.state == 'run':
+            try:
+                self.frame_queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+
+    def _next(self):
+        if self.eof:
+            return None
+        item = self.frame_queue.get()
+        if item is _EOF:
+            self.eof = True
+            logging.debug(f'Replay of {self.source} finished after {self.delivered} frames')
+            return None
+        self.delivered += 1
+        self.media_time = item[1]
+        return item
+
+    def read(self):
+        item = self._next()
+        if item is None:
+            return (False, None)
+        return (True, item[3])
+
+    def read_pyramid(self):
+        item = self._next()
+        if item is None:
+            return (False, None)
+        index, _, capture_ts, frame = item
+        return (True, FramePyramid(frame, self.pyramid_scales, seq=index, timestamp=capture_ts))
+
+    def occupancy(self):
+        return self.frame_queue.qsize() / self.frame_queue.maxsize
+
+    def stop(self):
+        self.state = 'stop'
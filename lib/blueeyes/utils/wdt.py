@@ -3,14 +3,18 @@ import sys
 from threading import Thread
 from time import time, sleep
 class WDT:
-    def __init__(self, timeout=60):
+    def __init__(self, timeout=60, keepalive=None):
         self.timeout = timeout
+        # keepalive(): True while a slow but expected recovery (e.g. a stream reconnect) is in progress
+        self.keepalive = keepalive
         self.active = False
         self.thread = Thread(target=self._pooling)
         self.thread.start()
     def _pooling(self):
         while True:
             if self.active:
+                if self.keepalive is not None and self.keepalive():
+                    self.t = time()
                 if time() - self.t > self.timeout:
                     self.on_timeout()
                     break
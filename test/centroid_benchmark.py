@@ -0,0 +1,64 @@
+'''
+Query time of CentroidClassifier (one GEMM per batch of faces) against the per-face
+np.repeat + np.linalg.norm loop of the old _distance_recog, on galleries of 1k, 10k and 100k
+random 128-d identities.
+Usage: python centroid_benchmark.py [faces per frame] [frames]
+'''
+import sys
+import json
+import numpy as np
+from time import time
+sys.path.append('../lib')
+
+from blueeyes.face_recognition.recognition import CentroidClassifier
+
+FACES_PER_FRAME = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+NUM_FRAMES = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+GALLERY_SIZES = [1000, 10000, 100000]
+FEATURE_SIZE = 128
+
+def legacy_recog(model, classes, features):
+    result = []
+    for feature in features:
+        prepare_list = np.repeat([[feature]], len(model), axis=0)
+        result_list = np.linalg.norm(prepare_list - model, axis=2)
+        result.append(classes[np.argmin(result_list)])
+    return result
+
+rng = np.random.default_rng(0)
+results = []
+for size in GALLERY_SIZES:
+    # (identities, 1 sample, feature size) like the euclid model.dat
+    model = rng.normal(size=(size, 1, FEATURE_SIZE)).astype(np.float32)
+    classes = np.array([f'id{i}' for i in range(size)])
+    # queries close to random gallery entries
+    frames = [model[rng.integers(0, size, FACES_PER_FRAME), 0] + 0.1 * rng.normal(size=(FACES_PER_FRAME, FEATURE_SIZE)).astype(np.float32)
+              for _ in range(NUM_FRAMES)]
+
+    t = time()
+    classifier = CentroidClassifier(model, classes)
+    build_ms = 1000 * (time() - t)
+
+    t = time()
+    legacy = [legacy_recog(model, classes, features) for features in frames]
+    legacy_ms = 1000 * (time() - t) / NUM_FRAMES
+
+    t = time()
+    labels = [classifier.kneighbors(features, k=5)[0][:, 0] for features in frames]
+    gemm_ms = 1000 * (time() - t) / NUM_FRAMES
+
+    agreement = np.mean([a == b for frame_a, frame_b in zip(legacy, labels) for a, b in zip(frame_a, frame_b)])
+    result = {
+        'gallery': size,
+        'build_ms': build_ms,
+        'legacy_ms_per_frame': legacy_ms,
+        'gemm_ms_per_frame': gemm_ms,
+        'speedup': legacy_ms / gemm_ms,
+        'top1_agreement': float(agreement),
+    }
+    results.append(result)
+    print(f"gallery {size:>6}  legacy {legacy_ms:9.2f}ms/frame  gemm (top-5) {gemm_ms:8.2f}ms/frame  "
+          f"speedup {result['speedup']:7.1f}x  top-1 agreement {agreement:.3f}")
+
+with open('centroid_benchmark.json', 'w') as f:
+    json.dump({'faces_per_frame': FACES_PER_FRAME, 'frames': NUM_FRAMES, 'results': results}, f, indent=2)
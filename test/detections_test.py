@@ -0,0 +1,167 @@
+'''
+Deterministic checks of the columnar detection code on synthetic numpy data, no model needed:
+Detections indexing / masking / coordinate round-trips, box_iou on empty inputs, the pixel
+mapping of ROI.contains / ROI.restrict, and FaceFilter's integral image statistics against
+the per box cvtColor + cv2.mean / Laplacian they replace.
+Usage: python detections_test.py (or pytest detections_test.py)
+'''
+import sys
+import cv2
+import numpy as np
+sys.path.append('../lib')
+
+from blueeyes.face_detection import Detections, ROI, FaceFilter
+from blueeyes.face_detection.detections import box_iou
+
+BOXES = [(10, 20, 50, 70), (0, 0, 30, 30), (60, 10, 100, 40)]
+SCORES = [0.9, 0.5, 0.7]
+
+def make_landmarks(boxes, fractions):
+    boxes = np.float32(boxes)
+    return boxes[:, None, :2] + fractions * (boxes[:, None, 2:] - boxes[:, None, :2])
+
+FRACTIONS = np.float32([(0.3, 0.4), (0.7, 0.4), (0.5, 0.6), (0.35, 0.8), (0.65, 0.8)])
+LANDMARKS = make_landmarks(BOXES, FRACTIONS)
+
+def test_indexing():
+    d = Detections(BOXES, SCORES, LANDMARKS)
+    assert len(d) == 3
+    assert d[1] == (0, 0, 30, 30)
+    assert list(d) == BOXES
+    sub = d[1:]
+    assert isinstance(sub, Detections) and list(sub) == BOXES[1:]
+    assert np.allclose(sub.scores, SCORES[1:])
+    assert np.allclose(sub.landmarks, LANDMARKS[1:])
+    picked = d[np.array([2, 0])]
+    assert list(picked) == [BOXES[2], BOXES[0]]
+
+def test_masking():
+    d = Detections(BOXES, SCORES, LANDMARKS)
+    masked = d[d.scores > 0.6]
+    assert list(masked) == [BOXES[0], BOXES[2]]
+    assert np.allclose(masked.landmarks, LANDMARKS[[0, 2]])
+    empty = d[np.zeros(3, dtype=bool)]
+    assert len(empty) == 0 and empty.boxes.shape == (0, 4) and empty.landmarks.shape == (0, 5, 2)
+    # (wmin, hmin, wmax, hmax): box 0 is 40x50, box 1 30x30, box 2 40x30
+    assert d.in_size_ranges([(35, 25, 45, 55)]).tolist() == [True, False, True]
+    assert d.in_size_ranges([(0, 0, 30, 30), (40, 50, 40, 50)]).tolist() == [True, True, False]
+    assert Detections().boxes.shape == (0, 4)
+
+def test_scale_offset_clip():
+    d = Detections(BOXES, SCORES, LANDMARKS)
+    assert d.scale(1) is d
+    back = d.scale(2).scale(0.5)
+    assert np.array_equal(back.boxes, d.boxes)
+    assert np.allclose(back.landmarks, d.landmarks)
+    moved = d.offset(15, -5)
+    assert moved[0] == (25, 15, 65, 65)
+    back = moved.offset(-15, 5)
+    assert np.array_equal(back.boxes, d.boxes)
+    assert np.allclose(back.landmarks, d.landmarks)
+    clipped = Detections([(-5, -10, 120, 40), (10, 10, 20, 20)]).clip(100, 30)
+    assert list(clipped) == [(0, 0, 100, 30), (10, 10, 20, 20)]
+    # without a size only the negative coordinates are zeroed
+    assert list(Detections([(-5, -10, 120, 40)]).clip()) == [(0, 0, 120, 40)]
+
+def test_relative_landmarks():
+    d = Detections(BOXES, SCORES, LANDMARKS)
+    for relative in d.relative_landmarks():
+        assert np.allclose(relative, FRACTIONS, atol=1e-5)
+    # unchanged by scaling and moving the frame, as the recognizer's crops are
+    for relative in d.scale(2).offset(7, 3).relative_landmarks():
+        assert np.allclose(relative, FRACTIONS, atol=1e-5)
+    assert Detections(BOXES).relative_landmarks() == [None, None, None]
+
+def test_box_iou():
+    ious = box_iou(BOXES, BOXES)
+    assert ious.shape == (3, 3)
+    assert np.allclose(np.diag(ious), 1)
+    # boxes 0 and 1 share (10, 20)-(30, 30): 200 / (2000 + 900 - 200)
+    assert np.isclose(ious[0, 1], 200 / 2700)
+    assert ious[1, 2] == 0
+    assert box_iou([], BOXES).shape == (0, 3)
+    assert box_iou(BOXES, []).shape == (3, 0)
+    assert box_iou(np.empty((0, 4)), []).shape == (0, 0)
+
+def test_roi_restrict():
+    roi = ROI([(0.1, 0.2, 0.5, 1.0)])
+    # fractions of a 200x100 frame
+    assert roi.rects(200, 100) == [(20, 20, 100, 100)]
+    # the same ROI at half the resolution
+    assert roi.rects(100, 50) == [(10, 10, 50, 50)]
+    regions = [(0, 0, 60, 60), (150, 0, 200, 100), (90, 90, 200, 200)]
+    assert roi.restrict(regions, 200, 100) == [(20, 20, 60, 60), (90, 90, 100, 100)]
+    # shapes outside the frame are clipped to it
+    assert ROI([(-0.5, 0.5, 0.5, 2.0)]).rects(200, 100) == [(0, 50, 100, 100)]
+
+def test_roi_contains():
+    # lower left triangle of a 100x100 frame
+    roi = ROI([[(0, 0), (0, 1), (1, 1)]])
+    detections = Detections([(0, 60, 20, 80), (60, 0, 80, 20), (-40, 90, 40, 150)])
+    # centers (10, 70) inside, (70, 10) outside, (0, 120) clipped to the last row inside
+    assert roi.contains(detections, 100, 100).tolist() == [True, False, True]
+    # detections are in the coordinates of the frame size given, the mask follows it
+    assert roi.contains(detections.scale(2), 200, 200).tolist() == [True, False, True]
+    assert roi.contains(Detections(), 100, 100).shape == (0,)
+    rect = ROI([(0.5, 0, 1, 1)])
+    assert rect.contains(Detections([(40, 0, 58, 10), (40, 0, 62, 10)]), 100, 100).tolist() == [False, True]
+
+def make_frame():
+    rng = np.random.RandomState(0)
+    frame = rng.randint(0, 256, (120, 160, 3)).astype(np.uint8)
+    # smooth, dark and bright patches so the statistics differ between the boxes
+    frame[10:60, 10:70] = cv2.GaussianBlur(frame[10:60, 10:70].copy(), (9, 9), 3)
+    frame[70:110, 20:60] //= 4
+    frame[60:100, 100:150] = 255 - frame[60:100, 100:150] // 8
+    return frame
+
+FILTER_BOXES = [(10, 10, 70, 60), (20, 70, 60, 110), (100, 60, 150, 100), (5, 5, 40, 40)]
+
+def reference_brightness(frame, box):
+    x1, y1, x2, y2 = box
+    hsv = cv2.cvtColor(frame[y1:y2, x1:x2], cv2.COLOR_BGR2HSV)
+    return cv2.mean(hsv)[2]
+
+def reference_sharpness(frame, box):
+    x1, y1, x2, y2 = box
+    value = cv2.cvtColor(frame[y1:y2, x1:x2], cv2.COLOR_BGR2HSV)[..., 2]
+    return cv2.Laplacian(value, cv2.CV_32F).var()
+
+def test_filter_brightness():
+    frame = make_frame()
+    stats = FaceFilter(brightness_ranges=[(0, 256)]).stats(Detections(FILTER_BOXES), frame)
+    expected = [reference_brightness(frame, box) for box in FILTER_BOXES]
+    assert np.allclose(stats['brightness'], expected, atol=1e-3)
+    assert stats['width'].tolist() == [60, 40, 50, 35]
+    assert stats['height'].tolist() == [50, 40, 40, 35]
+
+def test_filter_sharpness():
+    frame = make_frame()
+    face_filter = FaceFilter(min_sharpness=0)
+    # a single box: the Laplacian map is computed on exactly its crop
+    for box in FILTER_BOXES:
+        stats = face_filter.stats(Detections([box]), frame)
+        assert np.isclose(stats['sharpness'][0], reference_sharpness(frame, box), rtol=1e-3)
+    # several boxes share the map of the area around them, the borders see the neighbouring pixels
+    stats = face_filter.stats(Detections(FILTER_BOXES), frame)
+    value = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)[..., 2]
+    x1, y1 = np.min(FILTER_BOXES, axis=0)[:2]
+    x2, y2 = np.max(FILTER_BOXES, axis=0)[2:]
+    laplacian = cv2.Laplacian(value[y1:y2, x1:x2], cv2.CV_32F)
+    expected = [laplacian[by1 - y1:by2 - y1, bx1 - x1:bx2 - x1].var() for bx1, by1, bx2, by2 in FILTER_BOXES]
+    assert np.allclose(stats['sharpness'], expected, rtol=1e-3)
+
+def test_filter_mask():
+    frame = make_frame()
+    detections = Detections(FILTER_BOXES + [(200, 200, 220, 220)])
+    brightness = [reference_brightness(frame, box) for box in FILTER_BOXES]
+    face_filter = FaceFilter(brightness_ranges=[(min(brightness) + 1, 256)], min_size=36)
+    # the dark box and the one too small are rejected, the box outside the frame is clipped to nothing
+    assert face_filter(detections, frame).tolist() == [True, False, True, False, False]
+
+if __name__ == '__main__':
+    tests = [(name, f) for name, f in sorted(globals().items()) if name.startswith('test_')]
+    for name, test in tests:
+        test()
+        print(f'{name} ok')
+    print(f'{len(tests)} tests passed')
@@ -0,0 +1,53 @@
+'''
+dlib feature extraction throughput (faces/s) of the serial FeatureExtractor against
+ParallelFeatureExtractor thread and process pools with 1 .. cpu_count workers.
+Usage: python extraction_benchmark.py <folder of face crops> [faces per call] [calls]
+'''
+import os
+import sys
+import cv2
+import json
+import numpy as np
+from time import time
+sys.path.append('../lib')
+
+from blueeyes.face_recognition.recognition import FeatureExtractor, ParallelFeatureExtractor
+
+FOLDER = sys.argv[1]
+FACES_PER_CALL = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+NUM_CALLS = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+
+crops = [cv2.imread(os.path.join(FOLDER, name)) for name in sorted(os.listdir(FOLDER))]
+crops = [crop for crop in crops if crop is not None]
+if not crops:
+    print(f'no face crop in {FOLDER}')
+    sys.exit(-1)
+# the same faces per call as a crowded frame
+batches = [[crops[(i * FACES_PER_CALL + j) % len(crops)] for j in range(FACES_PER_CALL)] for i in range(NUM_CALLS)]
+
+def run(extractor):
+    extractor.feed(batches[0])
+    t = time()
+    features = [extractor.feed(batch) for batch in batches]
+    return features, NUM_CALLS * FACES_PER_CALL / (time() - t)
+
+reference, serial_rate = run(FeatureExtractor(model_type='dlib'))
+print(f"{'serial':<8} {1:>2} workers {serial_rate:8.1f} faces/s")
+results = [{'pool': 'serial', 'workers': 1, 'faces_per_s': serial_rate, 'speedup': 1.0}]
+workers = sorted({1, 2, 4, os.cpu_count()} & set(range(1, os.cpu_count() + 1)))
+for pool in ('thread', 'process'):
+    for num_workers in workers:
+        extractor = ParallelFeatureExtractor('dlib', num_workers, pool)
+        features, rate = run(extractor)
+        extractor.close()
+        # the parallel features must come back in the same order as the serial ones
+        max_diff = max(float(np.abs(np.array(a) - np.array(b)).max())
+                       for batch_a, batch_b in zip(reference, features) for a, b in zip(batch_a, batch_b))
+        results.append({'pool': pool, 'workers': num_workers, 'faces_per_s': rate,
+                        'speedup': rate / serial_rate, 'max_feature_diff': max_diff})
+        print(f"{pool:<8} {num_workers:>2} workers {rate:8.1f} faces/s  speedup {rate / serial_rate:5.2f}x  "
+              f"max feature diff {max_diff:.2e}")
+
+with open('extraction_benchmark.json', 'w') as f:
+    json.dump({'folder': FOLDER, 'faces_per_call': FACES_PER_CALL, 'calls': NUM_CALLS,
+               'cpu_count': os.cpu_count(), 'results': results}, f, indent=2)
@@ -0,0 +1,60 @@
+'''
+CPU throughput of the FaceBoxes detector at several input scales.
+Usage: python faceboxes_cpu_benchmark.py <video or image> [num_threads] [frames]
+'''
+import os
+import sys
+import cv2
+import json
+from time import time
+sys.path.append('../lib')
+
+from blueeyes.face_detection import FaceDetector
+
+SOURCE = sys.argv[1]
+NUM_THREADS = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+NUM_FRAMES = int(sys.argv[3]) if len(sys.argv) > 3 else 100
+SCALES = [1, 1.5, 2, 3, 4]
+
+# decode the frames once so only the detector is measured
+frames = []
+cap = cv2.VideoCapture(SOURCE)
+while len(frames) < NUM_FRAMES:
+    ret, frame = cap.read()
+    if not ret:
+        break
+    frames.append(frame)
+cap.release()
+if not frames:
+    print(f'cannot read frames from {SOURCE}')
+    sys.exit(-1)
+
+results = []
+for scale in SCALES:
+    detector = FaceDetector('faceboxes', scale=scale, threshold=0.5, device='cpu', num_threads=NUM_THREADS, input_bucket=32)
+    # warm up (allocator, anchors of the input size)
+    detector.detect(frames[0])
+    times = []
+    n_faces = 0
+    for frame in frames:
+        t = time()
+        boxes = detector.detect(frame)
+        times.append(time() - t)
+        n_faces += len(boxes)
+    height, width = frames[0].shape[:2]
+    times.sort()
+    result = {
+        'scale': scale,
+        'input_size': (int(width/scale), int(height/scale)),
+        'frames': len(times),
+        'fps': len(times) / sum(times),
+        'mean_ms': 1000 * sum(times) / len(times),
+        'p95_ms': 1000 * times[int(0.95 * (len(times) - 1))],
+        'faces': n_faces,
+    }
+    results.append(result)
+    print(f"scale {scale:<4} input {result['input_size'][0]}x{result['input_size'][1]:<5} "
+          f"{result['fps']:7.2f} frames/s  mean {result['mean_ms']:7.2f}ms  p95 {result['p95_ms']:7.2f}ms  {n_faces} faces")
+
+with open('faceboxes_cpu_benchmark.json', 'w') as f:
+    json.dump({'source': SOURCE, 'num_threads': NUM_THREADS, 'results': results}, f, indent=2)
@@ -0,0 +1,71 @@
+'''
+Drift of the dlib face descriptors when the MTCNN landmarks of the detector replace dlib's
+shape_predictor: distance between the two descriptors of every detected face, for the nose tip
+used as is (nose base 0) and for the nose base estimated towards the mouth (NOSE_BASE).
+dlib treats descriptors closer than 0.6 as the same person, the drift should stay well below it.
+Usage: python landmark_benchmark.py <video or folder of images> [frames] [min face size]
+'''
+import os
+import sys
+import cv2
+import json
+import numpy as np
+sys.path.append('../lib')
+
+from blueeyes.face_detection import FaceDetector
+from blueeyes.face_recognition import recognition
+from blueeyes.face_recognition.recognition import FeatureExtractor
+
+SOURCE = sys.argv[1]
+NUM_FRAMES = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+MIN_FACE_SIZE = int(sys.argv[3]) if len(sys.argv) > 3 else 60
+SAME_PERSON = 0.6
+NOSE_BASES = [0, 0.2, recognition.NOSE_BASE, 0.5]
+
+frames = []
+if os.path.isdir(SOURCE):
+    for name in sorted(os.listdir(SOURCE))[:NUM_FRAMES]:
+        frame = cv2.imread(os.path.join(SOURCE, name))
+        if frame is not None:
+            frames.append(frame)
+else:
+    cap = cv2.VideoCapture(SOURCE)
+    while len(frames) < NUM_FRAMES:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+
+detector = FaceDetector('mtcnn_torch', min_face_size=MIN_FACE_SIZE)
+crops, landmarks = [], []
+for frame in frames:
+    detections = detector.detect(frame)
+    crops.extend(detections.crops())
+    landmarks.extend(detections.relative_landmarks())
+if not crops:
+    print(f'no face with landmarks in {SOURCE}')
+    sys.exit(-1)
+
+extractor = FeatureExtractor(model_type='dlib')
+reference = np.array([np.array(f) for f in extractor.feed(crops)])
+results = []
+default = recognition.NOSE_BASE
+for nose_base in NOSE_BASES:
+    recognition.NOSE_BASE = nose_base
+    features = np.array([np.array(f) for f in extractor.feed(crops, landmarks)])
+    distances = np.linalg.norm(features - reference, axis=1)
+    result = {
+        'nose_base': nose_base,
+        'mean': float(distances.mean()),
+        'p95': float(np.percentile(distances, 95)),
+        'max': float(distances.max()),
+        'same_person_rate': float(np.mean(distances < SAME_PERSON)),
+    }
+    results.append(result)
+    print(f"nose base {nose_base:.2f}  descriptor distance mean {result['mean']:.4f}  p95 {result['p95']:.4f}  "
+          f"max {result['max']:.4f}  < {SAME_PERSON} for {100 * result['same_person_rate']:.1f}% of {len(crops)} faces")
+recognition.NOSE_BASE = default
+
+with open('landmark_benchmark.json', 'w') as f:
+    json.dump({'source': SOURCE, 'faces': len(crops), 'default_nose_base': default, 'results': results}, f, indent=2)
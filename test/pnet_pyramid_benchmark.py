@@ -0,0 +1,65 @@
+'''
+MTCNN stage one: packed single-pass P-Net pyramid against the per-scale loop.
+Usage: python pnet_pyramid_benchmark.py <video or image> [device] [frames]
+'''
+import sys
+import cv2
+import json
+import torch
+from time import time
+sys.path.append('../lib/blueeyes/face_recognition')
+
+import mtcnn_torch
+
+SOURCE = sys.argv[1]
+DEVICE = sys.argv[2] if len(sys.argv) > 2 else ('cuda:0' if torch.cuda.is_available() else 'cpu')
+NUM_FRAMES = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+THRESHOLD, FACTOR, MINSIZE, NMS_THRESHOLD = 0.6, 0.7, 20, 0.7
+
+frames = []
+cap = cv2.VideoCapture(SOURCE)
+while len(frames) < NUM_FRAMES:
+    ret, frame = cap.read()
+    if not ret:
+        break
+    frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+cap.release()
+if not frames:
+    print(f'cannot read frames from {SOURCE}')
+    sys.exit(-1)
+
+pnet, rnet, onet = mtcnn_torch.get_net_caffe('mtcnn_torch/model')
+detector = mtcnn_torch.FaceDetector(pnet, rnet, onet, device=DEVICE)
+
+def sync():
+    if detector.device.type == 'cuda':
+        torch.cuda.synchronize()
+
+results = {}
+for packed in (False, True):
+    name = 'packed' if packed else 'per_scale'
+    img = detector._preprocess(frames[0])
+    detector.stage_one(img, THRESHOLD, FACTOR, MINSIZE, NMS_THRESHOLD, packed)
+    times = []
+    candidates = 0
+    for frame in frames:
+        img = detector._preprocess(frame)
+        sync()
+        t = time()
+        boxes = detector.stage_one(img, THRESHOLD, FACTOR, MINSIZE, NMS_THRESHOLD, packed)
+        sync()
+        times.append(time() - t)
+        candidates += boxes.shape[0]
+    times.sort()
+    results[name] = {
+        'frames': len(times),
+        'mean_ms': 1000 * sum(times) / len(times),
+        'p95_ms': 1000 * times[int(0.95 * (len(times) - 1))],
+        'candidates': candidates,
+    }
+    print(f"{name:<10} mean {results[name]['mean_ms']:7.2f}ms  p95 {results[name]['p95_ms']:7.2f}ms  "
+          f"{candidates} stage one candidates")
+
+print(f"speedup {results['per_scale']['mean_ms'] / results['packed']['mean_ms']:.2f}x")
+with open('pnet_pyramid_benchmark.json', 'w') as f:
+    json.dump({'source': SOURCE, 'device': DEVICE, 'frame_size': frames[0].shape[:2], 'results': results}, f, indent=2)
@@ -0,0 +1,76 @@
+'''
+int8 against float32 CPU detectors: accuracy regression (recall / precision of the int8 boxes
+matched to the float boxes by IoU) and throughput.
+Usage: python quantization_benchmark.py <video or image folder> <calibration video or image folder> [num_threads] [frames]
+'''
+import os
+import sys
+import json
+from time import time
+sys.path.append('../lib')
+
+from blueeyes.face_detection import FaceDetector
+from blueeyes.face_detection.quantization import calibration_frames, compare_detections
+
+SOURCE = sys.argv[1]
+CALIBRATION = sys.argv[2]
+NUM_THREADS = int(sys.argv[3]) if len(sys.argv) > 3 else os.cpu_count()
+NUM_FRAMES = int(sys.argv[4]) if len(sys.argv) > 4 else 100
+IOU_THRESHOLD = 0.5
+CONFIGS = {
+    'faceboxes': {'scale': 2, 'threshold': 0.5, 'input_bucket': 32, 'num_threads': NUM_THREADS},
+    'mtcnn_torch': {'scale': 2, 'min_face_size': 40},
+}
+MODES = ['static', 'dynamic']
+
+frames = calibration_frames(SOURCE, NUM_FRAMES)
+
+def run(detector):
+    detector.detect(frames[0])
+    times = []
+    results = []
+    for frame in frames:
+        t = time()
+        results.append(detector.detect(frame))
+        times.append(time() - t)
+    times.sort()
+    return results, {
+        'fps': len(times) / sum(times),
+        'mean_ms': 1000 * sum(times) / len(times),
+        'p95_ms': 1000 * times[int(0.95 * (len(times) - 1))],
+    }
+
+report = []
+for detector_type, kwargs in CONFIGS.items():
+    reference, float_timing = run(FaceDetector(detector_type, device='cpu', **kwargs))
+    print(f"{detector_type:<12} float32  {float_timing['fps']:7.2f} frames/s  mean {float_timing['mean_ms']:7.2f}ms")
+    for mode in MODES:
+        detector = FaceDetector(detector_type, quantize=mode, calibration=CALIBRATION, **kwargs)
+        candidate, timing = run(detector)
+        matched = reference_count = candidate_count = 0
+        ious = []
+        for ref, cand in zip(reference, candidate):
+            result = compare_detections(ref, cand, IOU_THRESHOLD)
+            matched += result['matched']
+            reference_count += result['reference']
+            candidate_count += result['candidate']
+            ious += result['ious']
+        entry = {
+            'detector': detector_type,
+            'mode': mode,
+            'frames': len(frames),
+            'recall': matched / reference_count if reference_count else 1.0,
+            'precision': matched / candidate_count if candidate_count else 1.0,
+            'mean_iou': sum(ious) / len(ious) if ious else None,
+            'float32': float_timing,
+            'int8': timing,
+            'speedup': timing['fps'] / float_timing['fps'],
+        }
+        report.append(entry)
+        print(f"{detector_type:<12} {mode:<8} {timing['fps']:7.2f} frames/s  mean {timing['mean_ms']:7.2f}ms  "
+              f"speedup {entry['speedup']:4.2f}x  recall {entry['recall']:.3f}  precision {entry['precision']:.3f}  "
+              f"mean IoU {entry['mean_iou'] or 0:.3f}")
+
+with open('quantization_benchmark.json', 'w') as f:
+    json.dump({'source': SOURCE, 'calibration': CALIBRATION, 'num_threads': NUM_THREADS,
+               'iou_threshold': IOU_THRESHOLD, 'results': report}, f, indent=2)
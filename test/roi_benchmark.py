@@ -0,0 +1,70 @@
+'''
+FaceBoxes detection time with the network restricted to a ROI, against the full frame.
+The saving should follow the fraction of the frame the ROI covers.
+Usage: python roi_benchmark.py <video or image> [device] [frames]
+'''
+import sys
+import cv2
+import json
+from time import time
+sys.path.append('../lib')
+
+from blueeyes.face_detection import FaceDetector, ROI
+
+SOURCE = sys.argv[1]
+DEVICE = sys.argv[2] if len(sys.argv) > 2 else None
+NUM_FRAMES = int(sys.argv[3]) if len(sys.argv) > 3 else 100
+SCALE = 2
+ROIS = {
+    'full_frame': None,
+    'tracking_band': [(0.2, 0, 0.9, 1)],
+    'center_half': [(0.25, 0.25, 0.75, 0.75)],
+    'two_doors': [(0, 0.2, 0.3, 1), (0.7, 0.2, 1, 1)],
+    'polygon': [[(0.2, 0), (0.8, 0), (1, 1), (0, 1)]],
+}
+
+frames = []
+cap = cv2.VideoCapture(SOURCE)
+while len(frames) < NUM_FRAMES:
+    ret, frame = cap.read()
+    if not ret:
+        break
+    frames.append(frame)
+cap.release()
+if not frames:
+    print(f'cannot read frames from {SOURCE}')
+    sys.exit(-1)
+
+detector = FaceDetector('faceboxes', scale=SCALE, threshold=0.5, device=DEVICE, input_bucket=32)
+height, width = frames[0].shape[:2]
+results = []
+for name, shapes in ROIS.items():
+    roi = ROI(shapes) if shapes else None
+    coverage = roi.coverage(width // SCALE, height // SCALE) if roi else 1.0
+    # warm up (allocator, anchors of the input size)
+    detector.detect(frames[0], roi=roi)
+    times = []
+    n_faces = 0
+    for frame in frames:
+        t = time()
+        detections = detector.detect(frame, roi=roi)
+        times.append(time() - t)
+        n_faces += len(detections)
+    times.sort()
+    results.append({
+        'roi': name,
+        'coverage': float(coverage),
+        'frames': len(times),
+        'mean_ms': 1000 * sum(times) / len(times),
+        'p95_ms': 1000 * times[int(0.95 * (len(times) - 1))],
+        'faces': n_faces,
+    })
+
+full_ms = results[0]['mean_ms']
+for result in results:
+    result['relative_time'] = result['mean_ms'] / full_ms
+    print(f"{result['roi']:<14} coverage {result['coverage']:5.2f}  mean {result['mean_ms']:7.2f}ms  "
+          f"p95 {result['p95_ms']:7.2f}ms  relative time {result['relative_time']:5.2f}  {result['faces']} faces")
+
+with open('roi_benchmark.json', 'w') as f:
+    json.dump({'source': SOURCE, 'frame_size': (width, height), 'scale': SCALE, 'results': results}, f, indent=2)
@@ -0,0 +1,70 @@
+'''
+Per-frame detection latency of the exported graphs (frozen TorchScript, ONNX Runtime) against eager PyTorch.
+Export the models first: python -m blueeyes.face_detection.export {faceboxes,mtcnn_torch} --format {torchscript,onnx}
+Usage: python runtime_benchmark.py <video or image> [device] [frames]
+'''
+import sys
+import cv2
+import json
+import statistics
+from time import time
+sys.path.append('../lib')
+
+from blueeyes.face_detection import FaceDetector
+
+SOURCE = sys.argv[1]
+DEVICE = sys.argv[2] if len(sys.argv) > 2 else 'cpu'
+NUM_FRAMES = int(sys.argv[3]) if len(sys.argv) > 3 else 100
+CONFIGS = {
+    'faceboxes': {'scale': 2, 'threshold': 0.5, 'input_bucket': 32},
+    'mtcnn_torch': {'scale': 2, 'min_face_size': 40},
+}
+RUNTIMES = ['eager', 'torchscript', 'onnx']
+
+frames = []
+cap = cv2.VideoCapture(SOURCE)
+while len(frames) < NUM_FRAMES:
+    ret, frame = cap.read()
+    if not ret:
+        break
+    frames.append(frame)
+cap.release()
+if not frames:
+    print(f'cannot read frames from {SOURCE}')
+    sys.exit(-1)
+
+results = []
+for detector_type, kwargs in CONFIGS.items():
+    for runtime in RUNTIMES:
+        try:
+            detector = FaceDetector(detector_type, device=DEVICE, runtime=runtime, **kwargs)
+        except (NameError, ImportError, RuntimeError) as e:
+            print(f'{detector_type:<12} {runtime:<12} skipped ({type(e).__name__}: {e})')
+            continue
+        # warm up (allocator, TorchScript profiling runs, anchors of the input size)
+        for frame in frames[:3]:
+            detector.detect(frame)
+        times = []
+        n_faces = 0
+        for frame in frames:
+            t = time()
+            n_faces += len(detector.detect(frame))
+            times.append(1000 * (time() - t))
+        times.sort()
+        result = {
+            'detector': detector_type,
+            'runtime': runtime,
+            'frames': len(times),
+            'mean_ms': statistics.mean(times),
+            'std_ms': statistics.pstdev(times),
+            'p50_ms': times[len(times) // 2],
+            'p95_ms': times[int(0.95 * (len(times) - 1))],
+            'p99_ms': times[int(0.99 * (len(times) - 1))],
+            'faces': n_faces,
+        }
+        results.append(result)
+        print(f"{detector_type:<12} {runtime:<12} mean {result['mean_ms']:7.2f}ms  std {result['std_ms']:6.2f}ms  "
+              f"p50 {result['p50_ms']:7.2f}ms  p95 {result['p95_ms']:7.2f}ms  p99 {result['p99_ms']:7.2f}ms  {n_faces} faces")
+
+with open('runtime_benchmark.json', 'w') as f:
+    json.dump({'source': SOURCE, 'device': DEVICE, 'results': results}, f, indent=2)
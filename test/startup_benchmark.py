@@ -0,0 +1,85 @@
+'''
+Cold start cost of each detector / feature extractor / classifier configuration:
+import time, model loading time, time-to-first-frame and peak resident memory.
+Every configuration runs in a fresh interpreter so nothing is already imported.
+Usage: python startup_benchmark.py <video or image> [svm model path]
+'''
+import os
+import sys
+import json
+import resource
+import subprocess
+from time import time
+
+CONFIGS = [
+    {'detector': 'faceboxes', 'detector_kwargs': {'threshold': 0.3, 'scale': 2, 'device': 'cpu'}, 'extractor': None, 'classifier': None},
+    {'detector': 'haar', 'detector_kwargs': {}, 'extractor': None, 'classifier': None},
+    {'detector': 'faceboxes', 'detector_kwargs': {'threshold': 0.3, 'scale': 2}, 'extractor': 'dlib', 'classifier': 'svm'},
+    {'detector': 'mtcnn', 'detector_kwargs': {'min_face_size': 70, 'scale': 2}, 'extractor': 'dlib', 'classifier': 'svm'},
+]
+
+def run_child(source, config, model_path):
+    '''Runs in the fresh interpreter: load one configuration and process the first frame.'''
+    t0 = time()
+    sys.path.append('../lib')
+    import cv2
+    from blueeyes.face_detection import FaceDetector
+    timings = {'import_blueeyes': time() - t0}
+
+    t = time()
+    kwargs = dict(config['detector_kwargs'])
+    scale = kwargs.pop('scale', 1)
+    detector = FaceDetector(config['detector'], scale=scale, **kwargs)
+    recog = None
+    if config['extractor']:
+        from blueeyes.face_recognition import FaceRecognition, face_roi
+        recog = FaceRecognition(feature_extractor_type=config['extractor'],
+                                classifier_method=config['classifier'], model_path=model_path)
+    timings['load_models'] = time() - t
+
+    t = time()
+    cap = cv2.VideoCapture(source)
+    ret, frame = cap.read()
+    if not ret:
+        print(f'cannot read {source}')
+        sys.exit(-1)
+    boxes = detector.detect(frame)
+    if recog is not None and boxes:
+        face_imgs = [face_roi(frame, tuple(map(int, box))) for box in boxes]
+        recog.extract_feature(face_imgs)
+    timings['first_frame'] = time() - t
+    timings['time_to_first_frame'] = time() - t0
+    # ru_maxrss is in KB on linux
+    timings['max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    timings['modules'] = len(sys.modules)
+    print(json.dumps(timings))
+
+if __name__ == '__main__':
+    if sys.argv[1] == '--child':
+        run_child(sys.argv[2], json.loads(sys.argv[3]), sys.argv[4] or None)
+        sys.exit(0)
+
+    SOURCE = sys.argv[1]
+    MODEL_PATH = sys.argv[2] if len(sys.argv) > 2 else ''
+    results = []
+    for config in CONFIGS:
+        if config['classifier'] and not MODEL_PATH:
+            continue
+        name = '+'.join(v for v in (config['detector'], config['extractor'], config['classifier']) if v)
+        t = time()
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', SOURCE, json.dumps(config), MODEL_PATH],
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+        wall = time() - t
+        lines = proc.stdout.strip().splitlines()
+        if proc.returncode != 0 or not lines:
+            print(f'{name:<28} failed (exit code {proc.returncode})')
+            continue
+        timings = json.loads(lines[-1])
+        timings['process_wall'] = wall
+        results.append({'config': name, **timings})
+        print(f"{name:<28} import {timings['import_blueeyes']:6.2f}s  load {timings['load_models']:6.2f}s  "
+              f"first frame {timings['first_frame']:6.2f}s  ttff {timings['time_to_first_frame']:6.2f}s  "
+              f"rss {timings['max_rss_mb']:7.1f}MB")
+
+    with open('startup_benchmark.json', 'w') as f:
+        json.dump(results, f, indent=2)